@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 from pathlib import Path
 import os, datetime
+from celery.schedules import crontab
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -192,6 +193,8 @@ META_REDIRECT_URI = os.getenv('META_REDIRECT_URI')
 TIKTOK_APP_ID = os.getenv('TIKTOK_APP_ID')
 TIKTOK_APP_SECRET = os.getenv('TIKTOK_APP_SECRET')
 TIKTOK_REDIRECT_URI = os.getenv('TIKTOK_REDIRECT_URI')
+# Business API host for synced integrations; point at https://sandbox-ads.tiktok.com/open_api/v1.3 for sandbox apps
+TIKTOK_API_BASE_URL = os.getenv('TIKTOK_API_BASE_URL', 'https://business-api.tiktok.com/open_api/v1.3')
 
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
@@ -199,6 +202,40 @@ GOOGLE_REDIRECT_URI = os.getenv('GOOGLE_REDIRECT_URI')
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# LLM backends by alias (see main.llm_backends): BACKEND is openai, openai_compatible or stub.
+# `bulk` serves batch and queued copy generation.
+LLM_BACKENDS = {
+    'default': {
+        'BACKEND': os.getenv('LLM_BACKEND', 'openai'),
+        'MODEL': os.getenv('LLM_MODEL', 'gpt-4o'),
+        'BASE_URL': os.getenv('LLM_BASE_URL') or None,
+        'API_KEY': os.getenv('LLM_API_KEY') or None,
+        'TIMEOUT': float(os.getenv('LLM_TIMEOUT', 60)),
+        'MAX_RETRIES': int(os.getenv('LLM_MAX_RETRIES', 2)),
+        'MAX_CONCURRENCY': int(os.getenv('LLM_MAX_CONCURRENCY', 16)),
+        'LATENCY': float(os.getenv('LLM_STUB_LATENCY', 0)),  # stub only
+    },
+    'bulk': {
+        'BACKEND': os.getenv('LLM_BULK_BACKEND', 'openai'),
+        'MODEL': os.getenv('LLM_BULK_MODEL', 'gpt-4o-mini'),
+        'BASE_URL': os.getenv('LLM_BULK_BASE_URL') or None,
+        'API_KEY': os.getenv('LLM_BULK_API_KEY') or None,
+        'TIMEOUT': float(os.getenv('LLM_BULK_TIMEOUT', 30)),
+        'MAX_RETRIES': int(os.getenv('LLM_BULK_MAX_RETRIES', 2)),
+        'MAX_CONCURRENCY': int(os.getenv('LLM_BULK_MAX_CONCURRENCY', 8)),
+        'LATENCY': float(os.getenv('LLM_BULK_STUB_LATENCY', 0)),  # stub only
+    },
+}
+
+# AI copy: completions cached per normalized prompt, batch generation limits
+AI_COPY_CACHE_TTL = int(os.getenv('AI_COPY_CACHE_TTL', 60 * 60 * 24))
+AI_COPY_CACHE_MAX_ENTRIES = int(os.getenv('AI_COPY_CACHE_MAX_ENTRIES', 10000))
+AI_COPY_BATCH_MAX_ITEMS = int(os.getenv('AI_COPY_BATCH_MAX_ITEMS', 50))
+AI_COPY_BATCH_CONCURRENCY = int(os.getenv('AI_COPY_BATCH_CONCURRENCY', 8))
+
+# Nightly insight engine: one LLM summary per organization on top of the computed findings
+AI_INSIGHTS_LLM_SUMMARY = os.getenv('AI_INSIGHTS_LLM_SUMMARY', 'False') == 'True'
+
 # CORS Configuration
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
@@ -275,3 +312,49 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+ANALYTICS_SYNC_TICK_MINUTES = int(os.getenv('ANALYTICS_SYNC_TICK_MINUTES', 5))
+CELERY_BEAT_SCHEDULE = {
+    'schedule-analytics-syncs': {
+        'task': 'analysis.tasks.schedule_analytics_syncs_task',
+        'schedule': crontab(minute=f'*/{ANALYTICS_SYNC_TICK_MINUTES}'),
+    },
+    'compact-analytics': {
+        'task': 'analysis.tasks.compact_analytics_task',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'generate-insights': {
+        'task': 'analysis.tasks.generate_insights_task',
+        'schedule': crontab(hour=4, minute=0),
+    },
+}
+
+# Analytics sync: max concurrent integrations per platform for one worker
+ANALYTICS_SYNC_CONCURRENCY = {
+    'TIKTOK': int(os.getenv('TIKTOK_SYNC_CONCURRENCY', 10)),
+    'META': int(os.getenv('META_SYNC_CONCURRENCY', 10)),
+    'GOOGLE': int(os.getenv('GOOGLE_SYNC_CONCURRENCY', 5)),
+}
+
+# Analytics retention: days kept at daily granularity before compaction into monthly rows (0 disables)
+ANALYTICS_DAILY_RETENTION_DAYS = int(os.getenv('ANALYTICS_DAILY_RETENTION_DAYS', 400))
+
+# Incremental sync: days back each platform restates, and how often that window is refetched
+ANALYTICS_ATTRIBUTION_WINDOW_DAYS = {
+    'TIKTOK': int(os.getenv('TIKTOK_ATTRIBUTION_WINDOW_DAYS', 7)),
+    'META': int(os.getenv('META_ATTRIBUTION_WINDOW_DAYS', 28)),
+    'GOOGLE': int(os.getenv('GOOGLE_ATTRIBUTION_WINDOW_DAYS', 30)),
+}
+ANALYTICS_ATTRIBUTION_REFRESH_HOURS = int(os.getenv('ANALYTICS_ATTRIBUTION_REFRESH_HOURS', 24))
+
+# Shared token buckets for platform API calls (per platform, and per app id)
+ANALYTICS_RATE_LIMIT_REDIS_URL = f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', '6379')}/1"
+ANALYTICS_RATE_LIMITS = {
+    'TIKTOK': {'qps': float(os.getenv('TIKTOK_SYNC_QPS', 10)), 'burst': int(os.getenv('TIKTOK_SYNC_BURST', 20))},
+    'META': {'qps': float(os.getenv('META_SYNC_QPS', 5)), 'burst': int(os.getenv('META_SYNC_BURST', 10))},
+    'GOOGLE': {'qps': float(os.getenv('GOOGLE_SYNC_QPS', 5)), 'burst': int(os.getenv('GOOGLE_SYNC_BURST', 10))},
+}
+ANALYTICS_APP_RATE_LIMITS = {
+    'TIKTOK': {'qps': float(os.getenv('TIKTOK_APP_QPS', 10)), 'burst': int(os.getenv('TIKTOK_APP_BURST', 20))},
+    'META': {'qps': float(os.getenv('META_APP_QPS', 5)), 'burst': int(os.getenv('META_APP_BURST', 10))},
+    'GOOGLE': {'qps': float(os.getenv('GOOGLE_APP_QPS', 5)), 'burst': int(os.getenv('GOOGLE_APP_BURST', 10))},
+}
@@ -36,3 +36,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 'type': 'notification',
                 'data': event['data']
             }))
+
+    async def send_ai_copy_result(self, event):
+            await self.send(text_data=json.dumps({
+                'type': 'ai_copy_result',
+                'data': event['data']
+            }))
@@ -1,5 +1,5 @@
 from rest_framework.permissions import BasePermission
-from main.models import OrganizationMember, Organization
+from main.utils.org_context import get_org_context
 
 class IsRegularPlatformUser(BasePermission):
     """
@@ -25,18 +25,8 @@ class IsOrganizationMember(BasePermission):
     """
 
     def has_permission(self, request, view):
-        user = request.user
-        org_id = request.query_params.get("org_id")
-
-        if not org_id:
-            return False
-
-        try:
-            organization = Organization.objects.get(snowflake_id=org_id)
-        except Organization.DoesNotExist:
-            return False
-
-        return OrganizationMember.objects.filter(user=user, organization=organization).exists()    
+        context = get_org_context(request)
+        return bool(context and context.is_member)
 
 class IsAdminOrOwnerOfOrganization(BasePermission):
     """
@@ -44,19 +34,5 @@ class IsAdminOrOwnerOfOrganization(BasePermission):
     """
 
     def has_permission(self, request, view):
-        user = request.user
-        org_id = request.query_params.get("org_id")
-
-        if not org_id:
-            return False
-
-        try:
-            organization = Organization.objects.get(snowflake_id=org_id)
-        except Organization.DoesNotExist:
-            return False
-
-        return OrganizationMember.objects.filter(
-            user=user,
-            organization=organization,
-            role__in=['ADMIN', 'OWNER']
-        ).exists()
+        context = get_org_context(request)
+        return bool(context and context.has_role('ADMIN', 'OWNER'))
@@ -5,6 +5,8 @@ from accounts.models import User
 from main.models import Platform, UnifiedCampaign, PlatformCampaign
 from rest_framework.permissions import IsAdminUser
 from main.serializers import CampaignSerializer
+from main.mixins import CampaignMetricsMixin
+from main.utils.helper import with_campaign_metrics
 from rest_framework.pagination import PageNumberPagination
 from .serializers import UserAdminViewSerializer
 from django.db.models import Q
@@ -79,12 +81,14 @@ class CampaignListPagination(PageNumberPagination):
 	page_size = 10
 
 
-class CampaignListAPIView(generics.ListAPIView):
+class CampaignListAPIView(CampaignMetricsMixin, generics.ListAPIView):
 	serializer_class = CampaignSerializer
 	permission_classes = [permissions.IsAdminUser]
-	queryset = UnifiedCampaign.objects.all()
 	pagination_class = CampaignListPagination
 
+	def get_queryset(self):
+		return with_campaign_metrics(UnifiedCampaign.objects.all()).order_by('-created_at')
+
 class UserListPagination(PageNumberPagination):
 	max_page_size = 100
 	page_size = 10
@@ -1,4 +1,25 @@
 from django.contrib import admin
-from .models import AnalysisDaily
+from .models import AnalysisDaily, AnalysisDailyDevice, AnalysisRollup, AnalyticsBackfill, IntegrationSyncState
 
 admin.site.register(AnalysisDaily)
+
+@admin.register(AnalysisDailyDevice)
+class AnalysisDailyDeviceAdmin(admin.ModelAdmin):
+    list_display = ('daily', 'device', 'platform', 'date', 'spend_minor', 'impressions', 'clicks')
+    list_filter = ('platform', 'device')
+    raw_id_fields = ('daily',)
+
+@admin.register(AnalyticsBackfill)
+class AnalyticsBackfillAdmin(admin.ModelAdmin):
+    list_display = ('integration', 'start_date', 'end_date', 'window_days', 'status', 'updated_at')
+    list_filter = ('status',)
+
+@admin.register(AnalysisRollup)
+class AnalysisRollupAdmin(admin.ModelAdmin):
+    list_display = ('organization', 'platform', 'period', 'date', 'spend_minor', 'impressions', 'clicks', 'conversions', 'row_count', 'updated_at')
+    list_filter = ('period', 'platform')
+
+@admin.register(IntegrationSyncState)
+class IntegrationSyncStateAdmin(admin.ModelAdmin):
+    list_display = ('integration', 'last_synced_date', 'attribution_refreshed_at', 'last_success_at', 'updated_at')
+    raw_id_fields = ('integration',)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AnalysisConfig(AppConfig):
     name = 'analysis'
+
+    def ready(self) -> None:
+        import analysis.signals
@@ -0,0 +1,282 @@
+"""
+Nightly AI insight engine.
+
+Loads the last `BASELINE_DAYS + RECENT_DAYS` days of campaign level
+AnalysisDaily rows of every organization in one query and compares each
+campaign's recent days against its baseline with vectorized pandas/NumPy
+arithmetic:
+
+- spend spikes: the evaluated day's spend against the baseline daily mean
+  and standard deviation (days without a row count as zero spend);
+- CTR drops and ROAS regressions: the ratio over the recent days against
+  the ratio over the baseline, both from summed integer facts.
+
+Findings are scored by how far the metric moved, weighted by the money at
+stake, and the best `INSIGHTS_PER_ORGANIZATION` of each organization are
+written as AIInsight rows, replacing those of an earlier run for the same
+day. The LLM is never called per finding: with AI_INSIGHTS_LLM_SUMMARY on,
+each organization gets one summary of its findings from the `bulk` backend.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import AIInsight, PlatformCampaign
+from main.utils.dashboard_cache import invalidate_dashboard_on_commit
+
+from .metrics import from_minor
+from .models import AnalysisDaily
+
+logger = logging.getLogger(__name__)
+
+BASELINE_DAYS = 14
+RECENT_DAYS = 3
+INSIGHTS_PER_ORGANIZATION = 10
+
+MIN_SPEND_MINOR = 1000  # ignore campaigns spending less than 10.00 in a window
+MIN_IMPRESSIONS = 1000
+SPEND_SPIKE_RATIO = 1.5
+SPEND_SPIKE_Z = 3.0
+CTR_DROP = -0.3
+ROAS_DROP = -0.25
+
+KEYS = ['organization_id', 'platform', 'campaign_id']
+FACT_FIELDS = ['impressions', 'clicks', 'spend_minor', 'conversion_value_minor']
+
+
+def load_frame(end_date, organization_ids=None):
+    """Campaign level DAY rows of the baseline and recent windows ending on `end_date`."""
+    start_date = end_date - timedelta(days=BASELINE_DAYS + RECENT_DAYS - 1)
+    rows = AnalysisDaily.objects.filter(
+        date__gte=start_date,
+        date__lte=end_date,
+        granularity=AnalysisDaily.Granularity.DAY,
+        adgroup_id="",
+    )
+    if organization_ids is not None:
+        rows = rows.filter(organization_id__in=organization_ids)
+
+    columns = [*KEYS, 'campaign_name', 'date', *FACT_FIELDS]
+    return pd.DataFrame.from_records(rows.values_list(*columns).iterator(chunk_size=10000), columns=columns)
+
+
+def _ratio(numerator, denominator):
+    numerator = numerator.to_numpy(dtype='float64')
+    denominator = denominator.to_numpy(dtype='float64')
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def campaign_stats(frame, end_date):
+    """One row per campaign with its baseline, recent and evaluated day facts and derived ratios."""
+    recent_start = end_date - timedelta(days=RECENT_DAYS - 1)
+    frame = frame.assign(
+        recent=frame['date'] >= recent_start,
+        spend_sq=frame['spend_minor'].astype('float64') ** 2,
+    )
+
+    baseline = frame[~frame['recent']].groupby(KEYS)[[*FACT_FIELDS, 'spend_sq']].sum().add_prefix('base_')
+    recent = frame[frame['recent']].groupby(KEYS)[FACT_FIELDS].sum().add_prefix('recent_')
+    today = frame[frame['date'] == end_date].groupby(KEYS)['spend_minor'].sum().rename('today_spend_minor')
+    names = frame.sort_values('date').groupby(KEYS)['campaign_name'].last()
+
+    stats = baseline.join([recent, today], how='outer').fillna(0).join(names).reset_index()
+
+    mean = stats['base_spend_minor'].to_numpy(dtype='float64') / BASELINE_DAYS
+    variance = stats['base_spend_sq'].to_numpy() / BASELINE_DAYS - mean ** 2
+    stats['spend_mean_minor'] = mean
+    stats['spend_std_minor'] = np.sqrt(np.clip(variance, 0, None))
+    stats['base_ctr'] = _ratio(stats['base_clicks'], stats['base_impressions']) * 100
+    stats['recent_ctr'] = _ratio(stats['recent_clicks'], stats['recent_impressions']) * 100
+    stats['base_roas'] = _ratio(stats['base_conversion_value_minor'], stats['base_spend_minor'])
+    stats['recent_roas'] = _ratio(stats['recent_conversion_value_minor'], stats['recent_spend_minor'])
+    return stats
+
+
+def detect(stats):
+    """
+    Flags spend spikes, CTR drops and ROAS regressions in `campaign_stats`
+    output. Returns one row per finding with `kind`, `change` (relative)
+    and `score`.
+    """
+    def column(name):
+        return stats[name].to_numpy(dtype='float64')
+
+    today, mean = column('today_spend_minor'), column('spend_mean_minor')
+    # Floor the deviation so a perfectly flat baseline doesn't make every change infinite
+    deviation = np.maximum(column('spend_std_minor'), np.maximum(mean * 0.1, 1))
+    spend_ratio = _ratio(stats['today_spend_minor'], stats['spend_mean_minor'])
+    ctr_change = _ratio(stats['recent_ctr'], stats['base_ctr']) - 1
+    roas_change = _ratio(stats['recent_roas'], stats['base_roas']) - 1
+
+    checks = [
+        (
+            AIInsight.Kind.SPEND_SPIKE,
+            (mean > 0) & (today >= MIN_SPEND_MINOR) & (spend_ratio >= SPEND_SPIKE_RATIO) & ((today - mean) / deviation >= SPEND_SPIKE_Z),
+            spend_ratio - 1,
+            today - mean,
+        ),
+        (
+            AIInsight.Kind.CTR_DROP,
+            (column('base_impressions') >= MIN_IMPRESSIONS) & (column('recent_impressions') >= MIN_IMPRESSIONS) & (ctr_change <= CTR_DROP),
+            ctr_change,
+            column('recent_spend_minor'),
+        ),
+        (
+            AIInsight.Kind.ROAS_DROP,
+            (column('base_spend_minor') >= MIN_SPEND_MINOR) & (column('recent_spend_minor') >= MIN_SPEND_MINOR)
+            & (column('base_roas') > 0) & (roas_change <= ROAS_DROP),
+            roas_change,
+            column('recent_spend_minor'),
+        ),
+    ]
+
+    findings = []
+    for kind, mask, change, stake_minor in checks:
+        findings.append(stats[mask].assign(
+            kind=kind.value,
+            change=change[mask],
+            score=np.abs(change[mask]) * np.log1p(stake_minor[mask] / 100),
+        ))
+
+    findings = pd.concat(findings, ignore_index=True)
+    findings['impact'] = np.select(
+        [findings['change'].abs() >= 0.6, findings['change'].abs() >= 0.35],
+        ['HIGH', 'MEDIUM'],
+        default='LOW',
+    )
+    return findings
+
+
+def rank(findings, limit=INSIGHTS_PER_ORGANIZATION):
+    return findings.sort_values('score', ascending=False).groupby('organization_id').head(limit)
+
+
+def describe(finding, end_date):
+    name = finding['campaign_name'] or finding['campaign_id']
+    platform = finding['platform'].title()
+    kind = finding['kind']
+    if kind == AIInsight.Kind.SPEND_SPIKE:
+        return (
+            f"Spend spike on {name}",
+            f"{platform} spend on {end_date:%b %d} was {from_minor(finding['today_spend_minor']):,.2f}, "
+            f"{finding['change'] + 1:.1f}x the {BASELINE_DAYS}-day daily average of {from_minor(finding['spend_mean_minor']):,.2f}.",
+        )
+    if kind == AIInsight.Kind.CTR_DROP:
+        return (
+            f"CTR drop on {name}",
+            f"{platform} CTR over the last {RECENT_DAYS} days fell to {finding['recent_ctr']:.2f}% "
+            f"from {finding['base_ctr']:.2f}% over the previous {BASELINE_DAYS} days ({finding['change']:+.0%}).",
+        )
+    return (
+        f"ROAS regression on {name}",
+        f"{platform} ROAS over the last {RECENT_DAYS} days is {finding['recent_roas']:.2f} "
+        f"against {finding['base_roas']:.2f} over the previous {BASELINE_DAYS} days ({finding['change']:+.0%}).",
+    )
+
+
+def _unified_campaigns(organization_ids):
+    return {
+        (org_id, platform, str(campaign_id)): unified_id
+        for org_id, platform, campaign_id, unified_id in PlatformCampaign.objects.filter(
+            integration__organization_id__in=organization_ids,
+            platform_campaign_id__isnull=False,
+        ).values_list('integration__organization_id', 'integration__platform', 'platform_campaign_id', 'unified_campaign_id')
+    }
+
+
+def summarize(insights):
+    """One LLM summary of an organization's findings, or None if it fails."""
+    from main.ai_services import complete_json
+
+    findings = "\n".join(f"- [{insight.impect}] {insight.title}: {insight.description}" for insight in insights)
+    messages = [
+        {"role": "system", "content": (
+            "You are a performance marketing analyst. Summarise the findings for the account owner in 2-3 "
+            "plain sentences and name the single most important action. "
+            'Return ONLY a valid JSON object: { "summary": "..." }'
+        )},
+        {"role": "user", "content": f"Findings:\n{findings}"},
+    ]
+    try:
+        return complete_json(messages, temperature=0.3, backend='bulk').get("summary")
+    except Exception:
+        logger.exception("Insight summary failed for organization %s", insights[0].organization_id)
+        return None
+
+
+def write_insights(ranked, end_date, organization_ids, summaries=False):
+    """
+    Replaces the engine insights of `end_date` for every evaluated
+    organization with `ranked`. Returns the number of rows written.
+    """
+    campaigns = _unified_campaigns(organization_ids)
+    by_org = {org_id: [] for org_id in organization_ids}
+    for finding in ranked.to_dict('records'):
+        # NumPy scalars out of the frame, plain Python values into the ORM
+        org_id = int(finding['organization_id'])
+        title, description = describe(finding, end_date)
+        by_org[org_id].append(AIInsight(
+            organization_id=org_id,
+            campaign_id=campaigns.get((org_id, finding['platform'], str(finding['campaign_id']))),
+            title=title[:255],
+            description=description,
+            impect=str(finding['impact']),
+            kind=finding['kind'],
+            platform=finding['platform'],
+            platform_campaign_id=finding['campaign_id'] or "",
+            date=end_date,
+            score=float(finding['score']),
+        ))
+
+    if summaries:
+        pending = {org_id: insights for org_id, insights in by_org.items() if insights}
+        with ThreadPoolExecutor(max_workers=getattr(settings, 'AI_COPY_BATCH_CONCURRENCY', 8)) as executor:
+            texts = dict(zip(pending, executor.map(summarize, pending.values())))
+        for org_id, text in texts.items():
+            if text:
+                by_org[org_id].append(AIInsight(
+                    organization_id=org_id,
+                    title=f"Performance summary for {end_date:%b %d}",
+                    description=text,
+                    impect=max((insight.impect for insight in by_org[org_id]), key=['LOW', 'MEDIUM', 'HIGH'].index),
+                    kind=AIInsight.Kind.SUMMARY,
+                    date=end_date,
+                    # Ranked above the findings it summarises
+                    score=max(insight.score for insight in by_org[org_id]) + 1,
+                ))
+
+    written = 0
+    for org_id, insights in by_org.items():
+        with transaction.atomic():
+            AIInsight.objects.filter(organization_id=org_id, date=end_date).exclude(kind=AIInsight.Kind.MANUAL).delete()
+            AIInsight.objects.bulk_create(insights)
+            # bulk_create skips the post_save dashboard invalidation
+            invalidate_dashboard_on_commit(org_id)
+        written += len(insights)
+    return written
+
+
+def generate_insights(end_date=None, organization_ids=None, summaries=None):
+    """
+    Runs the engine for `end_date` (defaults to yesterday, the last full
+    day) over every organization with data, or only `organization_ids`.
+    Returns `{"organizations": int, "insights": int}`.
+    """
+    end_date = end_date or timezone.now().date() - timedelta(days=1)
+    if summaries is None:
+        summaries = getattr(settings, 'AI_INSIGHTS_LLM_SUMMARY', False)
+
+    frame = load_frame(end_date, organization_ids)
+    if frame.empty:
+        return {"organizations": 0, "insights": 0}
+
+    evaluated = sorted(frame['organization_id'].unique().tolist())
+    ranked = rank(detect(campaign_stats(frame, end_date)))
+    written = write_insights(ranked, end_date, evaluated, summaries=summaries)
+    return {"organizations": len(evaluated), "insights": written}
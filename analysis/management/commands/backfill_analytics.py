@@ -0,0 +1,46 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from main.models import AdIntegration
+from analysis.tasks import BACKFILL_DAYS, backfill_analytics_task, create_backfill
+from analysis.sync import run_backfill
+
+
+class Command(BaseCommand):
+    help = 'Backfill AnalysisDaily history for the integrations of an organization (resumes unfinished backfills)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--org', required=True, help='Organization snowflake id')
+        parser.add_argument('--platform', help='Only backfill this platform (META, GOOGLE, TIKTOK)')
+        parser.add_argument('--days', type=int, default=BACKFILL_DAYS, help='Days of history ending today')
+        parser.add_argument('--start', help='Start date YYYY-MM-DD (overrides --days)')
+        parser.add_argument('--end', help='End date YYYY-MM-DD (defaults to today)')
+        parser.add_argument('--async', action='store_true', dest='use_celery', help='Enqueue on Celery instead of running inline')
+
+    def handle(self, *args, **options):
+        try:
+            start_date = datetime.strptime(options['start'], '%Y-%m-%d').date() if options['start'] else None
+            end_date = datetime.strptime(options['end'], '%Y-%m-%d').date() if options['end'] else None
+        except ValueError:
+            raise CommandError('Dates must use the YYYY-MM-DD format')
+
+        integrations = AdIntegration.objects.filter(
+            organization__snowflake_id=options['org'],
+            is_active=True,
+        ).select_related('organization')
+        if options['platform']:
+            integrations = integrations.filter(platform=options['platform'].upper())
+        if not integrations.exists():
+            raise CommandError('No active integrations found')
+
+        for integration in integrations:
+            backfill = create_backfill(integration, start_date=start_date, end_date=end_date, days=options['days'])
+            if options['use_celery']:
+                backfill_analytics_task.delay(backfill.id)
+                self.stdout.write(f"Queued backfill {backfill.id} for {integration}")
+                continue
+
+            self.stdout.write(f"Backfilling {integration} {backfill.start_date} - {backfill.end_date} "
+                              f"({len(backfill.completed_windows)} window(s) already done)")
+            run_backfill(backfill)
+            style = self.style.SUCCESS if backfill.status == backfill.Status.COMPLETED else self.style.ERROR
+            self.stdout.write(style(f"Backfill {backfill.id}: {backfill.status}"))
@@ -0,0 +1,43 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from main.models import Organization
+from analysis.retention import compact_month, pending_months, retention_cutoff
+
+
+class Command(BaseCommand):
+    help = 'Compact AnalysisDaily days past the retention horizon into monthly rows, one organization month per transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--org', help='Only compact this organization (snowflake id)')
+        parser.add_argument('--before', help='Compact whole months before this date YYYY-MM-DD (defaults to the retention cutoff)')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the months that would be compacted')
+
+    def handle(self, *args, **options):
+        organization_id = None
+        if options['org']:
+            organization = Organization.objects.filter(snowflake_id=options['org']).first()
+            if not organization:
+                raise CommandError('Organization not found')
+            organization_id = organization.id
+
+        try:
+            before = datetime.strptime(options['before'], '%Y-%m-%d').date() if options['before'] else retention_cutoff()
+        except ValueError:
+            raise CommandError('Dates must use the YYYY-MM-DD format')
+        if before is None:
+            raise CommandError('Retention is disabled (ANALYTICS_DAILY_RETENTION_DAYS=0), pass --before')
+
+        months = pending_months(organization_id, before)
+        self.stdout.write(f"{len(months)} organization month(s) to compact before {before}")
+
+        rows = 0
+        for org_id, month in months:
+            if options['dry_run']:
+                self.stdout.write(f"  organization {org_id} {month:%Y-%m}")
+                continue
+            removed = compact_month(org_id, month)
+            rows += removed
+            self.stdout.write(f"  organization {org_id} {month:%Y-%m}: {removed} day row(s) compacted")
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Compacted {rows} day row(s) in {len(months)} month(s)"))
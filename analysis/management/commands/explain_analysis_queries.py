@@ -0,0 +1,145 @@
+import math
+import random
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from accounts.models import User
+from main.models import AdIntegration, Organization, Platform
+from analysis.models import AnalysisDaily, Report
+from analysis.report_writers import report_querysets
+from main.utils.helper import monthly_platform_totals
+
+SEED_DAYS = 730
+SEED_CHUNK_SIZE = 5000
+
+
+class RollbackSeed(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Print query plans and timings of the dashboard and report AnalysisDaily queries for an organization'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--org', help='Organization snowflake id')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Run against a throwaway organization seeded with this many synthetic AnalysisDaily rows; '
+                 'everything is rolled back afterwards',
+        )
+        parser.add_argument('--analyze', action='store_true', help='Use EXPLAIN ANALYZE (PostgreSQL only)')
+
+    def handle(self, *args, **options):
+        if options['analyze'] and connection.vendor != 'postgresql':
+            raise CommandError('--analyze is only supported on PostgreSQL')
+        if bool(options['org']) == bool(options['seed']):
+            raise CommandError('Pass either --org or --seed')
+
+        if not options['seed']:
+            organization = Organization.objects.filter(snowflake_id=options['org']).first()
+            if not organization:
+                raise CommandError('Organization not found')
+            self.explain(organization, options['analyze'])
+            return
+
+        # Seeded rows never outlive the run, so no real dashboard, rollup or report sees them
+        try:
+            with transaction.atomic():
+                organization = self.seed(options['seed'])
+                self.explain(organization, options['analyze'])
+                raise RollbackSeed
+        except RollbackSeed:
+            self.stdout.write(self.style.SUCCESS("Seeded rows rolled back"))
+
+    def explain(self, organization, analyze):
+        today = timezone.now().date()
+        report = Report(
+            organization=organization,
+            start_date=today - timedelta(days=365),
+            end_date=today,
+        )
+        all_rows, per_platform = report_querysets(report)
+        platform_values = [platform[0] for platform in Platform.choices]
+
+        queries = {
+            'dashboard (six months, grouped)': monthly_platform_totals(
+                AnalysisDaily.objects.filter(organization=organization, date__gte=today - timedelta(days=180)),
+                platform_values,
+            ),
+            'report rows (one year)': all_rows.values_list(),
+            **{
+                f'report rows {platform} (one year)': queryset.values_list()
+                for platform, queryset in per_platform.items()
+            },
+        }
+
+        self.stdout.write(f"Database: {connection.vendor}, rows for organization: {AnalysisDaily.objects.filter(organization=organization).count()}")
+        for label, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {label}"))
+            self.stdout.write(queryset.explain(analyze=True) if analyze else queryset.explain())
+
+            started = time.perf_counter()
+            rows = sum(1 for _ in queryset.iterator())
+            self.stdout.write(f"-> {rows} rows in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    def seed(self, count):
+        """
+        Creates a throwaway organization with an integration per platform and
+        `count` synthetic rows spread over platforms, campaigns and the last
+        two years. Returns the organization.
+        """
+        platforms = [platform[0] for platform in Platform.choices]
+        # Creating the user creates its organization
+        owner = User.objects.create(email=f"explain-{random.getrandbits(64):x}@example.invalid")
+        organization = owner.owned_organizations.get()
+        AdIntegration.objects.bulk_create(
+            AdIntegration(organization=organization, platform=platform, ad_account_id=f"bench-{platform}", access_token="")
+            for platform in platforms
+        )
+        campaigns = max(1, math.ceil(count / (len(platforms) * SEED_DAYS)))
+        today = timezone.now().date()
+
+        def rows():
+            produced = 0
+            for campaign in range(campaigns):
+                for platform in platforms:
+                    for day in range(SEED_DAYS):
+                        if produced >= count:
+                            return
+                        impressions = random.randint(100, 100000)
+                        clicks = random.randint(0, impressions // 10)
+                        spend_minor = random.randint(100, 50000)
+                        yield AnalysisDaily(
+                            organization=organization,
+                            platform=platform,
+                            account_id=f"bench-{platform}",
+                            campaign_id=f"bench-{campaign}",
+                            campaign_name=f"Benchmark campaign {campaign}",
+                            adgroup_id="",
+                            date=today - timedelta(days=day),
+                            impressions=impressions,
+                            clicks=clicks,
+                            spend_minor=spend_minor,
+                            conversions=random.randint(0, clicks // 5 + 1),
+                            conversion_value_minor=int(spend_minor * random.uniform(0, 6)),
+                        )
+                        produced += 1
+
+        batch = []
+        inserted = 0
+        for row in rows():
+            batch.append(row)
+            if len(batch) >= SEED_CHUNK_SIZE:
+                AnalysisDaily.objects.bulk_create(batch, ignore_conflicts=True)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            AnalysisDaily.objects.bulk_create(batch, ignore_conflicts=True)
+            inserted += len(batch)
+        # Fresh planner statistics, as a table of this size would have in production
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(AnalysisDaily._meta.db_table)}")
+        self.stdout.write(self.style.SUCCESS(f"Seeded {inserted} rows for a throwaway organization"))
+        return organization
@@ -0,0 +1,31 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from main.models import Organization
+from analysis.insights import generate_insights
+
+
+class Command(BaseCommand):
+    help = 'Run the AI insight engine over AnalysisDaily and write ranked AIInsight rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--org', help='Only this organization (snowflake id)')
+        parser.add_argument('--date', help='Day to evaluate YYYY-MM-DD (defaults to yesterday)')
+        parser.add_argument('--summaries', action='store_true', default=None, help='Add one LLM summary per organization')
+
+    def handle(self, *args, **options):
+        organization_ids = None
+        if options['org']:
+            organization = Organization.objects.filter(snowflake_id=options['org']).first()
+            if not organization:
+                raise CommandError('Organization not found')
+            organization_ids = [organization.id]
+
+        try:
+            end_date = datetime.strptime(options['date'], '%Y-%m-%d').date() if options['date'] else None
+        except ValueError:
+            raise CommandError('Dates must use the YYYY-MM-DD format')
+
+        result = generate_insights(end_date, organization_ids, summaries=options['summaries'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {result['insights']} insight(s) for {result['organizations']} organization(s)"
+        ))
@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from analysis import partitions
+
+
+class Command(BaseCommand):
+    help = ('Convert AnalysisDaily into a table range-partitioned by month (PostgreSQL only). '
+            'Run once to create and copy online (resumable), then again with --swap to switch over.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=partitions.COPY_BATCH_SIZE, help='Rows copied per transaction')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+        parser.add_argument('--swap', action='store_true', help='Catch up and swap the partitioned table into place')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning is only supported on PostgreSQL')
+        table, partitioned, _ = partitions.table_names()
+        if partitions.is_partitioned(table):
+            created = partitions.ensure_upcoming_partitions()
+            self.stdout.write(self.style.SUCCESS(f"{table} is already partitioned, {len(created)} partition(s) added"))
+            return
+
+        if partitions.create_partitioned_table():
+            self.stdout.write(f"Created {partitioned}")
+
+        copied = 0
+        while count := partitions.copy_batch(options['batch_size']):
+            copied += count
+            self.stdout.write(f"  copied {copied} row(s)")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f"{partitioned} caught up ({copied} row(s) copied this run)")
+
+        if options['swap']:
+            partitions.swap_tables()
+            self.stdout.write(self.style.SUCCESS(f"{table} is now partitioned by month, the old table is kept as {table}_unpartitioned"))
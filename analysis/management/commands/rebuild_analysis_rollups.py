@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from main.models import Organization
+from analysis.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the day/month AnalysisRollup tables from AnalysisDaily'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--org', help='Only rebuild this organization (snowflake id)')
+
+    def handle(self, *args, **options):
+        organization_id = None
+        if options['org']:
+            organization = Organization.objects.filter(snowflake_id=options['org']).first()
+            if not organization:
+                raise CommandError('Organization not found')
+            organization_id = organization.id
+
+        count = rebuild_rollups(organization_id)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups for {count} organization(s)"))
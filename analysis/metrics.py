@@ -0,0 +1,77 @@
+"""
+Derived ad metrics.
+
+AnalysisDaily and AnalysisRollup only store additive facts (money in minor
+units, counts). CTR, CPC and ROAS are ratios of those facts and are derived
+at read time, in SQL via the expressions below or in Python via
+`derive_metrics` when the sums are already at hand. Both use the same
+formulas.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+# Amounts are stored in minor units, e.g. cents
+MINOR_UNITS = 100
+
+
+def to_minor(amount):
+    if amount in (None, ''):
+        return 0
+    return int((Decimal(str(amount)) * MINOR_UNITS).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_minor(amount_minor):
+    return (amount_minor or 0) / MINOR_UNITS
+
+
+def _expression(value):
+    return F(value) if isinstance(value, str) else value
+
+
+def _as_float(value):
+    return Cast(_expression(value), output_field=FloatField())
+
+
+def ratio_expression(numerator, denominator, scale=1):
+    """`numerator * scale / denominator` as a float, 0 when the denominator is 0."""
+    return Coalesce(
+        _as_float(numerator) * Value(float(scale)) / NullIf(_as_float(denominator), Value(0.0)),
+        Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def money_expression(amount_minor='spend_minor'):
+    return _as_float(amount_minor) / Value(float(MINOR_UNITS))
+
+
+def metric_expressions(spend_minor='spend_minor', impressions='impressions', clicks='clicks',
+                       conversion_value_minor='conversion_value_minor'):
+    """
+    Annotations for `spend`, `conversion_value`, `ctr`, `cpc` and `roas`.
+    Pass field names for per row values or aggregates such as
+    `Sum('clicks')` for grouped queries.
+    """
+    return {
+        'spend': money_expression(spend_minor),
+        'conversion_value': money_expression(conversion_value_minor),
+        'ctr': ratio_expression(clicks, impressions, scale=100),
+        'cpc': ratio_expression(spend_minor, clicks, scale=1 / MINOR_UNITS),
+        'roas': ratio_expression(conversion_value_minor, spend_minor),
+    }
+
+
+def derive_metrics(spend_minor=0, impressions=0, clicks=0, conversion_value_minor=0):
+    spend_minor = spend_minor or 0
+    impressions = impressions or 0
+    clicks = clicks or 0
+    conversion_value_minor = conversion_value_minor or 0
+    return {
+        'spend': round(from_minor(spend_minor), 2),
+        'conversion_value': round(from_minor(conversion_value_minor), 2),
+        'ctr': round(clicks * 100 / impressions, 2) if impressions else 0,
+        'cpc': round(from_minor(spend_minor) / clicks, 2) if clicks else 0,
+        'roas': round(conversion_value_minor / spend_minor, 2) if spend_minor else 0,
+    }
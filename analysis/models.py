@@ -1,45 +1,167 @@
 from django.db import models
-from main.models import Platform, Organization
+from main.models import Platform, Organization, AdIntegration
 
 class AnalysisDaily(models.Model):
+    class Granularity(models.TextChoices):
+        DAY = 'DAY', 'Day'
+        # Days past the retention horizon are compacted into one row per month (see analysis.retention)
+        MONTH = 'MONTH', 'Month'
+
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='daily_analyses')
     platform = models.CharField(max_length=100, choices=Platform.choices)
     account_id = models.CharField(max_length=100)
     campaign_id = models.CharField(max_length=100, blank=True, null=True)
     campaign_name = models.CharField(max_length=255, blank=True, null=True)
     adgroup_id = models.CharField(max_length=100, blank=True, null=True)
-    date = models.DateField()
-    impressions = models.IntegerField()
-    clicks = models.IntegerField()
-    spend = models.FloatField()
-    ctr = models.FloatField()  # Click-Through Rate
-    cpc = models.FloatField()  # Cost Per Click
-    roas = models.FloatField()  # Return on Ad Spend
-    device_breakdown = models.JSONField(blank=True, null=True)  # e.g., {"mobile": {...}, "desktop": {...}}
+    date = models.DateField()  # first day of the month for MONTH rows
+    granularity = models.CharField(max_length=10, choices=Granularity.choices, default=Granularity.DAY)
+    # Additive facts only, CTR/CPC/ROAS are derived at read time (see analysis.metrics)
+    impressions = models.BigIntegerField(default=0)
+    clicks = models.BigIntegerField(default=0)
+    spend_minor = models.BigIntegerField(default=0, help_text="Stored in minor units (e.g. cents)")
+    conversions = models.BigIntegerField(default=0)
+    conversion_value_minor = models.BigIntegerField(default=0, help_text="Stored in minor units (e.g. cents)")
+    updated_at = models.DateTimeField(auto_now=True)
     class Meta:
-        unique_together = ('platform', 'account_id', 'campaign_id', 'adgroup_id', 'date')
+        # Organizations sharing an ad account each keep their own rows
+        unique_together = ('organization', 'platform', 'account_id', 'campaign_id', 'adgroup_id', 'date', 'granularity')
+        # Dashboard, rollup and report reads all start from the organization
+        indexes = [
+            models.Index(fields=['organization', 'date']),
+            models.Index(fields=['organization', 'platform', 'date']),
+        ]
 
     def __str__(self):
         return f"Analysis for {self.campaign_name} {self.date} on {self.platform}"
 
 
+class AnalysisDailyDevice(models.Model):
+    """
+    Device split of a campaign level AnalysisDaily row. Organization,
+    platform and date are copied from the parent so breakdowns aggregate
+    without a join.
+    """
+    # No database constraint: a partitioned AnalysisDaily table (see
+    # partition_analysis_daily) has no unique index on `id` alone to reference
+    daily = models.ForeignKey(AnalysisDaily, on_delete=models.CASCADE, related_name='devices', db_constraint=False)
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='daily_device_analyses')
+    platform = models.CharField(max_length=100, choices=Platform.choices)
+    date = models.DateField()
+    device = models.CharField(max_length=50)  # e.g. ANDROID, IOS, desktop
+    impressions = models.BigIntegerField(default=0)
+    clicks = models.BigIntegerField(default=0)
+    spend_minor = models.BigIntegerField(default=0, help_text="Stored in minor units (e.g. cents)")
+    conversions = models.BigIntegerField(default=0)
+    conversion_value_minor = models.BigIntegerField(default=0, help_text="Stored in minor units (e.g. cents)")
+
+    class Meta:
+        unique_together = ('daily', 'device')
+        indexes = [
+            models.Index(fields=['organization', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.device} analysis for {self.date} on {self.platform}"
+
+
+class AnalysisRollup(models.Model):
+    """
+    Pre-summed AnalysisDaily totals per organization, platform and day/month.
+    Kept up to date by `analysis.rollups.refresh_rollups` whenever daily rows are written.
+    """
+    class Period(models.TextChoices):
+        DAY = 'DAY', 'Day'
+        MONTH = 'MONTH', 'Month'
+
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='analysis_rollups')
+    platform = models.CharField(max_length=100, choices=Platform.choices)
+    period = models.CharField(max_length=10, choices=Period.choices)
+    date = models.DateField()  # first day of the bucket
+    spend_minor = models.BigIntegerField(default=0)
+    impressions = models.BigIntegerField(default=0)
+    clicks = models.BigIntegerField(default=0)
+    conversions = models.BigIntegerField(default=0)
+    conversion_value_minor = models.BigIntegerField(default=0)
+    row_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('organization', 'platform', 'period', 'date')
+
+    def __str__(self):
+        return f"{self.period} rollup {self.date} on {self.platform}"
+
+
 class Report(models.Model):
     class Status(models.TextChoices):
         PENDING = 'PENDING', 'Pending'
         COMPLETED = 'COMPLETED', 'Completed'
         FAILED = 'FAILED', 'Failed'
 
+    class Format(models.TextChoices):
+        XLSX = 'xlsx', 'Excel'
+        CSV_GZ = 'csv.gz', 'Gzipped CSV'
+        PARQUET = 'parquet', 'Parquet'
+
     name = models.CharField(max_length=255)
     organization = models.ForeignKey('main.Organization', on_delete=models.CASCADE, related_name='reports')
     created_at = models.DateTimeField(auto_now_add=True)
     file = models.FileField(upload_to='reports/', blank=True, null=True)
     report_type = models.CharField(max_length=50)  # e.g., 'weekly', 'monthly', 'custom'
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    format = models.CharField(max_length=10, choices=Format.choices, default=Format.XLSX)
     included_platforms = models.JSONField(default=list, blank=True)  # e.g., ['META', 'TIKTOK', 'GOOGLE']
-    included_metrics = models.JSONField(default=list, blank=True)    # e.g., ['spend', 'impressions', 'clicks', 'ctr', 'cpc', 'roas']
+    included_metrics = models.JSONField(default=list, blank=True)    # e.g., ['spend', 'impressions', 'clicks', 'conversions', 'ctr', 'cpc', 'roas']
     start_date = models.DateField(blank=True, null=True)  # For custom date range reports
     end_date = models.DateField(blank=True, null=True)    # For custom date range reports
+    # Hash of the normalized request and the state of the rows it was built from,
+    # see analysis.report_cache
+    cache_key = models.CharField(max_length=64, blank=True, db_index=True)
+    data_watermark = models.CharField(max_length=64, blank=True)
 
     def __str__(self):
         return self.name
 
+
+
+class AnalyticsBackfill(models.Model):
+    """
+    A historical analytics pull for one integration, split into date windows.
+    Finished windows are checkpointed so an interrupted backfill resumes.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        RUNNING = 'RUNNING', 'Running'
+        COMPLETED = 'COMPLETED', 'Completed'
+        FAILED = 'FAILED', 'Failed'
+
+    integration = models.ForeignKey(AdIntegration, on_delete=models.CASCADE, related_name='backfills')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    window_days = models.PositiveIntegerField()
+    completed_windows = models.JSONField(default=list, blank=True)  # start dates (YYYY-MM-DD) of finished windows
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Backfill {self.integration} {self.start_date} - {self.end_date} ({self.status})"
+
+
+class IntegrationSyncState(models.Model):
+    """
+    How far scheduled syncs of an integration have got, so each run only
+    asks the platform for new days and for the days still inside its
+    attribution restatement window (see analysis.sync.plan_sync).
+    """
+    integration = models.OneToOneField(AdIntegration, on_delete=models.CASCADE, related_name='sync_state')
+    # Last day included in a finished sync; it is fetched again next run since it may have been partial
+    last_synced_date = models.DateField(null=True, blank=True)
+    attribution_refreshed_at = models.DateTimeField(null=True, blank=True)
+    # The run in progress: {"start_date", "end_date", "refresh_attribution", "completed_windows"}
+    cursor = models.JSONField(default=dict, blank=True)
+    last_success_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Sync state of {self.integration} (up to {self.last_synced_date})"
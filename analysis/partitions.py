@@ -0,0 +1,218 @@
+"""
+Monthly range partitioning of the `AnalysisDaily` table on PostgreSQL.
+
+Django has no notion of partitioned tables, so the table is converted in
+place by `manage.py partition_analysis_daily`:
+
+1. a partitioned copy of the table is created next to it, with one
+   partition per month and a DEFAULT partition for anything else;
+2. existing rows are copied over in id batches while the app keeps
+   writing to the original table;
+3. `--swap` catches up on rows written or deleted since the copy started
+   and swaps the two tables under a short write lock.
+
+Every dashboard, rollup and report query filters on `date`, so the planner
+only scans the partitions of the requested months. Ids and the natural key
+are unchanged; the primary key becomes `(id, date)` since PostgreSQL needs
+the partition key in every unique index.
+"""
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from main.models import Organization
+
+from .models import AnalysisDaily
+from .rollups import month_start, next_month
+
+MONTHS_AHEAD = 3
+COPY_BATCH_SIZE = 50000
+COPY_STARTED_PREFIX = "copy started at "
+
+
+def table_names():
+    table = AnalysisDaily._meta.db_table
+    return table, f"{table}_partitioned", f"{table}_unpartitioned"
+
+
+def _execute(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall() if cursor.description else None
+
+
+def is_partitioned(table=None):
+    """Whether `table` (defaults to the AnalysisDaily table) is a partitioned table."""
+    if connection.vendor != 'postgresql':
+        return False
+    table = table or AnalysisDaily._meta.db_table
+    return bool(_execute(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+        [table],
+    ))
+
+
+def table_exists(table):
+    return table in connection.introspection.table_names()
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def ensure_partitions(table, start, end):
+    """
+    Creates the missing monthly partitions of `table` covering
+    `start` through `end`. Returns the names of the partitions created.
+    """
+    quote = connection.ops.quote_name
+    existing = set(connection.introspection.table_names())
+    created = []
+    month = month_start(start)
+    while month <= end:
+        name = partition_name(table, month)
+        if name not in existing:
+            _execute(
+                f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} FOR VALUES FROM (%s) TO (%s)",
+                [month, next_month(month)],
+            )
+            created.append(name)
+        month = next_month(month)
+    return created
+
+
+def _months_ahead(months_ahead):
+    end = timezone.now().date()
+    for _ in range(months_ahead):
+        end = next_month(end)
+    return end
+
+
+def ensure_upcoming_partitions(months_ahead=MONTHS_AHEAD):
+    """
+    Keeps partitions ready for the coming months once the table has been
+    partitioned; rows outside them would land in the DEFAULT partition.
+    """
+    if not is_partitioned():
+        return []
+    return ensure_partitions(AnalysisDaily._meta.db_table, timezone.now().date(), _months_ahead(months_ahead))
+
+
+def create_partitioned_table():
+    """
+    Creates the partitioned copy of AnalysisDaily with its partitions,
+    constraints and indexes. Does nothing if it already exists.
+    """
+    quote = connection.ops.quote_name
+    table, partitioned, _ = table_names()
+    if table_exists(partitioned):
+        return False
+
+    opts = AnalysisDaily._meta
+
+    def column(name):
+        return quote(opts.get_field(name).column)
+
+    unique_columns = ", ".join(column(name) for name in opts.unique_together[0])
+    sequence = f"{partitioned}_id_seq"
+
+    with transaction.atomic():
+        _execute(f"CREATE TABLE {quote(partitioned)} (LIKE {quote(table)} INCLUDING DEFAULTS) PARTITION BY RANGE ({column('date')})")
+        # The original id is an identity column, which partitioned tables can't
+        # inherit before PostgreSQL 17; a plain sequence default does the same
+        _execute(f"CREATE SEQUENCE {quote(sequence)}")
+        _execute(f"ALTER TABLE {quote(partitioned)} ALTER COLUMN {column('id')} SET DEFAULT nextval(%s)", [sequence])
+        _execute(f"ALTER TABLE {quote(partitioned)} ADD PRIMARY KEY ({column('id')}, {column('date')})")
+        _execute(f"ALTER TABLE {quote(partitioned)} ADD UNIQUE ({unique_columns})")
+        _execute(
+            f"ALTER TABLE {quote(partitioned)} ADD FOREIGN KEY ({column('organization')}) "
+            f"REFERENCES {quote(Organization._meta.db_table)} ({quote(Organization._meta.pk.column)}) DEFERRABLE INITIALLY DEFERRED"
+        )
+        # Named after the model indexes, renamed into place on swap
+        for index in opts.indexes:
+            columns = ", ".join(column(name) for name in index.fields)
+            _execute(f"CREATE INDEX {quote(index.name + '_p')} ON {quote(partitioned)} ({columns})")
+
+        first = AnalysisDaily.objects.order_by('date').values_list('date', flat=True).first() or timezone.now().date()
+        ensure_partitions(partitioned, first, _months_ahead(MONTHS_AHEAD))
+        _execute(f"CREATE TABLE {quote(partitioned + '_default')} PARTITION OF {quote(partitioned)} DEFAULT")
+        _execute(f"COMMENT ON TABLE {quote(partitioned)} IS %s", [COPY_STARTED_PREFIX + timezone.now().isoformat()])
+    return True
+
+
+def copy_started_at():
+    table, partitioned, _ = table_names()
+    comment = _execute("SELECT obj_description(%s::regclass, 'pg_class')", [partitioned])[0][0] or ""
+    return datetime.fromisoformat(comment.removeprefix(COPY_STARTED_PREFIX))
+
+
+def copy_batch(batch_size=COPY_BATCH_SIZE):
+    """
+    Copies the next `batch_size` ids from AnalysisDaily into the partitioned
+    table, resuming after the highest id already copied. Returns the number
+    of rows copied, 0 once it has caught up.
+    """
+    quote = connection.ops.quote_name
+    table, partitioned, _ = table_names()
+    id_column = quote(AnalysisDaily._meta.pk.column)
+
+    last_id = _execute(f"SELECT COALESCE(MAX({id_column}), 0) FROM {quote(partitioned)}")[0][0]
+    upper = _execute(
+        f"SELECT MAX({id_column}) FROM (SELECT {id_column} FROM {quote(table)} WHERE {id_column} > %s ORDER BY {id_column} LIMIT %s) batch",
+        [last_id, batch_size],
+    )[0][0]
+    if upper is None:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(partitioned)} SELECT * FROM {quote(table)} WHERE {id_column} > %s AND {id_column} <= %s ON CONFLICT DO NOTHING",
+            [last_id, upper],
+        )
+        return cursor.rowcount
+
+
+def swap_tables():
+    """
+    Brings the partitioned table up to date and puts it in place of the
+    original, which is kept as `<table>_unpartitioned` until dropped by hand.
+    Writers are blocked (readers are not) for the duration.
+    """
+    quote = connection.ops.quote_name
+    table, partitioned, unpartitioned = table_names()
+    opts = AnalysisDaily._meta
+    id_column = quote(opts.pk.column)
+    date_column = quote(opts.get_field('date').column)
+    columns = [quote(field.column) for field in opts.concrete_fields]
+    assignments = ", ".join(f"{name} = EXCLUDED.{name}" for name in columns)
+    since = copy_started_at()
+
+    with transaction.atomic():
+        _execute(f"LOCK TABLE {quote(table)} IN SHARE ROW EXCLUSIVE MODE")
+        # Rows deleted since the copy started, then rows written (inserted or
+        # upserted) since. Deletes go first: compaction, or an upsert after a
+        # delete, re-inserts a natural key under a new id, which would hit the
+        # natural key constraint while the old id is still in place
+        _execute(
+            f"DELETE FROM {quote(partitioned)} p WHERE NOT EXISTS "
+            f"(SELECT 1 FROM {quote(table)} t WHERE t.{id_column} = p.{id_column})"
+        )
+        last_id = _execute(f"SELECT COALESCE(MAX({id_column}), 0) FROM {quote(partitioned)}")[0][0]
+        _execute(
+            f"INSERT INTO {quote(partitioned)} SELECT * FROM {quote(table)} "
+            f"WHERE {id_column} > %s OR {quote(opts.get_field('updated_at').column)} >= %s "
+            f"ON CONFLICT ({id_column}, {date_column}) DO UPDATE SET {assignments}",
+            [last_id, since],
+        )
+
+        _execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(unpartitioned)}")
+        _execute(f"ALTER TABLE {quote(partitioned)} RENAME TO {quote(table)}")
+        for index in opts.indexes:
+            _execute(f"ALTER INDEX {quote(index.name)} RENAME TO {quote(index.name + '_old')}")
+            _execute(f"ALTER INDEX {quote(index.name + '_p')} RENAME TO {quote(index.name)}")
+
+        sequence = f"{partitioned}_id_seq"
+        _execute(f"SELECT setval(%s, (SELECT COALESCE(MAX({id_column}), 0) + 1 FROM {quote(table)}), false)", [sequence])
+        _execute(f"ALTER SEQUENCE {quote(sequence)} OWNED BY {quote(table)}.{id_column}")
+        _execute(f"COMMENT ON TABLE {quote(table)} IS NULL")
+
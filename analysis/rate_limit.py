@@ -0,0 +1,133 @@
+"""
+Shared request budgets for the ad platform APIs.
+
+Every worker draws from the same Redis token buckets before each HTTP
+request: one per platform and one per platform app (the app id the
+requests are made with), refilled at `qps` tokens per second up to
+`burst`. Both buckets are checked and charged in one Lua call, so
+concurrent workers never overdraw them. When Redis is unreachable the
+request goes out unthrottled rather than failing the sync.
+"""
+import asyncio
+import logging
+
+from django.conf import settings
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from main.models import Platform
+
+logger = logging.getLogger(__name__)
+
+BUCKET_KEY = "ratelimit:{platform}"
+APP_BUCKET_KEY = "ratelimit:{platform}:app:{app_id}"
+
+DEFAULT_RATE_LIMITS = {
+    Platform.TIKTOK: {'qps': 10, 'burst': 20},
+    Platform.META: {'qps': 5, 'burst': 10},
+    Platform.GOOGLE: {'qps': 5, 'burst': 10},
+}
+
+APP_ID_SETTINGS = {
+    Platform.TIKTOK: 'TIKTOK_APP_ID',
+    Platform.META: 'META_APP_ID',
+    Platform.GOOGLE: 'GOOGLE_CLIENT_ID',
+}
+
+HOST_PLATFORMS = {
+    'tiktok.com': Platform.TIKTOK,
+    'facebook.com': Platform.META,
+    'googleapis.com': Platform.GOOGLE,
+}
+
+# KEYS: the buckets, ARGV: (qps, burst) per bucket.
+# Returns 0 once a token was taken from every bucket, else the ms to wait.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    available = math.min(burst, available + (now - ts) * rate / 1000)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, math.ceil((1 - available) * 1000 / rate))
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst * 1000 / rate) + 1000)
+end
+return 0
+"""
+
+
+def get_rate_limits():
+    return {**DEFAULT_RATE_LIMITS, **getattr(settings, 'ANALYTICS_RATE_LIMITS', {})}
+
+
+def get_app_rate_limits():
+    return {**get_rate_limits(), **getattr(settings, 'ANALYTICS_APP_RATE_LIMITS', {})}
+
+
+def platform_for_host(host):
+    for suffix, platform in HOST_PLATFORMS.items():
+        if host == suffix or host.endswith(f".{suffix}"):
+            return platform
+    return None
+
+
+class RateLimiter:
+    """
+    Async token bucket client for one event loop; use `request_hook` as an
+    httpx `request` event hook to throttle every outgoing platform call.
+    """
+
+    def __init__(self, url=None):
+        self.redis = aioredis.Redis.from_url(url or settings.ANALYTICS_RATE_LIMIT_REDIS_URL)
+        self.script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def buckets(self, platform):
+        buckets = []
+        limit = get_rate_limits().get(platform)
+        if limit:
+            buckets.append((BUCKET_KEY.format(platform=platform), limit))
+        app_id = getattr(settings, APP_ID_SETTINGS.get(platform, ''), None)
+        app_limit = get_app_rate_limits().get(platform)
+        if app_id and app_limit:
+            buckets.append((APP_BUCKET_KEY.format(platform=platform, app_id=app_id), app_limit))
+        return buckets
+
+    async def acquire(self, platform):
+        buckets = self.buckets(platform)
+        if not buckets:
+            return
+        keys = [key for key, _ in buckets]
+        args = [value for _, limit in buckets for value in (limit['qps'], limit['burst'])]
+        while True:
+            try:
+                wait = await self.script(keys=keys, args=args)
+            except RedisError:
+                logger.warning("Rate limiter unavailable, sending %s request unthrottled", platform, exc_info=True)
+                return
+            if not wait:
+                return
+            await asyncio.sleep(int(wait) / 1000)
+
+    async def request_hook(self, request):
+        platform = platform_for_host(request.url.host)
+        if platform:
+            await self.acquire(platform)
+
+    async def aclose(self):
+        await self.redis.aclose()
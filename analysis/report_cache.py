@@ -0,0 +1,87 @@
+"""
+Content addressed reuse of generated reports.
+
+A report is identified by its normalized request (`report_cache_key`) and by
+a watermark of the AnalysisDaily rows it covers (`report_watermark`: the
+latest `updated_at` plus the row count, so deletions are noticed too). A
+completed report with the same key and watermark is served as is; a pending
+one is shared by every identical request made while it is being built, unless
+it is older than `REPORT_PENDING_TIMEOUT`, in which case its task is assumed
+lost and a fresh report is started.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from main.models import Organization
+from .models import Report
+from .report_writers import report_querysets
+
+
+# Well past a report task's retries (3 x 60 s countdown) and a long sharded build
+DEFAULT_REPORT_PENDING_TIMEOUT = timedelta(minutes=30)
+
+
+def get_pending_timeout():
+    return getattr(settings, 'REPORT_PENDING_TIMEOUT', DEFAULT_REPORT_PENDING_TIMEOUT)
+
+
+def report_cache_key(organization, report_type, included_platforms, included_metrics, start_date, end_date, report_format):
+    payload = {
+        'organization': organization.pk,
+        # Part of the file name
+        'report_type': (report_type or '').lower(),
+        'platforms': sorted(included_platforms or []),
+        'metrics': sorted(included_metrics or []),
+        'start_date': start_date.isoformat() if start_date else None,
+        'end_date': end_date.isoformat() if end_date else None,
+        'format': report_format,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def report_watermark(report):
+    all_rows, _ = report_querysets(report)
+    state = all_rows.order_by().aggregate(latest=Max('updated_at'), rows=Count('id'))
+    latest = state['latest'].isoformat() if state['latest'] else '-'
+    return f"{latest}:{state['rows']}"
+
+
+def get_or_create_report(organization, **fields):
+    """
+    Returns `(report, created)`. An existing report is returned when one
+    with the same request and watermark is completed or has been pending
+    for less than `REPORT_PENDING_TIMEOUT`; otherwise a new PENDING report
+    is created and the caller enqueues it. An older pending duplicate is
+    marked FAILED.
+    """
+    report = Report(organization=organization, **fields)
+    report.cache_key = report_cache_key(
+        organization, report.report_type, report.included_platforms, report.included_metrics,
+        report.start_date, report.end_date, report.format,
+    )
+    report.data_watermark = report_watermark(report)
+
+    with transaction.atomic():
+        # Serializes report requests per organization so concurrent duplicates coalesce
+        Organization.objects.select_for_update().filter(pk=organization.pk).first()
+        existing = Report.objects.filter(
+            organization=organization,
+            cache_key=report.cache_key,
+            data_watermark=report.data_watermark,
+            status__in=[Report.Status.PENDING, Report.Status.COMPLETED],
+        ).order_by('-created_at').first()
+        if existing and existing.status == Report.Status.PENDING:
+            if existing.created_at >= timezone.now() - get_pending_timeout():
+                return existing, False
+            # Its task died without marking it, don't let it block every identical request
+            Report.objects.filter(pk=existing.pk, status=Report.Status.PENDING).update(status=Report.Status.FAILED)
+        elif existing and existing.file:
+            return existing, False
+        report.save()
+    return report, True
@@ -0,0 +1,306 @@
+"""
+Streaming report writers.
+
+Rows are read with `.values_list().iterator()` and written straight to the
+output, so memory stays flat however large the report is.
+
+- xlsx: write-only workbook. Column widths have to be set before the first
+  row of a write-only sheet, so they are computed up front with one
+  aggregate query per sheet.
+- csv.gz: plain tuples into `csv.writer` over a gzip stream.
+- parquet: each fetched chunk is transposed into Arrow columns and written
+  as one record batch.
+"""
+import csv
+import gzip
+import io
+import json
+import shutil
+from datetime import timedelta
+from itertools import islice
+
+from django.db.models import CharField, Max
+from django.db.models.functions import Cast, Length
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+from .metrics import metric_expressions
+from .models import AnalysisDaily
+from .retention import period_filter
+from .rollups import next_month
+
+REPORT_CHUNK_SIZE = 2000
+MAX_COLUMN_WIDTH = 50
+
+HEADER_FONT = Font(bold=True, color="FFFFFF")
+HEADER_FILL = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+
+
+def report_querysets(report, platforms=('META', 'GOOGLE', 'TIKTOK')):
+    """
+    Returns `(all_rows, {platform: rows})` querysets for the platforms of
+    `report` the organization has an integration for, covering every ad
+    account of each platform. A compacted month the date range touches is
+    read as its MONTH row, see `analysis.retention.period_filter`.
+    """
+    included_platforms = [p.upper() for p in (report.included_platforms or [])] or list(platforms)
+
+    connected = set(report.organization.integrations.filter(platform__in=included_platforms).values_list('platform', flat=True))
+    included_platforms = [platform for platform in included_platforms if platform in connected]
+
+    if not included_platforms:
+        return AnalysisDaily.objects.none(), {}
+
+    # Money and ratios are derived per row in SQL, see analysis.metrics
+    rows = AnalysisDaily.objects.filter(organization=report.organization).annotate(**metric_expressions())
+    # Apply date range filter if available, compacted months are exported
+    # whole as their MONTH row
+    if report.start_date and report.end_date:
+        rows = rows.filter(period_filter(report.start_date, report.end_date))
+
+    per_platform = {
+        platform: rows.filter(platform=platform).order_by('date', 'id')
+        for platform in included_platforms
+    }
+    all_rows = rows.filter(platform__in=included_platforms)
+    return all_rows.order_by('platform', 'date', 'id'), per_platform
+
+
+def iter_report_rows(queryset, keys, chunk_size=REPORT_CHUNK_SIZE):
+    for row in queryset.values_list(*keys).iterator(chunk_size=chunk_size):
+        # Dates as ISO strings for Excel compatibility
+        yield [value.isoformat() if hasattr(value, 'isoformat') else value for value in row]
+
+
+def column_widths(queryset, headers):
+    lengths = queryset.order_by().aggregate(**{
+        f'{key}_length': Max(Length(Cast(key, output_field=CharField())))
+        for _, key in headers
+    })
+    return [min(max(len(name), lengths[f'{key}_length'] or 0) + 2, MAX_COLUMN_WIDTH) for name, key in headers]
+
+
+def _header_cells(sheet, headers):
+    cells = []
+    for name, _ in headers:
+        cell = WriteOnlyCell(sheet, value=name)
+        cell.font = HEADER_FONT
+        cell.fill = HEADER_FILL
+        cells.append(cell)
+    return cells
+
+
+def write_xlsx_sheet(workbook, title, queryset, headers):
+    sheet = workbook.create_sheet(title)
+    for col_num, width in enumerate(column_widths(queryset, headers), 1):
+        sheet.column_dimensions[get_column_letter(col_num)].width = width
+
+    sheet.append(_header_cells(sheet, headers))
+
+    for row in iter_report_rows(queryset, [key for _, key in headers]):
+        sheet.append(row)
+
+
+def write_xlsx_report(fileobj, report, headers):
+    """
+    Writes an "All Data" sheet plus one sheet per platform with data
+    to `fileobj` (a path or binary file opened for writing).
+    """
+    all_rows, per_platform = report_querysets(report)
+    workbook = Workbook(write_only=True)
+    write_xlsx_sheet(workbook, "All Data", all_rows, headers)
+    for platform, queryset in per_platform.items():
+        if queryset.exists():
+            write_xlsx_sheet(workbook, platform, queryset, headers)
+    workbook.save(fileobj)
+
+
+def write_csv_gz_report(fileobj, report, headers):
+    """Writes every row of the report as gzipped CSV to a binary `fileobj`."""
+    all_rows, _ = report_querysets(report)
+    with gzip.GzipFile(fileobj=fileobj, mode='wb') as gz, io.TextIOWrapper(gz, encoding='utf-8', newline='') as text:
+        writer = csv.writer(text)
+        writer.writerow([name for name, _ in headers])
+        writer.writerows(
+            all_rows.values_list(*[key for _, key in headers]).iterator(chunk_size=REPORT_CHUNK_SIZE)
+        )
+
+
+def arrow_schema(keys):
+    import pyarrow as pa
+
+    types = {
+        'AutoField': pa.int64(),
+        'BigAutoField': pa.int64(),
+        'IntegerField': pa.int64(),
+        'BigIntegerField': pa.int64(),
+        'PositiveIntegerField': pa.int64(),
+        'FloatField': pa.float64(),
+        'DateField': pa.date32(),
+    }
+    fields = {field.name: field for field in AnalysisDaily._meta.get_fields()}
+    # Keys that are not model fields are the derived float metrics
+    return pa.schema([
+        (key, types.get(fields[key].get_internal_type(), pa.string()) if key in fields else pa.float64())
+        for key in keys
+    ])
+
+
+def write_parquet_rows(fileobj, queryset, keys, chunk_size=REPORT_CHUNK_SIZE):
+    """
+    Writes `queryset` as Parquet to `fileobj`, one record batch (and row
+    group) per fetched chunk. Columns are named by field key.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(keys)
+    rows = queryset.values_list(*keys).iterator(chunk_size=chunk_size)
+
+    with pq.ParquetWriter(fileobj, schema, compression='snappy') as writer:
+        while chunk := list(islice(rows, chunk_size)):
+            columns = zip(*chunk)
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema,
+            ))
+
+
+def write_parquet_report(fileobj, report, headers):
+    """Writes every row of the report as Parquet to `fileobj`."""
+    all_rows, _ = report_querysets(report)
+    write_parquet_rows(fileobj, all_rows, [key for _, key in headers])
+
+
+REPORT_WRITERS = {
+    'xlsx': write_xlsx_report,
+    'csv.gz': write_csv_gz_report,
+    'parquet': write_parquet_report,
+}
+
+
+# --- Sharded generation ---
+#
+# Large reports are split into one shard per platform and calendar month.
+# Each shard writes a partial file, and the partials are merged in order,
+# which yields the same platform/date ordering as the single pass:
+# - csv.gz partials are headerless gzip members, merged by concatenation
+#   after a header member (a multi-member gzip file is valid gzip)
+# - parquet partials are copied row group by row group
+# - xlsx partials are gzipped JSON lines, streamed into a write-only
+#   workbook; each shard also reports its column widths
+
+PARTIAL_SUFFIXES = {
+    'xlsx': '.jsonl.gz',
+    'csv.gz': '.csv.gz',
+    'parquet': '.parquet',
+}
+
+
+def month_windows(start_date, end_date):
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(next_month(window_start) - timedelta(days=1), end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(days=1)
+    return windows
+
+
+def report_shards(report):
+    """Returns `(platform, start_date, end_date)` per platform and month."""
+    if not (report.start_date and report.end_date):
+        return []
+    _, per_platform = report_querysets(report)
+    return [
+        (platform, window_start, window_end)
+        # Sorted like the "All Data" rows of a single pass
+        for platform in sorted(per_platform)
+        for window_start, window_end in month_windows(report.start_date, report.end_date)
+    ]
+
+
+def shard_queryset(report, platform, start_date, end_date):
+    _, per_platform = report_querysets(report)
+    if platform not in per_platform:
+        return AnalysisDaily.objects.none()
+    return per_platform[platform].filter(period_filter(start_date, end_date))
+
+
+def write_report_partial(fileobj, queryset, headers, report_format):
+    """
+    Writes one shard in its partial format. For xlsx returns
+    `{"rows": int, "widths": [...]}` for the merge step, else an empty dict.
+    """
+    keys = [key for _, key in headers]
+    if report_format == 'parquet':
+        write_parquet_rows(fileobj, queryset, keys)
+        return {}
+
+    with gzip.GzipFile(fileobj=fileobj, mode='wb') as gz, io.TextIOWrapper(gz, encoding='utf-8', newline='') as text:
+        if report_format == 'csv.gz':
+            csv.writer(text).writerows(queryset.values_list(*keys).iterator(chunk_size=REPORT_CHUNK_SIZE))
+            return {}
+
+        rows = 0
+        widths = [0] * len(keys)
+        for row in iter_report_rows(queryset, keys):
+            rows += 1
+            for index, value in enumerate(row):
+                if value is not None:
+                    widths[index] = max(widths[index], len(str(value)))
+            text.write(json.dumps(row) + '\n')
+        return {"rows": rows, "widths": widths}
+
+
+def _iter_partial_rows(paths, storage):
+    for path in paths:
+        with storage.open(path, 'rb') as raw, gzip.GzipFile(fileobj=raw) as gz:
+            for line in io.TextIOWrapper(gz, encoding='utf-8'):
+                yield json.loads(line)
+
+
+def merge_report_partials(fileobj, headers, report_format, partials, storage):
+    """
+    Merges shard outputs (`{"platform", "path", ...}` dicts in shard order,
+    plus `rows` and `widths` for xlsx) into the final report written to `fileobj`.
+    """
+    if report_format == 'csv.gz':
+        with gzip.GzipFile(fileobj=fileobj, mode='wb') as gz, io.TextIOWrapper(gz, encoding='utf-8', newline='') as text:
+            csv.writer(text).writerow([name for name, _ in headers])
+        for partial in partials:
+            with storage.open(partial['path'], 'rb') as part:
+                shutil.copyfileobj(part, fileobj)
+        return
+
+    if report_format == 'parquet':
+        import pyarrow.parquet as pq
+
+        with pq.ParquetWriter(fileobj, arrow_schema([key for _, key in headers]), compression='snappy') as writer:
+            for partial in partials:
+                with storage.open(partial['path'], 'rb') as part:
+                    parquet_file = pq.ParquetFile(part)
+                    for index in range(parquet_file.num_row_groups):
+                        writer.write_table(parquet_file.read_row_group(index))
+        return
+
+    by_platform = {}
+    for partial in partials:
+        by_platform.setdefault(partial['platform'], []).append(partial)
+
+    workbook = Workbook(write_only=True)
+    sheets = [("All Data", partials)] + [
+        (platform, platform_partials) for platform, platform_partials in by_platform.items()
+        if any(partial['rows'] for partial in platform_partials)
+    ]
+    for title, sheet_partials in sheets:
+        sheet = workbook.create_sheet(title)
+        for col_num, (name, _) in enumerate(headers, 1):
+            width = max([len(name)] + [partial['widths'][col_num - 1] for partial in sheet_partials])
+            sheet.column_dimensions[get_column_letter(col_num)].width = min(width + 2, MAX_COLUMN_WIDTH)
+        sheet.append(_header_cells(sheet, headers))
+        for row in _iter_partial_rows([partial['path'] for partial in sheet_partials], storage):
+            sheet.append(row)
+    workbook.save(fileobj)
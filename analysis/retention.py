@@ -0,0 +1,164 @@
+"""
+Retention policy for `AnalysisDaily`.
+
+Days older than `ANALYTICS_DAILY_RETENTION_DAYS` are compacted: the DAY
+rows of a month are replaced by one MONTH row per campaign key, dated the
+first of the month, and their device rows likewise. All facts are integers,
+so a MONTH row carries exactly the sum of the days it replaces; month
+rollups, dashboard and report totals are unchanged. Day rollups computed
+before compaction are left in place.
+
+Readers select a date range with `period_filter`: a range that covers only
+part of a compacted month reads that whole month's MONTH row, and every
+reader reports the granularity of what it returns.
+
+Compaction runs one organization month per transaction and re-sums any
+MONTH row already present, so it can be interrupted and rerun at any time.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import AnalysisDaily, AnalysisDailyDevice
+from .rollups import month_start, next_month
+
+DEFAULT_RETENTION_DAYS = 400
+KEY_FIELDS = ['platform', 'account_id', 'campaign_id', 'adgroup_id']
+FACT_FIELDS = ['impressions', 'clicks', 'spend_minor', 'conversions', 'conversion_value_minor']
+
+
+def get_retention_days():
+    return getattr(settings, 'ANALYTICS_DAILY_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+
+
+def retention_cutoff(today=None):
+    """
+    First day still kept at daily granularity: the start of the month the
+    retention horizon falls in. `None` when retention is disabled.
+    """
+    days = get_retention_days()
+    if not days:
+        return None
+    today = today or timezone.now().date()
+    return month_start(today - timedelta(days=days))
+
+
+def period_filter(start_date, end_date, prefix=''):
+    """
+    Q for the rows of `start_date`..`end_date`: DAY rows dated within it and
+    the MONTH rows of every month it touches. `prefix` reaches AnalysisDaily
+    through a relation, e.g. `daily__`.
+    """
+    return Q(**{
+        f'{prefix}granularity': AnalysisDaily.Granularity.DAY,
+        f'{prefix}date__gte': start_date,
+        f'{prefix}date__lte': end_date,
+    }) | Q(**{
+        f'{prefix}granularity': AnalysisDaily.Granularity.MONTH,
+        f'{prefix}date__gte': month_start(start_date),
+        f'{prefix}date__lte': end_date,
+    })
+
+
+def pending_months(organization_id=None, before=None):
+    """
+    `(organization_id, month)` pairs that still hold DAY rows before
+    `before` (defaults to `retention_cutoff()`), oldest first.
+    """
+    before = before or retention_cutoff()
+    if before is None:
+        return []
+
+    rows = AnalysisDaily.objects.filter(granularity=AnalysisDaily.Granularity.DAY, date__lt=month_start(before))
+    if organization_id is not None:
+        rows = rows.filter(organization_id=organization_id)
+    return list(
+        rows.annotate(month=TruncMonth('date'))
+        .values_list('organization_id', 'month')
+        .distinct()
+        .order_by('month', 'organization_id')
+    )
+
+
+def compact_month(organization_id, month):
+    """
+    Replaces the DAY rows of one organization month with MONTH rows.
+    Returns the number of DAY rows removed.
+    """
+    month = month_start(month)
+    rows = AnalysisDaily.objects.filter(organization_id=organization_id, date__gte=month, date__lt=next_month(month))
+    devices = AnalysisDailyDevice.objects.filter(organization_id=organization_id, date__gte=month, date__lt=next_month(month))
+    day_rows = rows.filter(granularity=AnalysisDaily.Granularity.DAY)
+
+    with transaction.atomic():
+        # Summed over DAY and MONTH rows alike, so a rerun is a no-op
+        totals = list(
+            rows.values(*KEY_FIELDS)
+            .annotate(last_campaign_name=Max('campaign_name'), **{f'total_{field}': Sum(field) for field in FACT_FIELDS})
+            .order_by()
+        )
+        device_totals = list(
+            devices.values(*[f'daily__{field}' for field in KEY_FIELDS], 'device')
+            .annotate(**{f'total_{field}': Sum(field) for field in FACT_FIELDS})
+            .order_by()
+        )
+        if not totals:
+            return 0
+
+        devices.delete()
+        # A raw DELETE skips the per row post_delete signal: the month totals
+        # (and so every rollup) are the same before and after compaction
+        removed = day_rows._raw_delete(day_rows.db)
+
+        AnalysisDaily.objects.bulk_create(
+            [
+                AnalysisDaily(
+                    organization_id=organization_id,
+                    date=month,
+                    granularity=AnalysisDaily.Granularity.MONTH,
+                    campaign_name=row['last_campaign_name'],
+                    **{field: row[field] for field in KEY_FIELDS},
+                    **{field: row[f'total_{field}'] or 0 for field in FACT_FIELDS},
+                )
+                for row in totals
+            ],
+            update_conflicts=True,
+            unique_fields=['organization', *KEY_FIELDS, 'date', 'granularity'],
+            update_fields=['campaign_name', *FACT_FIELDS, 'updated_at'],
+        )
+
+        parents = {
+            tuple(key): parent_id
+            for parent_id, *key in rows.filter(granularity=AnalysisDaily.Granularity.MONTH, adgroup_id="")
+            .values_list('id', *KEY_FIELDS)
+        }
+        AnalysisDailyDevice.objects.bulk_create([
+            AnalysisDailyDevice(
+                daily_id=parents[key],
+                organization_id=organization_id,
+                platform=row['daily__platform'],
+                date=month,
+                device=row['device'],
+                **{field: row[f'total_{field}'] or 0 for field in FACT_FIELDS},
+            )
+            for row in device_totals
+            if (key := tuple(row[f'daily__{field}'] for field in KEY_FIELDS)) in parents
+        ])
+
+    return removed
+
+
+def compact_analytics(organization_id=None, before=None):
+    """
+    Compacts every organization month before the retention cutoff.
+    Returns `{"months": int, "rows": int}`.
+    """
+    months = rows = 0
+    for org_id, month in pending_months(organization_id, before):
+        rows += compact_month(org_id, month)
+        months += 1
+    return {"months": months, "rows": rows}
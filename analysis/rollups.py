@@ -0,0 +1,124 @@
+"""
+Incremental maintenance of `AnalysisRollup`.
+
+Whenever AnalysisDaily rows are written, only the day and month buckets
+they fall into are re-summed from the daily table and upserted. Re-summing
+(instead of applying deltas) keeps the rollups exact however often the same
+rows are re-synced; all facts are integers, so the sums are exact too.
+"""
+from datetime import date, datetime, timedelta
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from .models import AnalysisDaily, AnalysisRollup
+
+ROLLUP_FIELDS = ['spend_minor', 'impressions', 'clicks', 'conversions', 'conversion_value_minor', 'row_count']
+
+
+def as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def month_start(value):
+    return value.replace(day=1)
+
+
+def next_month(value):
+    return (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def rollup_aggregates():
+    # Prefixed, an annotation may not shadow a model field
+    return {
+        **{f'total_{field}': Sum(field) for field in ROLLUP_FIELDS if field != 'row_count'},
+        'total_row_count': Count('id'),
+    }
+
+
+def refresh_rollups(organization_id, touched):
+    """
+    Re-sums the day and month buckets of `touched`, an iterable of
+    `(platform, date)` pairs that were just written for the organization.
+    Buckets left without daily rows are removed.
+    """
+    days = {(platform, as_date(day)) for platform, day in touched}
+    if not days:
+        return
+    months = {(platform, month_start(day)) for platform, day in days}
+
+    daily = AnalysisDaily.objects.filter(
+        organization_id=organization_id,
+        platform__in={platform for platform, _ in days},
+    )
+    day_totals = {
+        (row['platform'], row['date']): row
+        # Compacted MONTH rows are dated the 1st but belong to the whole month
+        for row in daily.filter(date__in={day for _, day in days}, granularity=AnalysisDaily.Granularity.DAY)
+        .values('platform', 'date')
+        .annotate(**rollup_aggregates())
+    }
+    month_totals = {
+        (row['platform'], row['month']): row
+        for row in daily.filter(
+            date__gte=min(month for _, month in months),
+            date__lt=next_month(max(month for _, month in months)),
+        )
+        .annotate(month=TruncMonth('date'))
+        .values('platform', 'month')
+        .annotate(**rollup_aggregates())
+    }
+
+    rollups = []
+    empty = []
+    for period, buckets, totals in (
+        (AnalysisRollup.Period.DAY, days, day_totals),
+        (AnalysisRollup.Period.MONTH, months, month_totals),
+    ):
+        for platform, bucket in buckets:
+            row = totals.get((platform, bucket))
+            if row is None:
+                empty.append(Q(period=period, platform=platform, date=bucket))
+                continue
+            rollups.append(AnalysisRollup(
+                organization_id=organization_id,
+                platform=platform,
+                period=period,
+                date=bucket,
+                **{field: row[f'total_{field}'] or 0 for field in ROLLUP_FIELDS},
+            ))
+
+    with transaction.atomic():
+        AnalysisRollup.objects.bulk_create(
+            rollups,
+            update_conflicts=True,
+            unique_fields=['organization', 'platform', 'period', 'date'],
+            update_fields=ROLLUP_FIELDS + ['updated_at'],
+        )
+        if empty:
+            AnalysisRollup.objects.filter(reduce(or_, empty), organization_id=organization_id).delete()
+
+
+def rebuild_rollups(organization_id=None):
+    """
+    Recomputes every rollup from scratch, e.g. after importing data
+    outside the ingestion path. Returns the number of organizations rebuilt.
+    """
+    daily = AnalysisDaily.objects.all()
+    if organization_id is not None:
+        daily = daily.filter(organization_id=organization_id)
+
+    org_ids = list(daily.values_list('organization_id', flat=True).distinct())
+    for org_id in org_ids:
+        touched = daily.filter(organization_id=org_id).values_list('platform', 'date').distinct()
+        with transaction.atomic():
+            AnalysisRollup.objects.filter(organization_id=org_id).delete()
+            refresh_rollups(org_id, touched.iterator())
+    return len(org_ids)
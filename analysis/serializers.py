@@ -4,4 +4,4 @@ from .models import AnalysisDaily, Report
 class ReportSerializer(serializers.ModelSerializer):
     class Meta:
         model = Report
-        fields = ['id', 'name', 'created_at', 'report_type', 'file']
\ No newline at end of file
+        fields = ['id', 'name', 'created_at', 'report_type', 'format', 'file']
\ No newline at end of file
@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from analysis.models import AnalysisDaily
+from analysis.rollups import refresh_rollups
+from main.utils.dashboard_cache import invalidate_dashboard_on_commit
+
+# Bulk ingestion refreshes rollups itself; these cover one-off writes (admin, shell)
+@receiver([post_save, post_delete], sender=AnalysisDaily)
+def analysis_daily_change_handler(sender, instance, **kwargs):
+    touched = [(instance.platform, instance.date)]
+    transaction.on_commit(lambda: refresh_rollups(instance.organization_id, touched))
+    invalidate_dashboard_on_commit(instance.organization_id)
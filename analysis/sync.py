@@ -0,0 +1,402 @@
+"""
+Concurrent analytics sync engine.
+
+Fans out over ad integrations from a single Celery worker using asyncio and
+one pooled httpx client, with a semaphore per platform so each ad network
+only sees a bounded number of in-flight requests. Report pages are streamed
+chunk by chunk into the `AnalysisDaily` bulk upsert, so running the same
+sync twice is harmless.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+from functools import partial
+from typing import NamedTuple
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import AdIntegration, Platform
+from main.utils import meta_handler, tiktok_handler
+from main.utils.analytics import BULK_CHUNK_SIZE, bulk_save_device_metrics, bulk_save_daily_analytics
+
+from .rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Max in-flight integrations per platform for one worker
+DEFAULT_CONCURRENCY = {
+    Platform.TIKTOK: 10,
+    Platform.META: 10,
+    Platform.GOOGLE: 5,
+}
+
+PROGRESS_KEY = "analytics_sync:{org_id}"
+PROGRESS_TTL = 60 * 60 * 24
+
+
+def get_concurrency():
+    return {**DEFAULT_CONCURRENCY, **getattr(settings, 'ANALYTICS_SYNC_CONCURRENCY', {})}
+
+
+def get_sync_progress(org_id):
+    return cache.get(PROGRESS_KEY.format(org_id=org_id))
+
+
+async def write_rows(rows, writer, organization, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Feeds an async row stream into one of the sync bulk writers chunk by
+    chunk, so a report is never held in memory as a whole.
+    """
+    totals = {}
+    chunk = []
+
+    async def flush():
+        result = await sync_to_async(writer)(chunk, organization) or {}
+        for key, value in result.items():
+            totals[key] = totals.get(key, 0) + value
+
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            await flush()
+            chunk = []
+    if chunk:
+        await flush()
+    return totals
+
+
+async def sync_tiktok(http, integration, start_date, end_date):
+    client = tiktok_handler.AsyncTikTokClient.for_integration(integration, http=http)
+    valid_camps = await tiktok_handler.aget_campaign_names(client)
+    if not valid_camps:
+        return {}
+
+    result = await write_rows(
+        tiktok_handler.aiter_analytics_rows(
+            client, valid_camps, start_date, end_date,
+            tiktok_handler.DAILY_DIMENSIONS, tiktok_handler.daily_row_from_report,
+        ),
+        bulk_save_daily_analytics, integration.organization,
+    )
+    await write_rows(
+        tiktok_handler.aiter_analytics_rows(
+            client, valid_camps, start_date, end_date,
+            tiktok_handler.DEVICE_DIMENSIONS, tiktok_handler.device_row_from_report,
+        ),
+        bulk_save_device_metrics, integration.organization,
+    )
+    return result
+
+
+async def sync_meta(http, integration, start_date, end_date):
+    args = (http, integration.access_token, integration.ad_account_id, start_date, end_date)
+    result = await write_rows(meta_handler.aiter_analytics_rows(*args), bulk_save_daily_analytics, integration.organization)
+    await write_rows(meta_handler.aiter_device_rows(*args), bulk_save_device_metrics, integration.organization)
+    return result
+
+
+# Google Ads reporting needs a developer token and GAQL access that the
+# project does not provision yet; integrations without a syncer are skipped.
+SYNCERS = {
+    Platform.TIKTOK: sync_tiktok,
+    Platform.META: sync_meta,
+}
+
+
+class SyncJob(NamedTuple):
+    integration: AdIntegration
+    start_date: str
+    end_date: str
+
+
+class SyncProgress:
+    """
+    Per organization counters mirrored to the cache after every job,
+    so the API can report how far a sync has got.
+    """
+
+    def __init__(self, jobs):
+        self.state = {}
+        for job in jobs:
+            org_id = job.integration.organization.snowflake_id
+            state = self.state.setdefault(org_id, {
+                'status': 'RUNNING',
+                'start_date': job.start_date,
+                'end_date': job.end_date,
+                'total': 0,
+                'done': 0,
+                'failed': 0,
+                'skipped': 0,
+                'errors': {},
+                'started_at': timezone.now().isoformat(),
+                'finished_at': None,
+            })
+            state['start_date'] = min(state['start_date'], job.start_date)
+            state['end_date'] = max(state['end_date'], job.end_date)
+            state['total'] += 1
+
+    async def publish(self, org_id):
+        await cache.aset(PROGRESS_KEY.format(org_id=org_id), self.state[org_id], PROGRESS_TTL)
+
+    async def publish_all(self):
+        for org_id in self.state:
+            await self.publish(org_id)
+
+    async def record(self, job, outcome, error=None):
+        integration = job.integration
+        org_id = integration.organization.snowflake_id
+        state = self.state[org_id]
+        state[outcome] += 1
+        if error:
+            state['errors'][f"{integration.platform}:{integration.ad_account_id}:{job.start_date}"] = error
+        if state['done'] + state['failed'] + state['skipped'] == state['total']:
+            state['status'] = 'FAILED' if state['failed'] else 'COMPLETED'
+            state['finished_at'] = timezone.now().isoformat()
+        await self.publish(org_id)
+
+
+async def run_job(http, job, semaphores, progress, on_done=None):
+    integration = job.integration
+    syncer = SYNCERS.get(integration.platform)
+    if syncer is None or not integration.ad_account_id:
+        await progress.record(job, 'skipped')
+        return
+
+    try:
+        async with semaphores[integration.platform]:
+            await syncer(http, integration, job.start_date, job.end_date)
+        if on_done:
+            await sync_to_async(on_done)(job)
+    except Exception as exc:
+        logger.exception("Analytics sync failed for integration %s (%s - %s)", integration.id, job.start_date, job.end_date)
+        await progress.record(job, 'failed', error=str(exc))
+        return
+
+    await progress.record(job, 'done')
+
+
+async def run_sync(jobs, on_done=None):
+    """
+    Runs every `SyncJob` concurrently, bounded per platform. `on_done(job)`
+    is called (in a thread) after each successful job.
+    """
+    concurrency = get_concurrency()
+    semaphores = defaultdict(lambda: asyncio.Semaphore(1))
+    semaphores.update({platform: asyncio.Semaphore(limit) for platform, limit in concurrency.items()})
+
+    progress = SyncProgress(jobs)
+    await progress.publish_all()
+
+    total_limit = sum(concurrency.values())
+    # Every request draws from the shared per platform/app budgets first
+    limiter = RateLimiter()
+    try:
+        async with httpx.AsyncClient(
+            timeout=httpx.Timeout(30, connect=5),
+            limits=httpx.Limits(max_connections=total_limit, max_keepalive_connections=total_limit),
+            event_hooks={'request': [limiter.request_hook]},
+        ) as http:
+            await asyncio.gather(*(
+                run_job(http, job, semaphores, progress, on_done=on_done)
+                for job in jobs
+            ))
+    finally:
+        await limiter.aclose()
+
+    return progress.state
+
+
+def sync_analytics(organization=None, target_date=None):
+    """
+    Syncs every active integration (optionally of a single organization).
+    With `target_date` (YYYY-MM-DD) only that day is fetched; otherwise each
+    integration fetches what its `IntegrationSyncState` says is new or still
+    restatable (see `plan_sync`) and the state is advanced as it completes.
+    Returns the per organization progress summary.
+    """
+    integrations = AdIntegration.objects.filter(is_active=True).select_related('organization')
+    if organization is not None:
+        integrations = integrations.filter(organization=organization)
+
+    on_done = None
+    if target_date:
+        jobs = [SyncJob(integration, target_date, target_date) for integration in integrations]
+    else:
+        jobs = incremental_jobs(list(integrations))
+        on_done = _checkpoint_sync
+
+    if not jobs:
+        return {}
+    return asyncio.run(run_sync(jobs, on_done=on_done))
+
+
+# --- Backfill ---
+
+# Widest date range a single report request may cover per platform
+MAX_WINDOW_DAYS = {
+    Platform.TIKTOK: 30,
+    Platform.META: 90,
+    Platform.GOOGLE: 30,
+}
+
+
+def split_windows(start_date, end_date, window_days):
+    """
+    Splits the inclusive [start_date, end_date] range into consecutive
+    windows of at most `window_days` days.
+    """
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(days=1)
+    return windows
+
+
+def _checkpoint_window(backfill_id, job):
+    from .models import AnalyticsBackfill
+
+    with transaction.atomic():
+        backfill = AnalyticsBackfill.objects.select_for_update().get(id=backfill_id)
+        if job.start_date not in backfill.completed_windows:
+            backfill.completed_windows = [*backfill.completed_windows, job.start_date]
+            backfill.save(update_fields=['completed_windows', 'updated_at'])
+
+
+def run_backfill(backfill):
+    """
+    Syncs every window of `backfill` that has not completed yet, running
+    windows in parallel. Each finished window is checkpointed, so calling
+    this again after an interruption resumes where it stopped.
+    """
+    from .models import AnalyticsBackfill
+
+    integration = backfill.integration
+    pending = [
+        SyncJob(integration, window_start.isoformat(), window_end.isoformat())
+        for window_start, window_end in split_windows(backfill.start_date, backfill.end_date, backfill.window_days)
+        if window_start.isoformat() not in backfill.completed_windows
+    ]
+
+    backfill.status = AnalyticsBackfill.Status.RUNNING
+    backfill.save(update_fields=['status', 'updated_at'])
+
+    summary = asyncio.run(run_sync(pending, on_done=partial(_checkpoint_window, backfill.id))) if pending else {}
+
+    backfill.refresh_from_db()
+    remaining = len(split_windows(backfill.start_date, backfill.end_date, backfill.window_days)) - len(backfill.completed_windows)
+    backfill.status = AnalyticsBackfill.Status.COMPLETED if remaining <= 0 else AnalyticsBackfill.Status.FAILED
+    backfill.save(update_fields=['status', 'updated_at'])
+    return summary
+
+
+# --- Incremental sync ---
+
+# Days back a platform keeps restating conversions of a day
+DEFAULT_ATTRIBUTION_WINDOW_DAYS = {
+    Platform.TIKTOK: 7,
+    Platform.META: 28,
+    Platform.GOOGLE: 30,
+}
+DEFAULT_ATTRIBUTION_REFRESH_HOURS = 24
+
+
+def get_attribution_windows():
+    return {**DEFAULT_ATTRIBUTION_WINDOW_DAYS, **getattr(settings, 'ANALYTICS_ATTRIBUTION_WINDOW_DAYS', {})}
+
+
+class SyncPlan(NamedTuple):
+    start_date: date
+    end_date: date
+    refresh_attribution: bool
+
+
+def plan_sync(integration, state, now=None):
+    """
+    Date range the next sync of `integration` needs: from its last synced
+    day (fetched again, it may have been partial) through today, widened to
+    the platform's attribution window once every
+    `ANALYTICS_ATTRIBUTION_REFRESH_HOURS`. An integration that never synced
+    starts with one attribution window, older history is left to backfills.
+    """
+    now = now or timezone.now()
+    today = now.date()
+    window_start = today - timedelta(days=get_attribution_windows().get(integration.platform, 1) - 1)
+
+    if state is None or state.last_synced_date is None:
+        return SyncPlan(window_start, today, True)
+
+    refresh_every = timedelta(hours=getattr(settings, 'ANALYTICS_ATTRIBUTION_REFRESH_HOURS', DEFAULT_ATTRIBUTION_REFRESH_HOURS))
+    refresh = state.attribution_refreshed_at is None or now - state.attribution_refreshed_at >= refresh_every
+    start_date = min(state.last_synced_date, window_start) if refresh else state.last_synced_date
+    return SyncPlan(min(start_date, today), today, refresh)
+
+
+def _plan_windows(integration, start_date, end_date):
+    return split_windows(start_date, end_date, MAX_WINDOW_DAYS.get(integration.platform, 30))
+
+
+def incremental_jobs(integrations):
+    """
+    Plans the next sync of each integration and records the plan as its
+    cursor. A cursor left by an interrupted run for the same range is
+    resumed, skipping the windows it already finished.
+    """
+    from .models import IntegrationSyncState
+
+    states = {state.integration_id: state for state in IntegrationSyncState.objects.filter(integration__in=integrations)}
+    jobs = []
+    for integration in integrations:
+        state = states.get(integration.id) or IntegrationSyncState(integration=integration)
+        plan = plan_sync(integration, state)
+        cursor = {
+            'start_date': plan.start_date.isoformat(),
+            'end_date': plan.end_date.isoformat(),
+            'refresh_attribution': plan.refresh_attribution,
+            'completed_windows': [],
+        }
+        if (state.cursor.get('start_date'), state.cursor.get('end_date')) == (cursor['start_date'], cursor['end_date']):
+            cursor['completed_windows'] = state.cursor.get('completed_windows', [])
+            cursor['refresh_attribution'] = cursor['refresh_attribution'] or state.cursor.get('refresh_attribution', False)
+        state.cursor = cursor
+        state.save()
+
+        jobs.extend(
+            SyncJob(integration, window_start.isoformat(), window_end.isoformat())
+            for window_start, window_end in _plan_windows(integration, plan.start_date, plan.end_date)
+            if window_start.isoformat() not in cursor['completed_windows']
+        )
+    return jobs
+
+
+def _checkpoint_sync(job):
+    """Marks a window of the integration's current plan done, and the plan once all its windows are."""
+    from .models import IntegrationSyncState
+
+    with transaction.atomic():
+        state = IntegrationSyncState.objects.select_for_update().get(integration_id=job.integration.id)
+        cursor = state.cursor
+        if not cursor:
+            return
+        completed = cursor['completed_windows']
+        if job.start_date not in completed:
+            completed = [*completed, job.start_date]
+
+        windows = _plan_windows(job.integration, date.fromisoformat(cursor['start_date']), date.fromisoformat(cursor['end_date']))
+        if len(completed) < len(windows):
+            state.cursor = {**cursor, 'completed_windows': completed}
+        else:
+            now = timezone.now()
+            state.last_synced_date = date.fromisoformat(cursor['end_date'])
+            if cursor.get('refresh_attribution'):
+                state.attribution_refreshed_at = now
+            state.last_success_at = now
+            state.cursor = {}
+        state.save()
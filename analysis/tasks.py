@@ -1,10 +1,7 @@
 import logging
+import tempfile
 from celery import shared_task
-from datetime import datetime
-from io import BytesIO
-from django.core.files.base import ContentFile
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill
+from django.core.files import File
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +10,8 @@ METRIC_MAP = {
     'spend': ('Spend', 'spend'),
     'impressions': ('Impressions', 'impressions'),
     'clicks': ('Clicks', 'clicks'),
+    'conversions': ('Conversions', 'conversions'),
+    'conversion_value': ('Conversion Value', 'conversion_value'),
     'ctr': ('CTR', 'ctr'),
     'cpc': ('CPC', 'cpc'),
     'roas': ('ROAS', 'roas'),
@@ -27,132 +26,304 @@ BASE_HEADERS = [
     ('Campaign Name', 'campaign_name'),
     ('Adgroup ID', 'adgroup_id'),
     ('Date', 'date'),
+    # DAY, or MONTH for a compacted month dated its first day
+    ('Granularity', 'granularity'),
 ]
 
 
+# Reports spanning more days than this are built as per platform/month shards
+REPORT_SHARD_MIN_DAYS = 92
+
+
+def report_headers(report):
+    """Dynamic `(display name, field)` headers based on the selected metrics."""
+    included_metrics = [m.lower() for m in (report.included_metrics or [])]
+
+    headers = list(BASE_HEADERS)
+    for metric_key in included_metrics:
+        if metric_key in METRIC_MAP:
+            display_name, _ = METRIC_MAP[metric_key]
+            headers.append((display_name, metric_key))
+
+    # If no metrics selected, include all
+    if not included_metrics:
+        for key, (display_name, _) in METRIC_MAP.items():
+            headers.append((display_name, key))
+    return headers
+
+
+def _save_report(report, write):
+    """
+    Streams `write(fileobj)` to a temp file, then to storage, completes the
+    report and notifies the organization's owners / admins.
+    """
+    from .models import Report
+    from main.models import OrganizationMember
+    from accounts.models import Notification
+
+    organization = report.organization
+    report_format = report.format or Report.Format.XLSX
+    filename = f"{report.report_type.capitalize()}_report_{organization.name}_{report.start_date.strftime('%Y%m%d')}_{report.end_date.strftime('%Y%m%d')}.{report_format}"
+    with tempfile.NamedTemporaryFile(suffix=f'.{report_format}') as report_file:
+        write(report_file)
+        report_file.seek(0)
+        report.file.save(filename, File(report_file), save=False)
+    report.name = filename
+    report.status = Report.Status.COMPLETED
+    report.save()
+
+    # Create in-app notification for all org owners / admins
+    members = OrganizationMember.objects.filter(
+        organization=organization,
+        role__in=['OWNER', 'ADMIN'],
+        status='ACTIVE',
+    ).select_related('user')
+
+    notifications = [
+        Notification(
+            user=member.user,
+            organization=organization,
+            message=f"Your report \"{filename}\" has been generated successfully and is ready for download.",
+        )
+        for member in members
+    ]
+    Notification.objects.bulk_create(notifications)
+
+    logger.info("Report %s generated successfully for org %s", report.id, organization.name)
+
+
+def _mark_report_failed(report_id):
+    from .models import Report
+    Report.objects.filter(id=report_id).update(status=Report.Status.FAILED)
+
+
 @shared_task(bind=True, max_retries=3)
 def generate_report_task(self, report_id):
-    """Background task to generate an Excel report."""
-    from .models import AnalysisDaily, Report
-    from main.models import Organization
-    from accounts.models import Notification
+    """
+    Background task to generate a report in its requested format. Reports
+    longer than `REPORT_SHARD_MIN_DAYS` fan out as a chord of per
+    platform/month shards merged by `merge_report_shards_task`.
+    """
+    from celery import chord
+    from .models import Report
+    from .report_writers import REPORT_WRITERS, report_shards
+    from .report_cache import report_watermark
 
     try:
         report = Report.objects.select_related('organization').get(id=report_id)
-        organization = report.organization
-        included_platforms = [p.upper() for p in (report.included_platforms or [])]
-        included_metrics = [m.lower() for m in (report.included_metrics or [])]
-
-        # Build dynamic headers based on selected metrics
-        headers = list(BASE_HEADERS)
-        for metric_key in included_metrics:
-            if metric_key in METRIC_MAP:
-                display_name, _ = METRIC_MAP[metric_key]
-                headers.append((display_name, metric_key))
-
-        # If no metrics selected, include all
-        if not included_metrics:
-            for key, (display_name, _) in METRIC_MAP.items():
-                headers.append((display_name, key))
-
-        # Gather data per platform
-        platform_data = {}
-        all_data = []
-
-        for platform_key in included_platforms or ['META', 'GOOGLE', 'TIKTOK']:
-            integration = organization.integrations.filter(platform=platform_key).first()
-            if integration:
-                qs = AnalysisDaily.objects.filter(
-                    platform=platform_key,
-                    account_id=integration.ad_account_id,
-                )
-                
-                # Apply date range filter if available
-                if report.start_date and report.end_date:
-                    qs = qs.filter(date__gte=report.start_date, date__lte=report.end_date)
-                
-                data = list(qs.values())
-                if data:
-                    platform_data[platform_key] = data
-                    all_data.extend(data)
-
-        # ── Build Excel workbook ──
-        wb = Workbook()
-        header_names = [h[0] for h in headers]
-        header_keys = [h[1] for h in headers]
-
-        def populate_sheet(sheet, data, sheet_name):
-            sheet.title = sheet_name
-
-            for col_num, header in enumerate(header_names, 1):
-                cell = sheet.cell(row=1, column=col_num, value=header)
-                cell.font = Font(bold=True, color="FFFFFF")
-                cell.fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-
-            for row_num, record in enumerate(data, 2):
-                for col_num, key in enumerate(header_keys, 1):
-                    value = record.get(key)
-                    # Convert date objects to string for Excel compatibility
-                    if hasattr(value, 'isoformat'):
-                        value = value.isoformat()
-                    sheet.cell(row=row_num, column=col_num, value=value)
-
-            for col in sheet.columns:
-                max_length = 0
-                column_letter = col[0].column_letter
-                for cell in col:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except Exception:
-                        pass
-                sheet.column_dimensions[column_letter].width = min(max_length + 2, 50)
-
-        # All Data sheet
-        populate_sheet(wb.active, all_data, "All Data")
-
-        # Per-platform sheets
-        for platform_key, data in platform_data.items():
-            ws = wb.create_sheet(platform_key)
-            populate_sheet(ws, data, platform_key)
-
-        # Save to file
-        filename = f"{report.report_type.capitalize()}_report_{organization.name}_{report.start_date.strftime('%Y%m%d')}_{report.end_date.strftime('%Y%m%d')}.xlsx"
-        excel_file = BytesIO()
-        wb.save(excel_file)
-        excel_file.seek(0)
-
-        report.file.save(filename, ContentFile(excel_file.read()), save=False)
-        report.name = filename
-        report.status = Report.Status.COMPLETED
-        report.save()
-
-        # Create in-app notification for all org owners / admins
-        from main.models import OrganizationMember
-        members = OrganizationMember.objects.filter(
-            organization=organization,
-            role__in=['OWNER', 'ADMIN'],
-            status='ACTIVE',
-        ).select_related('user')
-
-        notifications = [
-            Notification(
-                user=member.user,
-                organization=organization,
-                message=f"Your report \"{filename}\" has been generated successfully and is ready for download.",
-            )
-            for member in members
-        ]
-        Notification.objects.bulk_create(notifications)
+        headers = report_headers(report)
+
+        # Record the state of the data actually read, a write landing after
+        # this point only makes the report look stale, never wrongly fresh
+        report.data_watermark = report_watermark(report)
+
+        shards = report_shards(report)
+        if len(shards) > 1 and (report.end_date - report.start_date).days >= REPORT_SHARD_MIN_DAYS:
+            report.save(update_fields=['data_watermark'])
+            chord(
+                generate_report_shard_task.s(report_id, platform, start_date.isoformat(), end_date.isoformat())
+                for platform, start_date, end_date in shards
+            )(merge_report_shards_task.s(report_id))
+            logger.info("Report %s split into %s shards", report_id, len(shards))
+            return
 
-        logger.info("Report %s generated successfully for org %s", report_id, organization.name)
+        report_format = report.format or Report.Format.XLSX
+        _save_report(report, lambda report_file: REPORT_WRITERS[report_format](report_file, report, headers))
 
     except Exception as exc:
         logger.exception("Report generation failed for report_id=%s", report_id)
-        try:
-            report = Report.objects.get(id=report_id)
-            report.status = Report.Status.FAILED
-            report.save(update_fields=['status'])
-        except Report.DoesNotExist:
-            pass
+        # Left PENDING while retries remain, so identical requests keep
+        # coalescing onto it (see analysis.report_cache)
+        if self.request.retries >= self.max_retries:
+            _mark_report_failed(report_id)
         raise self.retry(exc=exc, countdown=60)
+
+
+REPORT_PARTS_DIR = "reports/parts/{report_id}"
+
+
+@shared_task(bind=True, max_retries=3)
+def generate_report_shard_task(self, report_id, platform, start_date, end_date):
+    """Writes one platform/month shard of a report to storage as a partial file."""
+    from datetime import date
+    from django.core.files.storage import default_storage
+    from .models import Report
+    from .report_writers import PARTIAL_SUFFIXES, shard_queryset, write_report_partial
+
+    try:
+        report = Report.objects.select_related('organization').get(id=report_id)
+        report_format = report.format or Report.Format.XLSX
+        queryset = shard_queryset(report, platform, date.fromisoformat(start_date), date.fromisoformat(end_date))
+
+        with tempfile.NamedTemporaryFile(suffix=PARTIAL_SUFFIXES[report_format]) as part_file:
+            result = write_report_partial(part_file, queryset, report_headers(report), report_format)
+            part_file.seek(0)
+            path = default_storage.save(
+                f"{REPORT_PARTS_DIR.format(report_id=report_id)}/{platform}_{start_date}{PARTIAL_SUFFIXES[report_format]}",
+                File(part_file),
+            )
+        return {**result, "platform": platform, "path": path}
+
+    except Exception as exc:
+        logger.exception("Report shard %s %s failed for report_id=%s", platform, start_date, report_id)
+        if self.request.retries >= self.max_retries:
+            _mark_report_failed(report_id)
+        raise self.retry(exc=exc, countdown=30)
+
+
+@shared_task(bind=True, max_retries=3)
+def merge_report_shards_task(self, partials, report_id):
+    """Chord callback: merges the shard partials (in shard order) into the final report."""
+    from django.core.files.storage import default_storage
+    from .models import Report
+    from .report_writers import merge_report_partials
+
+    try:
+        report = Report.objects.select_related('organization').get(id=report_id)
+        report_format = report.format or Report.Format.XLSX
+        headers = report_headers(report)
+        _save_report(report, lambda report_file: merge_report_partials(
+            report_file, headers, report_format, partials, default_storage,
+        ))
+
+    except Exception as exc:
+        logger.exception("Merging report shards failed for report_id=%s", report_id)
+        if self.request.retries >= self.max_retries:
+            _mark_report_failed(report_id)
+        raise self.retry(exc=exc, countdown=30)
+
+    for partial in partials:
+        default_storage.delete(partial['path'])
+
+
+SYNC_LOCK_KEY = "analytics_sync_lock:{scope}"
+SYNC_LOCK_TTL = 60 * 30
+
+
+@shared_task(bind=True)
+def sync_analytics_task(self, org_id=None, target_date=None):
+    """
+    Pulls platform analytics for every active integration (or only those of
+    `org_id`) into AnalysisDaily: `target_date` only, or by default the days
+    each integration's sync state says are new or still restatable.
+    Overlapping runs for the same scope are dropped; rerunning a finished
+    sync simply upserts the same rows again.
+    """
+    from django.core.cache import cache
+    from main.models import Organization
+    from .sync import sync_analytics
+
+    lock_key = SYNC_LOCK_KEY.format(scope=org_id or 'all')
+    if not cache.add(lock_key, self.request.id or True, SYNC_LOCK_TTL):
+        logger.info("Analytics sync for %s already running, skipping", org_id or 'all organizations')
+        return None
+
+    try:
+        organization = Organization.objects.get(snowflake_id=org_id) if org_id else None
+        summary = sync_analytics(organization=organization, target_date=target_date)
+        logger.info("Analytics sync finished for %s organization(s)", len(summary))
+        return summary
+    finally:
+        cache.delete(lock_key)
+
+
+BACKFILL_DAYS = 180
+
+
+def create_backfill(integration, start_date=None, end_date=None, days=BACKFILL_DAYS):
+    """
+    Returns the unfinished backfill covering the same range for `integration`
+    if there is one, so re-requesting a backfill resumes it instead of
+    starting over.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from .models import AnalyticsBackfill
+    from .sync import MAX_WINDOW_DAYS
+
+    end_date = end_date or timezone.now().date()
+    start_date = start_date or end_date - timedelta(days=days - 1)
+
+    backfill = AnalyticsBackfill.objects.filter(
+        integration=integration,
+        start_date=start_date,
+        end_date=end_date,
+    ).exclude(status=AnalyticsBackfill.Status.COMPLETED).first()
+    if backfill:
+        return backfill
+    return AnalyticsBackfill.objects.create(
+        integration=integration,
+        start_date=start_date,
+        end_date=end_date,
+        window_days=MAX_WINDOW_DAYS.get(integration.platform, 30),
+    )
+
+
+@shared_task(bind=True)
+def backfill_analytics_task(self, backfill_id):
+    """Pulls the remaining windows of an AnalyticsBackfill."""
+    from django.core.cache import cache
+    from .models import AnalyticsBackfill
+    from .sync import run_backfill
+
+    lock_key = SYNC_LOCK_KEY.format(scope=f"backfill:{backfill_id}")
+    if not cache.add(lock_key, self.request.id or True, SYNC_LOCK_TTL):
+        logger.info("Backfill %s already running, skipping", backfill_id)
+        return None
+
+    try:
+        backfill = AnalyticsBackfill.objects.select_related('integration__organization').get(id=backfill_id)
+        summary = run_backfill(backfill)
+        logger.info("Backfill %s finished with status %s", backfill_id, backfill.status)
+        return summary
+    finally:
+        cache.delete(lock_key)
+
+
+@shared_task(bind=True)
+def compact_analytics_task(self, org_id=None):
+    """
+    Compacts AnalysisDaily days past the retention horizon into monthly
+    rows and, once the table is partitioned, creates the coming months'
+    partitions. Safe to run as often as wanted.
+    """
+    from main.models import Organization
+    from .partitions import ensure_upcoming_partitions
+    from .retention import compact_analytics
+
+    organization_id = Organization.objects.get(snowflake_id=org_id).id if org_id else None
+    result = compact_analytics(organization_id)
+    created = ensure_upcoming_partitions()
+    logger.info("Compacted %s day row(s) into %s month(s), created %s partition(s)", result['rows'], result['months'], len(created))
+    return {**result, "partitions": created}
+
+
+@shared_task(bind=True)
+def schedule_analytics_syncs_task(self):
+    """
+    Celery beat entry point: queues the organization syncs due in this
+    tick (see analysis.scheduler).
+    """
+    from .scheduler import due_syncs
+
+    due = due_syncs()
+    for sync in due:
+        sync_analytics_task.apply_async(kwargs={'org_id': sync.org_id}, countdown=sync.countdown)
+    logger.info("Scheduled %s analytics sync(s), %s for active organizations", len(due), sum(sync.active for sync in due))
+    return len(due)
+
+
+@shared_task(bind=True)
+def generate_insights_task(self, end_date=None, org_id=None):
+    """
+    Nightly insight engine run over every organization (or only `org_id`)
+    for `end_date` (YYYY-MM-DD, defaults to yesterday).
+    """
+    from datetime import date
+    from main.models import Organization
+    from .insights import generate_insights
+
+    organization_ids = [Organization.objects.get(snowflake_id=org_id).id] if org_id else None
+    result = generate_insights(date.fromisoformat(end_date) if end_date else None, organization_ids)
+    logger.info("Generated %s insight(s) for %s organization(s)", result['insights'], result['organizations'])
+    return result
@@ -1,3 +1,578 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+import pyarrow.parquet as pq
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from openpyxl import load_workbook
+
+from analysis.insights import BASELINE_DAYS, RECENT_DAYS, campaign_stats, detect, rank
+from analysis.models import (
+    AnalysisDaily, AnalysisDailyDevice, AnalysisRollup, AnalyticsBackfill, IntegrationSyncState, Report,
+)
+from analysis.report_writers import (
+    PARTIAL_SUFFIXES, REPORT_WRITERS, merge_report_partials, report_querysets, report_shards, shard_queryset,
+    write_report_partial,
+)
+from analysis.rollups import next_month, rebuild_rollups, refresh_rollups
+from analysis.retention import FACT_FIELDS, compact_analytics, compact_month
+from analysis.sync import (
+    MAX_WINDOW_DAYS, SYNCERS, SyncPlan, _checkpoint_sync, incremental_jobs, plan_sync, run_backfill, split_windows,
+)
+from analysis.tasks import generate_report_task, report_headers
+from main.models import AdIntegration
+from main.utils.analytics import get_daily_analytics, get_device_breakdown
+from main.utils.testing import create_organization, use_locmem_cache
+
+MONTH = date(2020, 3, 1)
+
+
+def totals(queryset):
+    return queryset.aggregate(**{field: Sum(field) for field in FACT_FIELDS})
+
+
+@use_locmem_cache
+class CompactMonthTests(TestCase):
+    def setUp(self):
+        self.organization = create_organization("retention@example.com")
+        self.other = create_organization("other@example.com")
+
+        for campaign in ("cmp-1", "cmp-2"):
+            for day in range(31):
+                daily = self.add_day(self.organization, campaign, MONTH + timedelta(days=day), spend_minor=100 + day)
+                for device in ("IOS", "ANDROID"):
+                    AnalysisDailyDevice.objects.create(
+                        daily=daily, organization=self.organization, platform=daily.platform,
+                        date=daily.date, device=device, impressions=5, clicks=1, spend_minor=50,
+                    )
+        # Outside the compacted month or organization
+        self.add_day(self.organization, "cmp-1", date(2020, 4, 1))
+        self.add_day(self.other, "cmp-1", MONTH, account_id="acc-other")
+
+    def add_day(self, organization, campaign_id, day, account_id="acc-1", **facts):
+        return AnalysisDaily.objects.create(
+            organization=organization, platform="TIKTOK", account_id=account_id,
+            campaign_id=campaign_id, campaign_name=campaign_id, adgroup_id="", date=day,
+            impressions=facts.get("impressions", 1000), clicks=facts.get("clicks", 40),
+            spend_minor=facts.get("spend_minor", 100), conversions=facts.get("conversions", 2),
+            conversion_value_minor=facts.get("conversion_value_minor", 300),
+        )
+
+    def month_rows(self):
+        return AnalysisDaily.objects.filter(organization=self.organization, date__gte=MONTH, date__lt=date(2020, 4, 1))
+
+    def test_totals_are_preserved_and_day_rows_removed(self):
+        before = totals(self.month_rows())
+        devices_before = totals(AnalysisDailyDevice.objects.filter(organization=self.organization))
+
+        removed = compact_month(self.organization.id, MONTH)
+
+        self.assertEqual(removed, 62)
+        self.assertFalse(self.month_rows().filter(granularity=AnalysisDaily.Granularity.DAY).exists())
+        compacted = self.month_rows().filter(granularity=AnalysisDaily.Granularity.MONTH)
+        self.assertEqual(sorted(compacted.values_list('campaign_id', 'date')), [("cmp-1", MONTH), ("cmp-2", MONTH)])
+        self.assertEqual(totals(self.month_rows()), before)
+        self.assertEqual(totals(AnalysisDailyDevice.objects.filter(organization=self.organization)), devices_before)
+        self.assertEqual(
+            set(AnalysisDailyDevice.objects.filter(organization=self.organization).values_list('daily__granularity', flat=True)),
+            {AnalysisDaily.Granularity.MONTH},
+        )
+
+    def test_other_months_and_organizations_are_untouched(self):
+        compact_month(self.organization.id, MONTH)
+
+        self.assertTrue(AnalysisDaily.objects.filter(organization=self.organization, date=date(2020, 4, 1), granularity=AnalysisDaily.Granularity.DAY).exists())
+        self.assertTrue(AnalysisDaily.objects.filter(organization=self.other, date=MONTH, granularity=AnalysisDaily.Granularity.DAY).exists())
+
+    def test_rerun_is_a_no_op(self):
+        compact_month(self.organization.id, MONTH)
+        after_first = totals(self.month_rows())
+
+        self.assertEqual(compact_month(self.organization.id, MONTH), 0)
+        self.assertEqual(totals(self.month_rows()), after_first)
+        self.assertEqual(self.month_rows().count(), 2)
+
+    def test_compact_analytics_stops_at_the_cutoff(self):
+        result = compact_analytics(self.organization.id, before=date(2020, 4, 15))
+
+        self.assertEqual(result, {"months": 1, "rows": 62})
+        self.assertTrue(AnalysisDaily.objects.filter(organization=self.organization, date=date(2020, 4, 1), granularity=AnalysisDaily.Granularity.DAY).exists())
+
+
+@use_locmem_cache
+class CompactedMonthReadTests(TestCase):
+    def setUp(self):
+        self.organization = create_organization("compacted@example.com")
+        AdIntegration.objects.create(organization=self.organization, platform="TIKTOK", ad_account_id="acc-1", access_token="token")
+        for day in [MONTH + timedelta(days=offset) for offset in range(31)] + [date(2020, 4, day) for day in (1, 2, 3)]:
+            daily = AnalysisDaily.objects.create(
+                organization=self.organization, platform="TIKTOK", account_id="acc-1", campaign_id="cmp-1",
+                campaign_name="Campaign 1", adgroup_id="", date=day, impressions=1000, clicks=10, spend_minor=100,
+            )
+            AnalysisDailyDevice.objects.create(
+                daily=daily, organization=self.organization, platform="TIKTOK", date=day, device="IOS", clicks=2, spend_minor=40,
+            )
+        compact_month(self.organization.id, MONTH)
+
+    def report(self, start_date, end_date):
+        return Report.objects.create(organization=self.organization, report_type="custom", start_date=start_date, end_date=end_date)
+
+    def test_reports_read_a_partly_covered_month_as_its_month_row(self):
+        all_rows, per_platform = report_querysets(self.report(date(2020, 3, 15), date(2020, 4, 2)))
+
+        expected = [("MONTH", MONTH, 3100), ("DAY", date(2020, 4, 1), 100), ("DAY", date(2020, 4, 2), 100)]
+        self.assertEqual(list(all_rows.values_list('granularity', 'date', 'spend_minor')), expected)
+        self.assertEqual(list(per_platform["TIKTOK"].values_list('granularity', 'date', 'spend_minor')), expected)
+        self.assertIn(('Granularity', 'granularity'), report_headers(Report(included_metrics=['spend'])))
+
+    def test_shards_keep_the_month_row_in_its_month(self):
+        report = self.report(date(2020, 3, 15), date(2020, 4, 2))
+
+        shards = report_shards(report)
+        self.assertEqual(shards, [("TIKTOK", date(2020, 3, 15), date(2020, 3, 31)), ("TIKTOK", date(2020, 4, 1), date(2020, 4, 2))])
+        self.assertEqual(
+            [list(shard_queryset(report, *shard).values_list('granularity', flat=True)) for shard in shards],
+            [["MONTH"], ["DAY", "DAY"]],
+        )
+
+    def test_a_compacted_day_reads_as_its_month(self):
+        compacted = get_daily_analytics(self.organization, date(2020, 3, 15))
+        daily = get_daily_analytics(self.organization, date(2020, 4, 2))
+
+        self.assertEqual(compacted["Campaign 1"]["granularity"], "MONTH")
+        self.assertEqual(compacted["Campaign 1"]["total_performance"]["spend"], 31.0)
+        self.assertEqual(compacted["Campaign 1"]["device_breakdown"]["IOS"]["clicks"], 62)
+        self.assertEqual(daily["Campaign 1"]["granularity"], "DAY")
+        self.assertEqual(daily["Campaign 1"]["total_performance"]["spend"], 1.0)
+
+    def test_device_breakdown_separates_month_rows(self):
+        breakdown = get_device_breakdown(self.organization, date(2020, 3, 15), date(2020, 4, 2))
+
+        self.assertEqual(
+            sorted((row["granularity"], row["clicks"]) for row in breakdown),
+            [("DAY", 4), ("MONTH", 62)],
+        )
+
+
+@use_locmem_cache
+class GenerateReportTaskTests(TestCase):
+    def test_the_report_stays_pending_until_the_last_retry(self):
+        organization = create_organization("report-task@example.com")
+        report = Report.objects.create(organization=organization, report_type="custom", start_date=date(2024, 1, 1), end_date=date(2024, 1, 31))
+        statuses = []
+
+        def failing_shards(report):
+            statuses.append(Report.objects.get(id=report.id).status)
+            raise RuntimeError("storage unavailable")
+
+        with mock.patch('analysis.report_writers.report_shards', side_effect=failing_shards), self.assertLogs('analysis.tasks', 'ERROR'):
+            result = generate_report_task.apply(args=[report.id])
+
+        self.assertIsInstance(result.result, RuntimeError)
+        self.assertEqual(statuses, [Report.Status.PENDING] * (generate_report_task.max_retries + 1))
+        report.refresh_from_db()
+        self.assertEqual(report.status, Report.Status.FAILED)
+
+
+class SplitWindowsTests(SimpleTestCase):
+    def test_edges(self):
+        cases = [
+            ((date(2024, 1, 1), date(2024, 1, 1), 30), [(date(2024, 1, 1), date(2024, 1, 1))]),
+            ((date(2024, 1, 1), date(2024, 1, 30), 30), [(date(2024, 1, 1), date(2024, 1, 30))]),
+            ((date(2024, 1, 1), date(2024, 1, 31), 30), [(date(2024, 1, 1), date(2024, 1, 30)), (date(2024, 1, 31), date(2024, 1, 31))]),
+            ((date(2024, 2, 27), date(2024, 3, 2), 2), [(date(2024, 2, 27), date(2024, 2, 28)), (date(2024, 2, 29), date(2024, 3, 1)), (date(2024, 3, 2), date(2024, 3, 2))]),
+            ((date(2024, 1, 2), date(2024, 1, 1), 30), []),
+        ]
+        for args, expected in cases:
+            with self.subTest(args=args):
+                self.assertEqual(split_windows(*args), expected)
+
+    def test_windows_cover_the_range_once(self):
+        windows = split_windows(date(2023, 1, 1), date(2024, 12, 31), 90)
+
+        days = [start + timedelta(days=offset) for start, end in windows for offset in range((end - start).days + 1)]
+        self.assertEqual(days, [date(2023, 1, 1) + timedelta(days=offset) for offset in range(731)])
+        self.assertTrue(all((end - start).days < 90 for start, end in windows))
+
+
+class FakeSyncer:
+    """Stands in for a platform syncer, failing the windows starting on a day in `failing`."""
+
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = set(failing)
+
+    async def __call__(self, http, integration, start_date, end_date):
+        self.calls.append((start_date, end_date))
+        if start_date in self.failing:
+            raise RuntimeError("platform unavailable")
+
+
+# Sync jobs checkpoint from worker threads, which only see committed rows
+@use_locmem_cache
+class RunBackfillTests(TransactionTestCase):
+    def setUp(self):
+        self.integration = AdIntegration.objects.create(
+            organization=create_organization("backfill@example.com"), platform="TIKTOK", ad_account_id="adv-1", access_token="token",
+        )
+        self.backfill = AnalyticsBackfill.objects.create(
+            integration=self.integration, start_date=date(2024, 1, 1), end_date=date(2024, 1, 10), window_days=4,
+        )
+
+    def run_backfill(self, syncer):
+        # Loaded like backfill_analytics_task does, the async sync can't lazy load relations
+        self.backfill = AnalyticsBackfill.objects.select_related('integration__organization').get(id=self.backfill.id)
+        logs = self.assertLogs('analysis.sync', 'ERROR') if syncer.failing else self.assertNoLogs('analysis.sync', 'ERROR')
+        with mock.patch.dict(SYNCERS, {"TIKTOK": syncer}), logs:
+            run_backfill(self.backfill)
+
+    def test_resumes_after_completed_windows(self):
+        self.backfill.completed_windows = ["2024-01-01"]
+        self.backfill.save()
+        syncer = FakeSyncer()
+
+        self.run_backfill(syncer)
+
+        self.assertEqual(sorted(syncer.calls), [("2024-01-05", "2024-01-08"), ("2024-01-09", "2024-01-10")])
+        self.assertEqual(sorted(self.backfill.completed_windows), ["2024-01-01", "2024-01-05", "2024-01-09"])
+        self.assertEqual(self.backfill.status, AnalyticsBackfill.Status.COMPLETED)
+
+    def test_a_failed_window_is_retried_alone(self):
+        self.run_backfill(FakeSyncer(failing={"2024-01-05"}))
+
+        self.assertEqual(self.backfill.status, AnalyticsBackfill.Status.FAILED)
+        self.assertEqual(sorted(self.backfill.completed_windows), ["2024-01-01", "2024-01-09"])
+
+        syncer = FakeSyncer()
+        self.run_backfill(syncer)
+
+        self.assertEqual(syncer.calls, [("2024-01-05", "2024-01-08")])
+        self.assertEqual(self.backfill.status, AnalyticsBackfill.Status.COMPLETED)
+
+
+class PlanSyncTests(SimpleTestCase):
+    now = datetime(2024, 6, 15, 12, tzinfo=dt_timezone.utc)
+    integration = AdIntegration(platform="TIKTOK")
+
+    def plan(self, **state):
+        return plan_sync(self.integration, IntegrationSyncState(**state) if state else None, now=self.now)
+
+    def test_first_sync_covers_one_attribution_window(self):
+        self.assertEqual(self.plan(), SyncPlan(date(2024, 6, 9), date(2024, 6, 15), True))
+
+    def test_refetches_from_the_last_synced_day(self):
+        plan = self.plan(last_synced_date=date(2024, 6, 14), attribution_refreshed_at=self.now - timedelta(hours=1))
+
+        self.assertEqual(plan, SyncPlan(date(2024, 6, 14), date(2024, 6, 15), False))
+
+    def test_widens_to_the_attribution_window_once_it_is_due(self):
+        plan = self.plan(last_synced_date=date(2024, 6, 14), attribution_refreshed_at=self.now - timedelta(hours=24))
+
+        self.assertEqual(plan, SyncPlan(date(2024, 6, 9), date(2024, 6, 15), True))
+
+    def test_a_long_gap_is_caught_up_in_full(self):
+        plan = self.plan(last_synced_date=date(2024, 5, 1), attribution_refreshed_at=self.now)
+
+        self.assertEqual(plan, SyncPlan(date(2024, 5, 1), date(2024, 6, 15), False))
+
+    def test_never_starts_after_today(self):
+        plan = self.plan(last_synced_date=date(2024, 6, 20), attribution_refreshed_at=self.now)
+
+        self.assertEqual(plan, SyncPlan(date(2024, 6, 15), date(2024, 6, 15), False))
+
+
+@mock.patch('django.utils.timezone.now', return_value=PlanSyncTests.now)
+@mock.patch.dict(MAX_WINDOW_DAYS, {"TIKTOK": 3})
+class IncrementalSyncTests(TestCase):
+    def setUp(self):
+        self.integration = AdIntegration.objects.create(
+            organization=create_organization("incremental@example.com"), platform="TIKTOK", ad_account_id="adv-1", access_token="token",
+        )
+
+    def jobs(self):
+        return [(job.start_date, job.end_date) for job in incremental_jobs([self.integration])]
+
+    def state(self):
+        return IntegrationSyncState.objects.get(integration=self.integration)
+
+    def test_first_run_records_its_plan_as_the_cursor(self, now):
+        self.assertEqual(self.jobs(), [("2024-06-09", "2024-06-11"), ("2024-06-12", "2024-06-14"), ("2024-06-15", "2024-06-15")])
+        self.assertEqual(self.state().cursor, {
+            "start_date": "2024-06-09", "end_date": "2024-06-15", "refresh_attribution": True, "completed_windows": [],
+        })
+
+    def test_an_interrupted_run_resumes_its_pending_windows(self, now):
+        first, second, third = incremental_jobs([self.integration])
+        _checkpoint_sync(first)
+        _checkpoint_sync(third)
+
+        self.assertEqual(self.jobs(), [("2024-06-12", "2024-06-14")])
+        self.assertEqual(self.state().cursor["completed_windows"], ["2024-06-09", "2024-06-15"])
+        self.assertIsNone(self.state().last_synced_date)
+
+    def test_the_last_window_advances_the_state(self, now):
+        for job in incremental_jobs([self.integration]):
+            _checkpoint_sync(job)
+
+        state = self.state()
+        self.assertEqual(state.cursor, {})
+        self.assertEqual(state.last_synced_date, date(2024, 6, 15))
+        self.assertEqual(state.attribution_refreshed_at, PlanSyncTests.now)
+        self.assertEqual(state.last_success_at, PlanSyncTests.now)
+
+        # Next run only refetches today, outside the attribution refresh
+        self.assertEqual(self.jobs(), [("2024-06-15", "2024-06-15")])
+        self.assertFalse(self.state().cursor["refresh_attribution"])
+
+    def test_a_checkpoint_without_a_cursor_is_ignored(self, now):
+        job, *_ = incremental_jobs([self.integration])
+        IntegrationSyncState.objects.filter(integration=self.integration).update(cursor={})
+
+        _checkpoint_sync(job)
+
+        self.assertEqual(self.state().cursor, {})
+        self.assertIsNone(self.state().last_synced_date)
+
+
+@use_locmem_cache
+class RefreshRollupsTests(TestCase):
+    def setUp(self):
+        self.organization = create_organization("rollups@example.com")
+        self.other = create_organization("rollups-other@example.com")
+        for platform, campaign, day in [
+            ("TIKTOK", "cmp-1", date(2020, 3, 1)),
+            ("TIKTOK", "cmp-2", date(2020, 3, 1)),
+            ("TIKTOK", "cmp-1", date(2020, 3, 31)),
+            ("TIKTOK", "cmp-1", date(2020, 4, 1)),
+            ("META", "cmp-3", date(2020, 3, 2)),
+        ]:
+            self.add_row(self.organization, platform, campaign, day)
+        # Already compacted month, and another organization on the same days
+        self.add_row(self.organization, "TIKTOK", "cmp-1", date(2020, 2, 1), granularity=AnalysisDaily.Granularity.MONTH)
+        self.add_row(self.other, "TIKTOK", "cmp-1", date(2020, 3, 1))
+
+    def add_row(self, organization, platform, campaign_id, day, **fields):
+        return AnalysisDaily.objects.create(
+            organization=organization, platform=platform, account_id="acc-1", campaign_id=campaign_id,
+            adgroup_id="", date=day, impressions=1000 + day.day, clicks=40 + day.month, spend_minor=100 * day.day,
+            conversions=day.month, conversion_value_minor=300 * day.day, **fields,
+        )
+
+    def refresh(self):
+        rows = AnalysisDaily.objects.filter(organization=self.organization)
+        refresh_rollups(self.organization.id, rows.values_list('platform', 'date'))
+
+    def rollups(self):
+        return {
+            (rollup.period, rollup.platform, rollup.date): {field: getattr(rollup, field) for field in FACT_FIELDS}
+            for rollup in AnalysisRollup.objects.filter(organization=self.organization)
+        }
+
+    def expected(self):
+        """The rollups summed straight from AnalysisDaily."""
+        rows = AnalysisDaily.objects.filter(organization=self.organization)
+        expected = {}
+        for platform, day, granularity in rows.values_list('platform', 'date', 'granularity').distinct():
+            if granularity == AnalysisDaily.Granularity.DAY:
+                expected[(AnalysisRollup.Period.DAY, platform, day)] = totals(
+                    rows.filter(platform=platform, date=day, granularity=AnalysisDaily.Granularity.DAY)
+                )
+            month = day.replace(day=1)
+            expected[(AnalysisRollup.Period.MONTH, platform, month)] = totals(
+                rows.filter(platform=platform, date__gte=month, date__lt=next_month(month))
+            )
+        return expected
+
+    def test_buckets_match_the_daily_sums(self):
+        self.refresh()
+
+        self.assertEqual(self.rollups(), self.expected())
+        # The compacted month has a month bucket only
+        self.assertNotIn((AnalysisRollup.Period.DAY, "TIKTOK", date(2020, 2, 1)), self.rollups())
+
+    def test_only_touched_buckets_are_refreshed(self):
+        self.refresh()
+        AnalysisDaily.objects.filter(organization=self.organization, date=date(2020, 3, 31)).update(spend_minor=1)
+        AnalysisDaily.objects.filter(organization=self.organization, date=date(2020, 4, 1)).update(spend_minor=1)
+
+        refresh_rollups(self.organization.id, [("TIKTOK", "2020-03-31")])
+
+        rollups = self.rollups()
+        self.assertEqual(rollups[(AnalysisRollup.Period.DAY, "TIKTOK", date(2020, 3, 31))]["spend_minor"], 1)
+        self.assertEqual(rollups[(AnalysisRollup.Period.MONTH, "TIKTOK", date(2020, 3, 1))]["spend_minor"], 100 + 100 + 1)
+        self.assertEqual(rollups[(AnalysisRollup.Period.DAY, "TIKTOK", date(2020, 4, 1))]["spend_minor"], 100)
+
+    def test_emptied_buckets_are_removed(self):
+        self.refresh()
+        AnalysisDaily.objects.filter(organization=self.organization, platform="META").delete()
+
+        refresh_rollups(self.organization.id, [("META", date(2020, 3, 2))])
+
+        self.assertEqual(self.rollups(), self.expected())
+        self.assertFalse(AnalysisRollup.objects.filter(organization=self.organization, platform="META").exists())
+
+    def test_compaction_keeps_the_month_bucket(self):
+        self.refresh()
+        month = self.rollups()[(AnalysisRollup.Period.MONTH, "TIKTOK", date(2020, 3, 1))]
+
+        compact_month(self.organization.id, date(2020, 3, 1))
+        rebuild_rollups(self.organization.id)
+
+        self.assertEqual(self.rollups()[(AnalysisRollup.Period.MONTH, "TIKTOK", date(2020, 3, 1))], month)
+        self.assertEqual(self.rollups(), self.expected())
+        self.assertEqual(AnalysisRollup.objects.filter(organization=self.other).count(), 0)
+
+
+def read_report(content, report_format):
+    """The rows of each sheet of a report file, by sheet title."""
+    if report_format == 'csv.gz':
+        return {"All Data": list(csv.reader(io.StringIO(gzip.decompress(content).decode())))}
+    if report_format == 'parquet':
+        table = pq.read_table(io.BytesIO(content))
+        return {"All Data": [table.column_names, *map(list, zip(*table.to_pydict().values()))]}
+    # Column widths are left out: SQLite casts floats to text with fewer
+    # digits than the shards measure
+    workbook = load_workbook(io.BytesIO(content), read_only=True)
+    return {sheet.title: [list(row) for row in sheet.iter_rows(values_only=True)] for sheet in workbook.worksheets}
+
+
+@use_locmem_cache
+class ShardedReportTests(TestCase):
+    def setUp(self):
+        self.organization = create_organization("sharded@example.com")
+        for platform in ("TIKTOK", "META", "GOOGLE"):
+            AdIntegration.objects.create(organization=self.organization, platform=platform, ad_account_id="acc-1", access_token="token")
+        for offset in range(0, 90, 3):
+            day = date(2020, 3, 1) + timedelta(days=offset)
+            for platform, campaign in (("TIKTOK", "cmp-1"), ("TIKTOK", "cmp-2"), ("META", "cmp-3")):
+                AnalysisDaily.objects.create(
+                    organization=self.organization, platform=platform, account_id="acc-1", campaign_id=campaign,
+                    campaign_name=f"Campaign {campaign}", adgroup_id="", date=day, impressions=1000 + offset,
+                    clicks=10 + offset, spend_minor=123 * (offset + 1), conversions=offset % 4, conversion_value_minor=457 * offset,
+                )
+        # Read whole as a MONTH row even though the range starts mid month
+        compact_month(self.organization.id, date(2020, 3, 1))
+
+    def test_sharded_reports_match_the_single_pass(self):
+        for report_format in Report.Format.values:
+            with self.subTest(report_format=report_format):
+                report = Report.objects.create(
+                    organization=self.organization, report_type="custom", format=report_format,
+                    start_date=date(2020, 3, 10), end_date=date(2020, 5, 20),
+                )
+                headers = report_headers(report)
+
+                single = io.BytesIO()
+                REPORT_WRITERS[report_format](single, report, headers)
+
+                storage = InMemoryStorage()
+                partials = []
+                for platform, start_date, end_date in report_shards(report):
+                    part = io.BytesIO()
+                    result = write_report_partial(part, shard_queryset(report, platform, start_date, end_date), headers, report_format)
+                    path = storage.save(f"{platform}_{start_date}{PARTIAL_SUFFIXES[report_format]}", ContentFile(part.getvalue()))
+                    partials.append({**result, "platform": platform, "path": path})
+                merged = io.BytesIO()
+                merge_report_partials(merged, headers, report_format, partials, storage)
+
+                expected = read_report(single.getvalue(), report_format)
+                # Sheet order included
+                self.assertEqual(list(read_report(merged.getvalue(), report_format).items()), list(expected.items()))
+                self.assertEqual(len(expected["All Data"]), 1 + 3 + 3 * 16)
+
+
+INSIGHTS_END = date(2024, 6, 17)
+
+
+def campaign_days(campaign_id, spend=10000, impressions=10000, clicks=200, roas=3.0, recent=None, today_spend=None):
+    """
+    Insight frame rows of one campaign over the baseline and recent days.
+    `recent` overrides facts of the recent days, `today_spend` the spend of
+    the evaluated day; `spend` may be a function of the day offset.
+    """
+    rows = []
+    for offset in range(BASELINE_DAYS + RECENT_DAYS):
+        facts = {"spend": spend, "impressions": impressions, "clicks": clicks, "roas": roas}
+        if offset < RECENT_DAYS:
+            facts.update(recent or {})
+        day_spend = facts["spend"](offset) if callable(facts["spend"]) else facts["spend"]
+        if offset == 0 and today_spend is not None:
+            day_spend = today_spend
+        rows.append({
+            "organization_id": 1, "platform": "TIKTOK", "campaign_id": campaign_id, "campaign_name": campaign_id,
+            "date": INSIGHTS_END - timedelta(days=offset), "impressions": facts["impressions"], "clicks": facts["clicks"],
+            "spend_minor": day_spend, "conversion_value_minor": round(day_spend * facts["roas"]),
+        })
+    return rows
+
+
+class InsightDetectionTests(SimpleTestCase):
+    def detect(self, *campaigns):
+        frame = pd.DataFrame([row for campaign in campaigns for row in campaign])
+        findings = detect(campaign_stats(frame, INSIGHTS_END))
+        return sorted(
+            (finding["campaign_id"], finding["kind"], round(finding["change"], 4), finding["impact"])
+            for finding in findings.to_dict("records")
+        )
+
+    def test_flags_each_kind_once(self):
+        findings = self.detect(
+            campaign_days("steady"),
+            # Baseline mean 100.00 with a 10.00 deviation
+            campaign_days("spike", spend=lambda offset: 9000 if offset % 2 else 11000, today_spend=40000),
+            campaign_days("ctr", recent={"clicks": 100}),
+            campaign_days("roas", recent={"roas": 1.5}),
+        )
+
+        self.assertEqual(findings, [
+            ("ctr", "CTR_DROP", -0.5, "MEDIUM"),
+            ("roas", "ROAS_DROP", -0.5, "MEDIUM"),
+            ("spike", "SPEND_SPIKE", 3.0, "HIGH"),
+        ])
+
+    def test_ignores_small_and_noisy_campaigns(self):
+        findings = self.detect(
+            # Baseline under MIN_SPEND_MINOR and MIN_IMPRESSIONS, evaluated day under MIN_SPEND_MINOR
+            campaign_days("small", spend=50, impressions=50, recent={"clicks": 1, "roas": 0.5}, today_spend=900),
+            # Within SPEND_SPIKE_Z deviations of a volatile baseline
+            campaign_days("volatile", spend=lambda offset: 2000 if offset % 2 else 18000, today_spend=20000),
+            # Changes inside the thresholds
+            campaign_days("mild", recent={"clicks": 160, "roas": 2.5}),
+        )
+
+        self.assertEqual(findings, [])
+
+    def test_days_without_rows_count_as_zero_spend(self):
+        # Spending every other day only, today's spend is a spike against the 50.00 mean
+        sparse = [row for row in campaign_days("sparse", today_spend=30000) if row["date"].day % 2]
+
+        self.assertEqual(self.detect(sparse)[0][:3], ("sparse", "SPEND_SPIKE", 5.0))
+
+    def test_rank_keeps_the_best_findings_of_each_organization(self):
+        findings = pd.DataFrame([
+            {"organization_id": 1, "campaign_id": "a", "score": 1.0},
+            {"organization_id": 1, "campaign_id": "b", "score": 3.0},
+            {"organization_id": 1, "campaign_id": "c", "score": 2.0},
+            {"organization_id": 2, "campaign_id": "d", "score": 0.5},
+        ])
+
+        ranked = rank(findings, limit=2)
+
+        self.assertEqual(list(zip(ranked["organization_id"], ranked["campaign_id"])), [(1, "b"), (1, "c"), (2, "d")])
+
+    def test_bigger_moves_on_more_spend_rank_first(self):
+        frame = pd.DataFrame([
+            *campaign_days("big-spender", spend=100000, recent={"clicks": 100}),
+            *campaign_days("small-spender", spend=2000, recent={"clicks": 100}),
+            *campaign_days("collapse", spend=2000, recent={"clicks": 20}),
+        ])
+
+        ranked = rank(detect(campaign_stats(frame, INSIGHTS_END)))
+
+        self.assertEqual(list(ranked["campaign_id"]), ["big-spender", "collapse", "small-spender"])
@@ -1,15 +1,15 @@
 from rest_framework.generics import GenericAPIView, ListAPIView
 from main.mixins import RequiredOrganizationIDMixin
 from rest_framework.response import Response
-from main.models import Organization
 from .models import AnalysisDaily, Report
 from .serializers import ReportSerializer
 from .tasks import generate_report_task
+from .report_cache import get_or_create_report
 from accounts.permissions import IsOrganizationMember, IsAdminOrOwnerOfOrganization, IsRegularPlatformUser
 from rest_framework.pagination import PageNumberPagination
 
 VALID_PLATFORMS = {'META', 'TIKTOK', 'GOOGLE'}
-VALID_METRICS = {'spend', 'impressions', 'clicks', 'ctr', 'cpc', 'roas'}
+VALID_METRICS = {'spend', 'impressions', 'clicks', 'conversions', 'conversion_value', 'ctr', 'cpc', 'roas'}
 
 class ReportPagination(PageNumberPagination):
     page_size = 15
@@ -22,11 +22,8 @@ class ReportListView(RequiredOrganizationIDMixin, ListAPIView):
     pagination_class = ReportPagination
     
     def get_queryset(self):
-        org_id = self.get_org_id()
-        organization = Organization.objects.filter(snowflake_id=org_id).first()
-        if organization:
-            return Report.objects.filter(organization=organization).order_by('-created_at')
-        return Report.objects.none()
+        organization = self.get_organization()
+        return Report.objects.filter(organization=organization).order_by('-created_at')
 
 
 class GenerateReportView(RequiredOrganizationIDMixin, GenericAPIView):
@@ -35,14 +32,16 @@ class GenerateReportView(RequiredOrganizationIDMixin, GenericAPIView):
     def post(self, request, *args, **kwargs):
         from datetime import datetime, timedelta
         
-        org_id = self.get_org_id()
-        organization = Organization.objects.filter(snowflake_id=org_id).first()
-
-        if not organization:
-            return Response({"error": "Organization not found"}, status=404)
+        organization = self.get_organization()
 
         # ── Parse request body ──
         report_type = request.data.get('report_type', 'custom')
+        report_format = request.data.get('format', Report.Format.XLSX)
+        if report_format not in Report.Format.values:
+            return Response(
+                {"error": f"Invalid format: '{report_format}'. Valid options are: {', '.join(Report.Format.values)}"},
+                status=400,
+            )
         included_platforms = request.data.get('included_platforms', [])
         included_metrics = request.data.get('included_metrics', [])
 
@@ -112,20 +111,28 @@ class GenerateReportView(RequiredOrganizationIDMixin, GenericAPIView):
                 status=400,
             )
 
-        # Create a pending Report record
-        report = Report.objects.create(
-            organization=organization,
+        # Reuse an identical report built from the same data, or join one in progress
+        report, created = get_or_create_report(
+            organization,
             name="Generating...",
             report_type=report_type,
+            format=report_format,
             status=Report.Status.PENDING,
             included_platforms=included_platforms,
             included_metrics=included_metrics,
             start_date=start_date,
             end_date=end_date,
         )
+        if report.status == Report.Status.COMPLETED:
+            return Response({
+                "message": "An identical report is already available.",
+                "report_id": report.id,
+                "report": ReportSerializer(report, context={'request': request}).data,
+            }, status=200)
 
         # Dispatch the background task
-        generate_report_task.delay(report.id)
+        if created:
+            generate_report_task.delay(report.id)
 
         return Response({
             "message": "Generating report, you will get a notification when completed.",
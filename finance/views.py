@@ -7,7 +7,6 @@ from .serializers import PlanSerializer
 from main import serializers
 from .models import Payment, Plan, Subscription
 from rest_framework import status
-from main.models import Organization
 import stripe
 from django.conf import settings
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiTypes
@@ -55,7 +54,7 @@ class BuyPlanAPIView(RequiredOrganizationIDMixin, GenericAPIView):
 		if subscription.exists():
 			return Response({"message": "Subscription already exists"}, status=status.HTTP_200_OK)
 		
-		organization = Organization.objects.get(snowflake_id=organization_snowflake_id)
+		organization = self.get_organization()
 		subscription = Subscription.objects.create(
 			organization=organization,
 			plan=plan.first(),
@@ -104,8 +103,7 @@ class GetPlanAPIView(RequiredOrganizationIDMixin, GenericAPIView):
         ]
     )
 	def get(self, request, *args, **kwargs):
-		organization_snowflake_id = self.get_org_id()
-		organization = Organization.objects.get(snowflake_id=organization_snowflake_id)
+		organization = self.get_organization()
 		subscription = Subscription.objects.filter(organization=organization, status='active').select_related('plan')
 		if not subscription.exists():
 			return Response({'error': "No active subscription found."}, status=status.HTTP_404_NOT_FOUND)
@@ -128,8 +126,7 @@ class BillingHistoryAPIView(RequiredOrganizationIDMixin, GenericAPIView):
 
 	def get(self, request, *args, **kwargs):
 		user = request.user
-		organization_snowflake_id = self.get_org_id()
-		organization = Organization.objects.get(snowflake_id=organization_snowflake_id)
+		organization = self.get_organization()
 		# Assuming BillingHistory model exists and has a foreign key to Organization
 		billing_history = Payment.objects.filter(organization=organization).order_by('-paid_at')
 
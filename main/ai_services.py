@@ -1,39 +1,122 @@
-import json
-from openai import OpenAI
+import hashlib, json, re
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
 from django.conf import settings
+from django.core.cache import cache
+from main.llm_backends import get_backend
+from main.utils.streaming import PartialJSONStrings
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI Client
-def get_openai_client():
-    if not settings.OPENAI_API_KEY:
-        raise RuntimeError("OPENAI_API_KEY is not set")
-    return OpenAI(api_key=settings.OPENAI_API_KEY)
+# Completions are cached per normalized prompt. The cache is capped by
+# counting entries per generation: once a generation holds
+# AI_COPY_CACHE_MAX_ENTRIES, the generation is bumped and the old entries
+# simply expire with their TTL.
+CACHE_KEY = "ai_copy:{generation}:{digest}"
+CACHE_GENERATION_KEY = "ai_copy:generation"
+CACHE_COUNT_KEY = "ai_copy:count:{generation}"
+DEFAULT_CACHE_TTL = 60 * 60 * 24
+DEFAULT_CACHE_MAX_ENTRIES = 10000
+DEFAULT_BATCH_CONCURRENCY = 8
 
 
-def generate_copy(product, audience, benefits, tone, copy_type):
+def normalize_input(value):
+    """Collapses whitespace so trivially different inputs share a prompt."""
+    return re.sub(r"\s+", " ", str(value or "")).strip()
 
-    client = get_openai_client()
-    """
-    Generates ad copy variations using OpenAI.
 
-    PARAMETERS:
-        product (str): Product or service name/description
-        audience (str): Target audience
-        benefits (str): Key benefits
-        tone (str): Tone of the copy (Professional, Friendly, etc.)
-        copy_type (str): Headlines | Primary Text | Descriptions | CTAs
+def _cache_digest(backend, temperature, messages):
+    payload = json.dumps(
+        {"backend": backend.alias, "model": backend.model, "temperature": temperature, "messages": [[m["role"], normalize_input(m["content"])] for m in messages]},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
 
-    RETURNS:
-        list[str]
 
-        On success:
-            A list of generated ad copy variations.
+def _cache_generation():
+    return cache.get_or_set(CACHE_GENERATION_KEY, 1, None)
 
-        On error:
-            A list with a single string containing the error message.
+
+def _cache_lookup(digest):
+    return cache.get(CACHE_KEY.format(generation=_cache_generation(), digest=digest))
+
+
+def _cache_store(digest, value):
+    ttl = getattr(settings, 'AI_COPY_CACHE_TTL', DEFAULT_CACHE_TTL)
+    if not ttl:
+        return
+    generation = _cache_generation()
+    count_key = CACHE_COUNT_KEY.format(generation=generation)
+    cache.add(count_key, 0, ttl)
+    if cache.incr(count_key) > getattr(settings, 'AI_COPY_CACHE_MAX_ENTRIES', DEFAULT_CACHE_MAX_ENTRIES):
+        try:
+            cache.incr(CACHE_GENERATION_KEY)
+        except ValueError:
+            pass
+        generation = _cache_generation()
+    cache.set(CACHE_KEY.format(generation=generation, digest=digest), value, ttl)
+
+
+def complete_json(messages, temperature, backend='default', use_cache=True):
     """
+    Runs a JSON mode chat completion on the `backend` alias (see
+    main.llm_backends) and returns the decoded object. Identical prompts
+    (after normalization) are answered from the cache.
+    """
+    backend = get_backend(backend)
+    digest = _cache_digest(backend, temperature, messages)
+    if use_cache:
+        cached = _cache_lookup(digest)
+        if cached is not None:
+            return cached
+
+    data = backend.complete_json(messages, temperature)
+    if use_cache:
+        _cache_store(digest, data)
+    return data
+
+
+def _walk_strings(value, path=()):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _walk_strings(item, (*path, key))
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            yield from _walk_strings(item, (*path, index))
+    elif isinstance(value, str):
+        yield path, value
+
+
+async def astream_json_strings(messages, temperature, backend='default', use_cache=True):
+    """
+    Streams a JSON mode chat completion, yielding `(path, value)` for each
+    string value as soon as its closing quote arrives (see
+    `PartialJSONStrings`). Cached answers are replayed at once, and the
+    finished completion is cached like `complete_json` does.
+    """
+    backend = get_backend(backend)
+    digest = _cache_digest(backend, temperature, messages)
+    if use_cache:
+        cached = await sync_to_async(_cache_lookup)(digest)
+        if cached is not None:
+            for item in _walk_strings(cached):
+                yield item
+            return
+
+    parser = PartialJSONStrings()
+    content = []
+    async for delta in backend.astream(messages, temperature):
+        content.append(delta)
+        for item in parser.feed(delta):
+            yield item
+
+    if use_cache:
+        await sync_to_async(_cache_store)(digest, json.loads("".join(content)))
+
+
+def build_copy_messages(product, audience, benefits, tone, copy_type):
+    product, audience, benefits = normalize_input(product), normalize_input(audience), normalize_input(benefits)
 
     # =========================
     # SYSTEM PROMPT 
@@ -91,34 +174,51 @@ def generate_copy(product, audience, benefits, tone, copy_type):
     Key Benefits: {benefits}
     """
 
-    try:
-        # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            response_format={"type": "json_object"}
-        )
-
-        # Parse JSON response
-        data = json.loads(response.choices[0].message.content)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def copy_variations(product, audience, benefits, tone, copy_type, backend='default'):
+    """Same as `generate_copy` but lets errors propagate."""
+    data = complete_json(build_copy_messages(product, audience, benefits, tone, copy_type), temperature=0.7, backend=backend)
+    return data.get("variations", [])
+
+
+def generate_copy(product, audience, benefits, tone, copy_type, backend='default'):
+    """
+    Generates ad copy variations using OpenAI.
+
+    PARAMETERS:
+        product (str): Product or service name/description
+        audience (str): Target audience
+        benefits (str): Key benefits
+        tone (str): Tone of the copy (Professional, Friendly, etc.)
+        copy_type (str): Headlines | Primary Text | Descriptions | CTAs
+
+    RETURNS:
+        list[str]
 
+        On success:
+            A list of generated ad copy variations.
+
+        On error:
+            A list with a single string containing the error message.
+    """
+    try:
         # RETURN TYPE: list[str]
-        return data.get("variations", [])
+        return copy_variations(product, audience, benefits, tone, copy_type, backend=backend)
 
     except Exception as e:
         # RETURN TYPE: list[str] (error inside list)
         return [f"Error generating copy: {str(e)}"]
 
 
-def generate_ad_copy(product_service, target_audience, key_benefits, tone):
-    """
-    Generates high-quality ad copy with strict tone adherence and richer descriptions.
-    """
-    client = get_openai_client()
+def build_ad_copy_messages(product_service, target_audience, key_benefits, tone):
+    product_service, target_audience, key_benefits = (
+        normalize_input(product_service), normalize_input(target_audience), normalize_input(key_benefits)
+    )
 
     # --- ADVANCED PROMPT ENGINEERING ---
     # We give the AI specific instructions on how to handle different tones.
@@ -169,30 +269,35 @@ def generate_ad_copy(product_service, target_audience, key_benefits, tone):
     Tone: {tone}
     """
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Use gpt-4o or gpt-4-turbo for high quality. gpt-3.5 is too simple.
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.75 # Slightly higher creativity
-        )
-        
-        content = response.choices[0].message.content
-        parsed_output = json.loads(content)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def ad_copy_fields(product_service, target_audience, key_benefits, tone, backend='default'):
+    """Same as `generate_ad_copy` but lets errors propagate."""
+    parsed_output = complete_json(
+        build_ad_copy_messages(product_service, target_audience, key_benefits, tone),
+        temperature=0.75, # Slightly higher creativity
+        backend=backend
+    )
+
+    return {
+        "headline": parsed_output.get("headline"),
+        "primary_text": parsed_output.get("primary_text"),
+        "description": parsed_output.get("description"),
+        "call_to_action": parsed_output.get("call_to_action"),
+        "success": True
+    }
 
-        return {
-            "headline": parsed_output.get("headline"),
-            "primary_text": parsed_output.get("primary_text"),
-            "description": parsed_output.get("description"),
-            "call_to_action": parsed_output.get("call_to_action"),
 
-        
-            "success": True
-    }
-    
+def generate_ad_copy(product_service, target_audience, key_benefits, tone, backend='default'):
+    """
+    Generates high-quality ad copy with strict tone adherence and richer descriptions.
+    """
+    try:
+        return ad_copy_fields(product_service, target_audience, key_benefits, tone, backend=backend)
 
     except Exception as e:
         return {
@@ -201,3 +306,42 @@ def generate_ad_copy(product_service, target_audience, key_benefits, tone):
         }
 
 
+def _item_key(item):
+    return json.dumps({field: normalize_input(value) for field, value in item.items()}, sort_keys=True)
+
+
+def generate_copy_batch(items, max_workers=None, backend='bulk'):
+    """
+    Runs `generate_copy` for a list of keyword dicts concurrently and
+    returns the results in the same order. Items with the same normalized
+    inputs are generated once. Batches go to the `bulk` backend alias,
+    which falls back to `default` when it is not configured.
+    """
+    max_workers = max_workers or getattr(settings, 'AI_COPY_BATCH_CONCURRENCY', DEFAULT_BATCH_CONCURRENCY)
+    unique = {}
+    for item in items:
+        unique.setdefault(_item_key(item), item)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique)) or 1) as executor:
+        results = dict(zip(unique, executor.map(lambda item: generate_copy(**item, backend=backend), unique.values())))
+
+    return [results[_item_key(item)] for item in items]
+
+
+async def astream_copy(product, audience, benefits, tone, copy_type):
+    """Yields the `generate_copy` variations one by one as they are written."""
+    messages = build_copy_messages(product, audience, benefits, tone, copy_type)
+    async for path, value in astream_json_strings(messages, temperature=0.7):
+        if len(path) == 2 and path[0] == "variations":
+            yield value
+
+
+AD_COPY_FIELDS = ("headline", "primary_text", "description", "call_to_action")
+
+
+async def astream_ad_copy(product_service, target_audience, key_benefits, tone):
+    """Yields the `generate_ad_copy` fields as `(field, value)` as soon as each is complete."""
+    messages = build_ad_copy_messages(product_service, target_audience, key_benefits, tone)
+    async for path, value in astream_json_strings(messages, temperature=0.75):
+        if len(path) == 1 and path[0] in AD_COPY_FIELDS:
+            yield path[0], value
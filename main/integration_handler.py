@@ -349,6 +349,11 @@ class SelectAdProfileView(APIView):
         integration.ad_account_id = account_id
         integration.save()
 
+        # Populate the dashboard with history for the newly selected account
+        from analysis.tasks import backfill_analytics_task, create_backfill
+        backfill = create_backfill(integration)
+        backfill_analytics_task.delay(backfill.id)
+
         return Response({"success": "Ad account selected."})
 
 
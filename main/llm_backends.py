@@ -0,0 +1,278 @@
+"""
+LLM backends behind `main.ai_services`.
+
+Backends are configured by alias in `settings.LLM_BACKENDS`:
+
+    LLM_BACKENDS = {
+        'default': {'BACKEND': 'openai', 'MODEL': 'gpt-4o', 'TIMEOUT': 60, 'MAX_CONCURRENCY': 8},
+        'bulk': {'BACKEND': 'openai_compatible', 'BASE_URL': ..., 'MODEL': ...},
+    }
+
+`BACKEND` is one of `openai`, `openai_compatible` (any server speaking the
+OpenAI chat completions API, `API_KEY` only if it wants one) or `stub` (deterministic local answers for
+load tests and offline development). Each backend bounds its in-flight
+requests per process with `MAX_CONCURRENCY` (per event loop for streams)
+and adds the tokens it used to daily per alias counters, flushed to the
+cache every few seconds (see `get_usage`).
+"""
+import asyncio, atexit, hashlib, json, logging, re, threading, time, weakref
+from collections import Counter
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+USAGE_KEY = "llm_usage:{alias}:{day}:{field}"
+USAGE_TTL = 60 * 60 * 24 * 40
+USAGE_FIELDS = ('requests', 'prompt_tokens', 'completion_tokens')
+
+DEFAULT_BACKENDS = {
+    'default': {'BACKEND': 'openai', 'MODEL': 'gpt-4o'},
+}
+
+
+# Usage is summed in process and written to the cache at most this often
+# (seconds), not on every completion
+USAGE_FLUSH_INTERVAL = 10
+
+_pending_usage = Counter()
+_usage_lock = threading.Lock()
+_usage_flushed_at = time.monotonic()
+
+
+def record_usage(alias, prompt_tokens=0, completion_tokens=0):
+    day = timezone.now().date().isoformat()
+    with _usage_lock:
+        for field, value in (('requests', 1), ('prompt_tokens', prompt_tokens), ('completion_tokens', completion_tokens)):
+            _pending_usage[USAGE_KEY.format(alias=alias, day=day, field=field)] += value or 0
+        due = time.monotonic() - _usage_flushed_at >= USAGE_FLUSH_INTERVAL
+    if due:
+        flush_usage()
+
+
+def flush_usage():
+    """Adds the usage recorded in this process since the last flush to the cache counters."""
+    global _usage_flushed_at
+    with _usage_lock:
+        pending = {key: value for key, value in _pending_usage.items() if value}
+        _pending_usage.clear()
+        _usage_flushed_at = time.monotonic()
+
+    for key, value in pending.items():
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            # First write of the day, or another process created it meanwhile
+            if not cache.add(key, value, USAGE_TTL):
+                cache.incr(key, value)
+
+
+@atexit.register
+def _flush_usage_at_exit():
+    try:
+        flush_usage()
+    except Exception:
+        logger.warning("Could not flush LLM usage counters at exit", exc_info=True)
+
+
+def get_usage(alias, day=None):
+    flush_usage()
+    day = (day or timezone.now().date()).isoformat()
+    keys = {field: USAGE_KEY.format(alias=alias, day=day, field=field) for field in USAGE_FIELDS}
+    found = cache.get_many(keys.values())
+    return {field: found.get(key, 0) for field, key in keys.items()}
+
+
+class LLMBackend:
+    """
+    Runs JSON mode chat completions. `complete_json` returns the decoded
+    object; `astream` yields the raw text deltas of the same completion.
+    """
+
+    def __init__(self, alias, config):
+        self.alias = alias
+        self.model = config.get('MODEL')
+        self.timeout = config.get('TIMEOUT', 60)
+        self.max_concurrency = config.get('MAX_CONCURRENCY', 8)
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        # asyncio objects are bound to the loop they were first used on, and a
+        # process can run several loops (daphne, asyncio.run in tasks and tests)
+        self._loop_lock = threading.Lock()
+        self._async_semaphores = weakref.WeakKeyDictionary()
+
+    def _per_loop(self, cache, factory):
+        loop = asyncio.get_running_loop()
+        with self._loop_lock:
+            if loop not in cache:
+                cache[loop] = factory()
+            return cache[loop]
+
+    @property
+    def async_semaphore(self):
+        return self._per_loop(self._async_semaphores, lambda: asyncio.Semaphore(self.max_concurrency))
+
+    def complete_json(self, messages, temperature):
+        with self._semaphore:
+            return self._complete_json(messages, temperature)
+
+    async def astream(self, messages, temperature):
+        async with self.async_semaphore:
+            async for delta in self._astream(messages, temperature):
+                yield delta
+
+    def _complete_json(self, messages, temperature):
+        raise NotImplementedError
+
+    async def _astream(self, messages, temperature):
+        """Backends that can't stream send the whole completion as one delta."""
+        from asgiref.sync import sync_to_async
+
+        data = await sync_to_async(self._complete_json, thread_sensitive=False)(messages, temperature)
+        yield json.dumps(data)
+
+
+class OpenAIBackend(LLMBackend):
+    def __init__(self, alias, config):
+        super().__init__(alias, config)
+        self.requires_key = config.get('BACKEND', 'openai') == 'openai'
+        # The OpenAI key is never sent to a third party endpoint
+        self.api_key = config.get('API_KEY') or (settings.OPENAI_API_KEY if self.requires_key else None)
+        self.base_url = config.get('BASE_URL')
+        self.max_retries = config.get('MAX_RETRIES', 2)
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _client_kwargs(self):
+        if not self.api_key and self.requires_key:
+            raise RuntimeError(f"No API key configured for LLM backend '{self.alias}'")
+        # Self-hosted servers often take no key. An empty one sends no
+        # Authorization header and stops the client reading OPENAI_API_KEY
+        # from the environment
+        return {'api_key': self.api_key or '', 'base_url': self.base_url, 'timeout': self.timeout, 'max_retries': self.max_retries}
+
+    # Shared per backend, the client pools connections and is thread safe
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(**self._client_kwargs())
+        return self._client
+
+    # Its connection pool belongs to one event loop, so one client per loop
+    @property
+    def async_client(self):
+        from openai import AsyncOpenAI
+        return self._per_loop(self._async_clients, lambda: AsyncOpenAI(**self._client_kwargs()))
+
+    def _complete_json(self, messages, temperature):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            response_format={"type": "json_object"},
+        )
+        if response.usage:
+            record_usage(self.alias, response.usage.prompt_tokens, response.usage.completion_tokens)
+        return json.loads(response.choices[0].message.content)
+
+    async def _astream(self, messages, temperature):
+        from asgiref.sync import sync_to_async
+
+        stream = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            response_format={"type": "json_object"},
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                await sync_to_async(record_usage)(self.alias, chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+
+class StubBackend(LLMBackend):
+    """
+    Answers without any network call. The reply is derived from a hash of
+    the prompt, so the same prompt always gets the same answer, and has the
+    shape the copy prompts ask for: a `variations` list, or one string per
+    quoted key the system prompt lists. `LATENCY` (seconds) simulates a
+    slow model.
+    """
+
+    def __init__(self, alias, config):
+        super().__init__(alias, config)
+        self.model = self.model or 'stub'
+        self.latency = config.get('LATENCY', 0)
+
+    def answer(self, messages):
+        system = next((m['content'] for m in messages if m['role'] == 'system'), '')
+        prompt = "\n".join(m['content'] for m in messages)
+        digest = hashlib.sha256(prompt.encode()).hexdigest()
+        subject = next(
+            (line.split(':', 1)[1].strip() for line in prompt.splitlines() if line.strip().startswith('Product/Service:')),
+            'your product',
+        )
+        if '"variations"' in system:
+            return {"variations": [f"{subject}, variation {index + 1} ({digest[index * 6:index * 6 + 6]})" for index in range(4)]}
+        keys = list(dict.fromkeys(re.findall(r'"(\w+)":', system))) or ['text']
+        return {key: f"{subject}: {key.replace('_', ' ')} ({digest[:6]})" for key in keys}
+
+    def _record(self, messages, content):
+        prompt_tokens = sum(len(m['content']) for m in messages) // 4
+        record_usage(self.alias, prompt_tokens, len(content) // 4)
+
+    def _complete_json(self, messages, temperature):
+        if self.latency:
+            time.sleep(self.latency)
+        data = self.answer(messages)
+        self._record(messages, json.dumps(data))
+        return data
+
+    async def _astream(self, messages, temperature):
+        from asgiref.sync import sync_to_async
+
+        content = json.dumps(self.answer(messages))
+        step = max(1, len(content) // 20)
+        for index in range(0, len(content), step):
+            if self.latency:
+                await asyncio.sleep(self.latency / 20)
+            yield content[index:index + step]
+        await sync_to_async(self._record)(messages, content)
+
+
+BACKEND_CLASSES = {
+    'openai': OpenAIBackend,
+    'openai_compatible': OpenAIBackend,
+    'stub': StubBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def get_backend(alias='default'):
+    """
+    The configured backend for `alias`; unknown aliases fall back to
+    `default`. Instances are shared per process until the settings they
+    were built from change.
+    """
+    backends = {**DEFAULT_BACKENDS, **getattr(settings, 'LLM_BACKENDS', {})}
+    if alias not in backends:
+        alias = 'default'
+    config = backends[alias]
+    backend_class = BACKEND_CLASSES.get(config.get('BACKEND', 'openai'))
+    if backend_class is None:
+        raise RuntimeError(f"Unknown LLM backend '{config.get('BACKEND')}' for '{alias}'")
+    return backend_class(alias, config)
+
+
+@receiver(setting_changed)
+def reset_backends(setting, **kwargs):
+    if setting in ('LLM_BACKENDS', 'OPENAI_API_KEY'):
+        get_backend.cache_clear()
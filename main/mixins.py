@@ -1,18 +1,42 @@
 from rest_framework.exceptions import ValidationError
-from main.models import Organization
+from main.utils.helper import attach_campaign_metrics
+from main.utils.org_context import get_org_context
 
 
 class RequiredOrganizationIDMixin:
 	required_url_kwargs = "org_id"
 
-	def get_org_id(self):
+	def get_org_context(self):
 		org_id = self.request.query_params.get(self.required_url_kwargs)
 		if not org_id:
 			raise ValidationError({
 				self.required_url_kwargs: "The parameter is required"
 			})
-		if not Organization.objects.filter(snowflake_id=org_id).exists():
+		context = get_org_context(self.request, org_id)
+		if context.organization_id is None:
 			raise ValidationError({
 				self.required_url_kwargs: "Organization not found"
 			})
-		return org_id
\ No newline at end of file
+		return context
+
+	def get_org_id(self):
+		return self.get_org_context().org_id
+
+	def get_organization(self):
+		return self.get_org_context().organization
+
+	def get_membership(self):
+		return self.get_org_context().membership
+
+
+class CampaignMetricsMixin:
+	"""
+	Sets the `total_<fact>` sums on each page of a paginated campaign list
+	view, see `main.utils.helper.attach_campaign_metrics`.
+	"""
+
+	def paginate_queryset(self, queryset):
+		page = super().paginate_queryset(queryset)
+		if page is None:
+			return None
+		return attach_campaign_metrics(page)
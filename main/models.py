@@ -398,11 +398,25 @@ class Ad(models.Model):
         unique_together = ("ad_group", "platform_ad_id")
     
 class AIInsight(models.Model):    
+    class Kind(models.TextChoices):
+        MANUAL = '', 'Manual'
+        # Written by the nightly engine (analysis.insights)
+        SPEND_SPIKE = 'SPEND_SPIKE', 'Spend spike'
+        CTR_DROP = 'CTR_DROP', 'CTR drop'
+        ROAS_DROP = 'ROAS_DROP', 'ROAS regression'
+        SUMMARY = 'SUMMARY', 'Summary'
+
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name="ai_insights")
-    campaign = models.ForeignKey(UnifiedCampaign, on_delete=models.CASCADE, related_name="ai_insights")
+    # Empty for summaries and for platform campaigns not created through the portal
+    campaign = models.ForeignKey(UnifiedCampaign, on_delete=models.CASCADE, related_name="ai_insights", null=True, blank=True)
     title = models.CharField(max_length=255)
     description = models.TextField()
     impect = models.CharField(max_length=20, choices=[('HIGH', 'High'), ('MEDIUM', 'Medium'), ('LOW', 'Low')], default='MEDIUM')
+    kind = models.CharField(max_length=20, choices=Kind.choices, default=Kind.MANUAL, blank=True)
+    platform = models.CharField(max_length=100, choices=Platform.choices, blank=True)
+    platform_campaign_id = models.CharField(max_length=100, blank=True)
+    date = models.DateField(null=True, blank=True)  # day the engine evaluated
+    score = models.FloatField(default=0)  # engine ranking, higher first
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.utils import choices
 from accounts.serializers import SimpleUserSerializer
 from main.models import BudgetType, Organization, OrganizationMember, UnifiedCampaign, AdIntegration, AIInsight
@@ -5,6 +6,16 @@ from rest_framework import serializers
 import json
 from rest_framework.validators import UniqueValidator
 from finance.models import Payment
+from analysis.metrics import derive_metrics, from_minor
+
+def campaign_metrics(obj):
+    """Derived metrics from the `main.utils.helper.attach_campaign_metrics` sums."""
+    return derive_metrics(
+        getattr(obj, 'total_spend_minor', 0),
+        getattr(obj, 'total_impressions', 0),
+        getattr(obj, 'total_clicks', 0),
+        getattr(obj, 'total_conversion_value_minor', 0),
+    )
 
 class CampaignSerializer(serializers.ModelSerializer):
     platforms = serializers.SerializerMethodField()
@@ -19,23 +30,23 @@ class CampaignSerializer(serializers.ModelSerializer):
         model = UnifiedCampaign
         fields = '__all__'
 
-    # TODO : Implement the methods to calculate the metrics
+    # Metrics come from the `main.utils.helper.attach_campaign_metrics` sums
     def get_platforms(self, obj):
         return [pc.integration.platform for pc in obj.platform_campaigns.all()]
     def get_total_budget(self, obj):
-        return 0
+        return from_minor(getattr(obj, 'total_budget_minor', 0))
     def get_total_spent(self, obj):
-        return 0
+        return campaign_metrics(obj)['spend']
     def get_impressions(self, obj):
-        return 0
+        return getattr(obj, 'total_impressions', 0) or 0
     def get_clicks(self, obj):
-        return 0
+        return getattr(obj, 'total_clicks', 0) or 0
     def get_conversions(self, obj):
-        return 0
+        return getattr(obj, 'total_conversions', 0) or 0
     def get_ctr(self, obj):
-        return 0
+        return campaign_metrics(obj)['ctr']
     def get_roas(self, obj):
-        return 0
+        return campaign_metrics(obj)['roas']
 
 class BudgetItemSerializer(serializers.Serializer):
     platform=serializers.CharField()
@@ -56,14 +67,15 @@ class SimpleCampaignSerializer(serializers.ModelSerializer):
     def get_platforms(self, obj):
         return [pc.integration.platform for pc in obj.platform_campaigns.all()]
     def get_spend(self, obj):
-        return 0
+        return campaign_metrics(obj)['spend']
     def get_performance(self, obj):
+        metrics = campaign_metrics(obj)
         return {
-            'impressions': 0,
-            'clicks': 0,
-            'conversions': 0,
-            'ctr': 0,
-            'roas': 0
+            'impressions': getattr(obj, 'total_impressions', 0) or 0,
+            'clicks': getattr(obj, 'total_clicks', 0) or 0,
+            'conversions': getattr(obj, 'total_conversions', 0) or 0,
+            'ctr': metrics['ctr'],
+            'roas': metrics['roas']
         }
 
 class CreateAdSerializer(serializers.Serializer):
@@ -131,6 +143,9 @@ class AICopyRequestSerializer(serializers.Serializer):
     tone = serializers.ChoiceField(choices=['Professional', 'Casual', 'Friendly'])
     copy_type = serializers.ChoiceField(choices=['Headlines', 'Primary Text', 'Descriptions', 'CTAs'])
 
+class AICopyBatchRequestSerializer(serializers.Serializer):
+    items = serializers.ListField(child=AICopyRequestSerializer(), min_length=1, max_length=settings.AI_COPY_BATCH_MAX_ITEMS)
+
 class AIAdCopySerializer(serializers.Serializer):
     product_service = serializers.CharField(max_length=200)
     target_audience = serializers.CharField(max_length=200)
@@ -166,4 +181,4 @@ class TeamMemberInviteSerializer(serializers.Serializer):
 class AIInsightSerializer(serializers.ModelSerializer):
     class Meta:
         model = AIInsight
-        fields = ['id', 'title', 'description', 'created_at', 'impect']
+        fields = ['id', 'title', 'description', 'created_at', 'impect', 'kind', 'platform', 'date']
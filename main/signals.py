@@ -0,0 +1,29 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from main.models import AdIntegration, AIInsight, Organization, OrganizationMember, PlatformCampaign, UnifiedCampaign
+from main.utils.dashboard_cache import invalidate_dashboard_on_commit
+from main.utils.org_context import invalidate_org_context_on_commit
+
+@receiver([post_save, post_delete], sender=UnifiedCampaign)
+@receiver([post_save, post_delete], sender=AIInsight)
+def dashboard_source_change_handler(sender, instance, **kwargs):
+    invalidate_dashboard_on_commit(instance.organization_id)
+
+@receiver([post_save, post_delete], sender=PlatformCampaign)
+def platform_campaign_change_handler(sender, instance, **kwargs):
+    # Recent campaigns list their platforms. Looked up by id, the integration
+    # may already be gone when this runs during a cascade delete
+    org_id = AdIntegration.objects.filter(id=instance.integration_id).values_list('organization_id', flat=True).first()
+    if org_id:
+        invalidate_dashboard_on_commit(org_id)
+
+@receiver([post_save, post_delete], sender=Organization)
+def organization_change_handler(sender, instance, **kwargs):
+    if instance.snowflake_id:
+        invalidate_org_context_on_commit(instance.snowflake_id)
+
+@receiver([post_save, post_delete], sender=OrganizationMember)
+def organization_member_change_handler(sender, instance, **kwargs):
+    org_id = Organization.objects.filter(id=instance.organization_id).values_list('snowflake_id', flat=True).first()
+    if org_id:
+        invalidate_org_context_on_commit(org_id)
@@ -0,0 +1,88 @@
+import logging
+import uuid
+from celery import shared_task
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True)
+def refresh_dashboard_task(self, organization_id):
+    from main.models import Organization
+    from main.utils.dashboard_cache import refresh_dashboard
+
+    organization = Organization.objects.filter(id=organization_id).first()
+    if not organization:
+        return None
+    refresh_dashboard(organization)
+    return organization.snowflake_id
+
+
+AI_COPY_JOB_KEY = "ai_copy_job:{job_id}"
+AI_COPY_JOB_TTL = 60 * 60
+
+# Response body key of the blocking endpoint, per generator
+AI_COPY_RESULT_KEYS = {
+    'copy': 'generated_copies',
+    'ad_copy': 'Ad copy',
+}
+
+
+def get_ai_copy_job(job_id, user):
+    job = cache.get(AI_COPY_JOB_KEY.format(job_id=job_id))
+    if not job or job['user_id'] != user.id:
+        return None
+    return {key: value for key, value in job.items() if key != 'user_id'}
+
+
+def enqueue_ai_copy_job(user, kind, params):
+    """
+    Queues one AI copy generation for `user` and returns the PENDING job.
+    The finished job is pushed to the user's websocket group and can also
+    be polled with `get_ai_copy_job`.
+    """
+    job_id = str(uuid.uuid4())
+    job = {'job_id': job_id, 'kind': kind, 'status': 'PENDING', 'result': None, 'error': None}
+    cache.set(AI_COPY_JOB_KEY.format(job_id=job_id), {**job, 'user_id': user.id}, AI_COPY_JOB_TTL)
+    generate_ai_copy_task.apply_async(kwargs={'user_id': user.id, 'kind': kind, 'params': params}, task_id=job_id)
+    return job
+
+
+def _publish_ai_copy_job(user_id, job):
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+
+    cache.set(AI_COPY_JOB_KEY.format(job_id=job['job_id']), {**job, 'user_id': user_id}, AI_COPY_JOB_TTL)
+    async_to_sync(get_channel_layer().group_send)(
+        f"user_{user_id}",
+        {
+            'type': 'send_ai_copy_result',
+            'data': job,
+        }
+    )
+
+
+@shared_task(bind=True, max_retries=2)
+def generate_ai_copy_task(self, user_id, kind, params):
+    """
+    Runs an AI copy generation off the web workers. The result, shaped like
+    the blocking endpoint's response body, is cached for polling and sent
+    to the `user_<id>` NotificationConsumer group. Once the retries are
+    used up the job is published as FAILED with the error instead.
+    """
+    from main.ai_services import ad_copy_fields, copy_variations
+
+    generate = copy_variations if kind == 'copy' else ad_copy_fields
+    job = {'job_id': self.request.id, 'kind': kind}
+    try:
+        # Queued generations are the low priority traffic the bulk backend is for
+        result = generate(**params, backend='bulk')
+    except Exception as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=30)
+        logger.exception("AI copy job %s failed", self.request.id)
+        _publish_ai_copy_job(user_id, {**job, 'status': 'FAILED', 'result': None, 'error': str(exc)})
+        return self.request.id
+
+    _publish_ai_copy_job(user_id, {**job, 'status': 'COMPLETED', 'result': {AI_COPY_RESULT_KEYS[kind]: result}, 'error': None})
+    return self.request.id
@@ -1,3 +1,474 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import requests
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from analysis.models import AnalysisDaily, AnalysisDailyDevice, AnalysisRollup
+from analysis.retention import retention_cutoff
+from main.ai_services import CACHE_GENERATION_KEY, complete_json
+from main.llm_backends import LLMBackend, get_backend, get_usage, record_usage
+from main.models import AdIntegration, PlatformCampaign, UnifiedCampaign
+from main.utils.analytics import bulk_save_daily_analytics, bulk_save_device_metrics
+from main.utils.helper import attach_campaign_metrics
+from main.utils.meta_handler import MetaAPIError, meta_get
+from main.utils.org_context import ACTIVE_REFRESH, ACTIVE_TTL, active_organizations, mark_org_active
+from main.utils.streaming import PartialJSONStrings
+from main.utils.testing import create_organization, use_locmem_cache
+from main.utils.tiktok_handler import AsyncTikTokClient, TikTokClient
+from main.views import CampaignListAPIView, DeviceBreakdownAPIView
+
+
+def daily_row(**overrides):
+    return {
+        "platform": "TIKTOK",
+        "account_id": "acc-1",
+        "campaign_id": "cmp-1",
+        "campaign_name": "Campaign 1",
+        "adgroup_id": "",
+        "date": timezone.now().date() - timedelta(days=1),
+        "impressions": 1000,
+        "clicks": 50,
+        "spend_minor": 2500,
+        "conversions": 3,
+        "conversion_value_minor": 9000,
+        **overrides,
+    }
+
+
+@use_locmem_cache
+class BulkSaveDailyAnalyticsTests(TestCase):
+    def setUp(self):
+        self.organization = create_organization("analytics@example.com")
+
+    def test_counts_inserts_then_updates(self):
+        rows = [daily_row(), daily_row(campaign_id="cmp-2", campaign_name="Campaign 2")]
+
+        result = bulk_save_daily_analytics(rows, self.organization)
+        self.assertEqual(result, {"inserted": 2, "updated": 0, "skipped": 0})
+
+        result = bulk_save_daily_analytics([{**row, "spend_minor": 4000} for row in rows], self.organization)
+        self.assertEqual(result, {"inserted": 0, "updated": 2, "skipped": 0})
+        self.assertEqual(AnalysisDaily.objects.count(), 2)
+        self.assertEqual(set(AnalysisDaily.objects.values_list('spend_minor', flat=True)), {4000})
+
+    def test_null_adgroup_upserts_onto_the_same_row(self):
+        bulk_save_daily_analytics([daily_row(adgroup_id=None)], self.organization)
+        result = bulk_save_daily_analytics([daily_row(adgroup_id=None, clicks=70)], self.organization)
+
+        self.assertEqual(result["updated"], 1)
+        row = AnalysisDaily.objects.get()
+        self.assertEqual(row.adgroup_id, "")
+        self.assertEqual(row.clicks, 70)
+
+    def test_last_duplicate_in_a_batch_wins(self):
+        result = bulk_save_daily_analytics([daily_row(clicks=1), daily_row(clicks=2)], self.organization)
+
+        self.assertEqual(result, {"inserted": 1, "updated": 0, "skipped": 0})
+        self.assertEqual(AnalysisDaily.objects.get().clicks, 2)
+
+    def test_only_fields_in_the_batch_are_overwritten(self):
+        bulk_save_daily_analytics([daily_row()], self.organization)
+        row = daily_row(impressions=5)
+        del row["campaign_name"]
+        bulk_save_daily_analytics([row], self.organization)
+
+        saved = AnalysisDaily.objects.get()
+        self.assertEqual(saved.campaign_name, "Campaign 1")
+        self.assertEqual(saved.impressions, 5)
+
+    def test_days_before_the_retention_cutoff_are_skipped(self):
+        compacted_day = retention_cutoff() - timedelta(days=1)
+
+        result = bulk_save_daily_analytics([daily_row(date=compacted_day), daily_row()], self.organization)
+
+        self.assertEqual(result, {"inserted": 1, "updated": 0, "skipped": 1})
+        self.assertFalse(AnalysisDaily.objects.filter(date=compacted_day).exists())
+
+    def test_organizations_sharing_an_ad_account_keep_their_own_rows(self):
+        other = create_organization("analytics-other@example.com")
+        bulk_save_daily_analytics([daily_row(clicks=1)], self.organization)
+
+        result = bulk_save_daily_analytics([daily_row(clicks=2)], other)
+
+        self.assertEqual(result, {"inserted": 1, "updated": 0, "skipped": 0})
+        self.assertEqual(
+            sorted(AnalysisDaily.objects.values_list('organization_id', 'clicks')),
+            sorted([(self.organization.id, 1), (other.id, 2)]),
+        )
+        self.assertEqual(
+            set(AnalysisRollup.objects.filter(period=AnalysisRollup.Period.DAY).values_list('organization_id', 'clicks')),
+            {(self.organization.id, 1), (other.id, 2)},
+        )
+
+    @override_settings(ANALYTICS_DAILY_RETENTION_DAYS=0)
+    def test_nothing_is_skipped_without_retention(self):
+        result = bulk_save_daily_analytics([daily_row(date=date(2000, 1, 1))], self.organization)
+
+        self.assertEqual(result, {"inserted": 1, "updated": 0, "skipped": 0})
+
+
+@use_locmem_cache
+class BulkSaveDeviceMetricsTests(TestCase):
+    def setUp(self):
+        self.organization = create_organization("devices@example.com")
+        bulk_save_daily_analytics([daily_row()], self.organization)
+        self.parent = AnalysisDaily.objects.get()
+
+    def device_row(self, **overrides):
+        row = daily_row(**{"device": "IOS", **overrides})
+        del row["campaign_name"]
+        return row
+
+    def test_rows_attach_to_their_campaign_level_parent(self):
+        result = bulk_save_device_metrics(
+            [self.device_row(adgroup_id=None), self.device_row(device="ANDROID", clicks=7)],
+            self.organization,
+        )
+
+        self.assertEqual(result, {"written": 2, "skipped": 0})
+        self.assertEqual(
+            sorted(AnalysisDailyDevice.objects.values_list('daily_id', 'device', 'clicks')),
+            [(self.parent.id, "ANDROID", 7), (self.parent.id, "IOS", 50)],
+        )
+
+    def test_rewrites_upsert_per_device(self):
+        bulk_save_device_metrics([self.device_row()], self.organization)
+        bulk_save_device_metrics([self.device_row(clicks=9)], self.organization)
+
+        self.assertEqual(AnalysisDailyDevice.objects.get().clicks, 9)
+
+    def test_rows_without_a_parent_are_skipped(self):
+        other = create_organization("devices-other@example.com")
+        rows = [self.device_row(campaign_id="unknown"), self.device_row(date=self.parent.date - timedelta(days=1))]
+
+        self.assertEqual(bulk_save_device_metrics(rows, self.organization), {"written": 0, "skipped": 2})
+        # Another organization never writes under this organization's rows
+        self.assertEqual(bulk_save_device_metrics([self.device_row()], other), {"written": 0, "skipped": 1})
+        self.assertFalse(AnalysisDailyDevice.objects.exists())
+
+
+class PartialJSONStringsTests(SimpleTestCase):
+    DOCUMENT = '{"headline": "Run \\"faster\\"", "tags": ["a,b", "c\\\\d"], "meta": {"count": 2, "ok": true, "note": "caf\\u00e9\\n"}}'
+    EXPECTED = [
+        (("headline",), 'Run "faster"'),
+        (("tags", 0), "a,b"),
+        (("tags", 1), "c\\d"),
+        (("meta", "note"), "café\n"),
+    ]
+
+    def feed_chunks(self, chunks):
+        parser = PartialJSONStrings()
+        return [item for chunk in chunks for item in parser.feed(chunk)]
+
+    def test_whole_document(self):
+        self.assertEqual(self.feed_chunks([self.DOCUMENT]), self.EXPECTED)
+
+    def test_one_character_at_a_time(self):
+        self.assertEqual(self.feed_chunks(list(self.DOCUMENT)), self.EXPECTED)
+
+    def test_every_split_point(self):
+        for index in range(1, len(self.DOCUMENT)):
+            with self.subTest(split=index):
+                self.assertEqual(self.feed_chunks([self.DOCUMENT[:index], self.DOCUMENT[index:]]), self.EXPECTED)
+
+    def test_strings_are_reported_when_closed(self):
+        parser = PartialJSONStrings()
+
+        self.assertEqual(parser.feed('{"variations": ["First", "Sec'), [(("variations", 0), "First")])
+        self.assertEqual(parser.feed('ond"]}'), [(("variations", 1), "Second")])
+
+
+@use_locmem_cache
+class CampaignMetricsTests(TestCase):
+    def setUp(self):
+        self.organization = create_organization("campaigns@example.com")
+        integration = AdIntegration.objects.create(organization=self.organization, platform="TIKTOK", ad_account_id="acc-1", access_token="token")
+        for index in range(3):
+            campaign = UnifiedCampaign.objects.create(organization=self.organization, name=f"Campaign {index}", objective="SALES")
+            PlatformCampaign.objects.create(unified_campaign=campaign, integration=integration, platform_campaign_id=f"cmp-{index}")
+            bulk_save_daily_analytics(
+                [daily_row(campaign_id=f"cmp-{index}", date=timezone.now().date() - timedelta(days=day), clicks=10 * (index + 1)) for day in (1, 2)],
+                self.organization,
+            )
+
+    def test_each_page_gets_its_metrics(self):
+        request = APIRequestFactory().get('/', {'org_id': self.organization.snowflake_id})
+        force_authenticate(request, user=self.organization.owner)
+
+        # Org context, count, page, prefetch, then the two metric queries
+        with self.assertNumQueries(8):
+            response = CampaignListAPIView.as_view()(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {campaign['name']: (campaign['clicks'], campaign['total_spent']) for campaign in response.data['results']},
+            {"Campaign 0": (20, 50.0), "Campaign 1": (40, 50.0), "Campaign 2": (60, 50.0)},
+        )
+
+    def test_campaigns_without_platform_campaigns_read_zero(self):
+        campaign = UnifiedCampaign.objects.create(organization=self.organization, name="Draft", objective="SALES")
+
+        [campaign] = attach_campaign_metrics([campaign])
+
+        self.assertEqual((campaign.total_clicks, campaign.total_spend_minor), (0, 0))
+
+
+@use_locmem_cache
+class LLMBackendTests(SimpleTestCase):
+    def test_backends_follow_settings_changes(self):
+        with self.settings(LLM_BACKENDS={'default': {'BACKEND': 'stub', 'MODEL': 'first'}}):
+            self.assertEqual(get_backend().model, 'first')
+            with self.settings(LLM_BACKENDS={'default': {'BACKEND': 'stub', 'MODEL': 'second'}}):
+                self.assertEqual(get_backend().model, 'second')
+            self.assertEqual(get_backend().model, 'first')
+
+    def test_usage_is_written_to_the_cache_in_batches(self):
+        alias = 'usage-test'
+        with mock.patch('main.llm_backends.USAGE_FLUSH_INTERVAL', 3600), mock.patch('main.llm_backends.cache', wraps=cache) as cache_mock:
+            get_usage(alias)
+            cache_mock.reset_mock()
+            for _ in range(5):
+                record_usage(alias, prompt_tokens=10, completion_tokens=3)
+            self.assertEqual(cache_mock.incr.call_count + cache_mock.add.call_count, 0)
+
+            self.assertEqual(get_usage(alias), {'requests': 5, 'prompt_tokens': 50, 'completion_tokens': 15})
+            record_usage(alias, prompt_tokens=1)
+            self.assertEqual(get_usage(alias), {'requests': 6, 'prompt_tokens': 51, 'completion_tokens': 15})
+
+    def test_openai_compatible_backends_need_no_key(self):
+        config = {'BACKEND': 'openai_compatible', 'BASE_URL': 'http://localhost:8001/v1', 'MODEL': 'local'}
+        with self.settings(LLM_BACKENDS={'local': config}, OPENAI_API_KEY='sk-secret'):
+            client = get_backend('local').client
+
+        self.assertEqual(client.api_key, '')
+        self.assertNotIn('Authorization', client.auth_headers)
+
+    def test_openai_backend_needs_a_key(self):
+        with self.settings(LLM_BACKENDS={'default': {'BACKEND': 'openai', 'MODEL': 'gpt-4o'}}, OPENAI_API_KEY=''):
+            with self.assertRaises(RuntimeError):
+                get_backend().client
+
+    def test_backends_without_streaming_send_one_delta(self):
+        class OneShotBackend(LLMBackend):
+            def _complete_json(self, messages, temperature):
+                return {"text": messages[-1]["content"]}
+
+        async def collect():
+            return [delta async for delta in OneShotBackend('one-shot', {}).astream([{"role": "user", "content": "hi"}], 0.5)]
+
+        self.assertEqual(asyncio.run(collect()), ['{"text": "hi"}'])
+
+
+STUB_BACKENDS = {'default': {'BACKEND': 'stub', 'MODEL': 'stub-1'}, 'bulk': {'BACKEND': 'stub', 'MODEL': 'stub-2'}}
+
+
+@use_locmem_cache
+@override_settings(LLM_BACKENDS=STUB_BACKENDS, AI_COPY_CACHE_TTL=60)
+class CompletionCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def complete(self, content, temperature=0.7, backend='default'):
+        def answer(messages, temperature):
+            self.calls.append(messages[-1]["content"])
+            return {"n": len(self.calls)}
+
+        with mock.patch.object(get_backend(backend), 'complete_json', side_effect=answer):
+            return complete_json([{"role": "system", "content": "Write copy"}, {"role": "user", "content": content}], temperature, backend=backend)
+
+    def test_prompts_differing_in_whitespace_share_an_entry(self):
+        first = self.complete("Running shoes  for\n trail runners")
+
+        self.assertEqual(self.complete("  Running shoes for trail\trunners "), first)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_temperature_model_and_content_are_part_of_the_key(self):
+        self.complete("Running shoes")
+        self.complete("Running shoes", temperature=0.2)
+        self.complete("Running shoes", backend='bulk')
+        self.complete("Running socks")
+
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(self.complete("Running shoes"), {"n": 1})
+
+    @override_settings(AI_COPY_CACHE_MAX_ENTRIES=2)
+    def test_a_full_generation_is_replaced(self):
+        for content in ("one", "two", "three"):
+            self.complete(content)
+
+        # "three" overflowed the first generation and starts the next one
+        self.assertEqual(cache.get(CACHE_GENERATION_KEY), 2)
+        self.assertEqual(self.complete("three"), {"n": 3})
+        self.assertEqual(self.complete("one"), {"n": 4})
+        self.assertEqual(self.calls, ["one", "two", "three", "one"])
+
+    @override_settings(AI_COPY_CACHE_TTL=0)
+    def test_a_zero_ttl_disables_the_cache(self):
+        self.complete("Running shoes")
+        self.complete("Running shoes")
+
+        self.assertEqual(len(self.calls), 2)
+
+
+def tiktok_response(status_code=200, body=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body if body is not None else {"code": 0, "message": "OK", "data": {}}).encode()
+    return response
+
+
+class TikTokClientTests(SimpleTestCase):
+    integration = AdIntegration(platform="TIKTOK", ad_account_id="adv-1", access_token="token")
+
+    def call(self, method, outcomes, **kwargs):
+        client = TikTokClient("token", "adv-1", backoff=0)
+        with mock.patch.object(client.session, 'request', side_effect=outcomes) as request:
+            try:
+                return client.request(method, "campaign/create/", **kwargs)
+            finally:
+                self.calls = request.call_count
+
+    def test_post_is_not_retried_on_server_errors(self):
+        with self.assertRaises(requests.HTTPError):
+            self.call('POST', [tiktok_response(503), tiktok_response()])
+        self.assertEqual(self.calls, 1)
+
+    def test_post_is_not_retried_on_timeouts(self):
+        with self.assertRaises(requests.Timeout):
+            self.call('POST', [requests.Timeout(), tiktok_response()])
+        self.assertEqual(self.calls, 1)
+
+    def test_post_is_not_retried_on_transient_error_codes(self):
+        body = self.call('POST', [tiktok_response(body={"code": 50000, "message": "System error"}), tiktok_response()])
+        self.assertEqual((body["code"], self.calls), (50000, 1))
+
+    def test_post_is_retried_when_throttled(self):
+        body = self.call('POST', [tiktok_response(body={"code": 40100, "message": "Too many requests"}), tiktok_response(429), tiktok_response()])
+        self.assertEqual((body["code"], self.calls), (0, 3))
+
+    def test_get_is_retried_on_server_errors_and_timeouts(self):
+        body = self.call('GET', [tiktok_response(502), requests.ConnectionError(), tiktok_response(body={"code": 50002, "message": "Busy"}), tiktok_response()])
+        self.assertEqual((body["code"], self.calls), (0, 4))
+
+    def test_idempotent_calls_are_retried_on_server_errors_and_timeouts(self):
+        body = self.call('POST', [requests.Timeout(), tiktok_response(504), tiktok_response()], idempotent=True)
+        self.assertEqual((body["code"], self.calls), (0, 3))
+
+    def test_retries_stop_at_max_retries(self):
+        with self.assertRaises(requests.HTTPError):
+            self.call('GET', [tiktok_response(503)] * 4 + [tiktok_response()])
+        self.assertEqual(self.calls, 4)
+
+    def test_async_client_applies_the_same_policy(self):
+        def run(method, outcomes, **kwargs):
+            outcomes = iter(outcomes)
+            calls = []
+
+            def handler(request):
+                calls.append(request)
+                outcome = next(outcomes)
+                if isinstance(outcome, Exception):
+                    raise outcome
+                return outcome
+
+            async def request():
+                async with AsyncTikTokClient("token", "adv-1", backoff=0, http=httpx.AsyncClient(transport=httpx.MockTransport(handler))) as client:
+                    try:
+                        return await client.request(method, "report/integrated/get/", **kwargs)
+                    finally:
+                        await client.http.aclose()
+
+            try:
+                return asyncio.run(request()), len(calls)
+            except Exception as exc:
+                return exc, len(calls)
+
+        timeout = httpx.ReadTimeout("timed out")
+        result, calls = run('POST', [timeout, httpx.Response(200, json={"code": 0})])
+        self.assertEqual((type(result), calls), (httpx.ReadTimeout, 1))
+        result, calls = run('POST', [httpx.Response(503), httpx.Response(200, json={"code": 0})])
+        self.assertEqual((type(result), calls), (httpx.HTTPStatusError, 1))
+        result, calls = run('GET', [timeout, httpx.Response(503), httpx.Response(200, json={"code": 0})])
+        self.assertEqual((result, calls), ({"code": 0}, 3))
+        result, calls = run('POST', [httpx.Response(503), httpx.Response(200, json={"code": 0})], idempotent=True)
+        self.assertEqual((result, calls), ({"code": 0}, 2))
+
+    def test_integration_clients_use_the_configured_host(self):
+        self.assertEqual(TikTokClient.for_integration(self.integration).base_url, "https://business-api.tiktok.com/open_api/v1.3")
+        with self.settings(TIKTOK_API_BASE_URL="https://sandbox-ads.tiktok.com/open_api/v1.3/"):
+            client = AsyncTikTokClient.for_integration(self.integration)
+        self.assertEqual(client._url("report/integrated/get/"), "https://sandbox-ads.tiktok.com/open_api/v1.3/report/integrated/get/")
+
+
+class MetaGetTests(SimpleTestCase):
+    def get(self, *responses):
+        responses = iter(responses)
+
+        async def run():
+            transport = httpx.MockTransport(lambda request: next(responses))
+            async with httpx.AsyncClient(transport=transport) as http:
+                return await meta_get(http, "https://graph.facebook.com/v18.0/act_1/insights", backoff=0)
+
+        return asyncio.run(run())
+
+    def test_html_error_pages_raise_meta_api_errors(self):
+        with self.assertRaisesMessage(MetaAPIError, "Unreadable response body (HTTP 400)"):
+            self.get(httpx.Response(400, text="<html>Bad Request</html>"))
+
+    def test_empty_bodies_raise_meta_api_errors(self):
+        with self.assertRaises(MetaAPIError):
+            self.get(httpx.Response(403))
+
+    def test_graph_errors_keep_their_code(self):
+        with self.assertRaises(MetaAPIError) as raised:
+            self.get(httpx.Response(400, json={"error": {"code": 190, "message": "Invalid token"}}))
+        self.assertEqual(raised.exception.code, 190)
+
+    def test_gateway_errors_are_retried(self):
+        body = self.get(httpx.Response(502, text="<html>Bad Gateway</html>"), httpx.Response(200, json={"data": []}))
+        self.assertEqual(body, {"data": []})
+
+
+@use_locmem_cache
+class DeviceBreakdownAPITests(TestCase):
+    def setUp(self):
+        self.organization = create_organization("breakdown@example.com")
+
+    def get(self, **params):
+        request = APIRequestFactory().get('/', {'org_id': self.organization.snowflake_id, **params})
+        force_authenticate(request, user=self.organization.owner)
+        return DeviceBreakdownAPIView.as_view()(request)
+
+    def test_invalid_input_is_rejected(self):
+        for params in ({'platform': 'MYSPACE'}, {'start_date': '2024-13-01'}, {'end_date': '01/02/2024'}, {'start_date': '2024-02-02', 'end_date': '2024-02-01'}):
+            with self.subTest(**params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+    def test_platform_is_case_insensitive(self):
+        response = self.get(platform='tiktok', start_date='2024-02-01', end_date='2024-02-29')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'], [])
+
+
+@use_locmem_cache
+class MarkOrgActiveTests(SimpleTestCase):
+    @mock.patch.dict('main.utils.org_context._active_marked_at', clear=True)
+    def test_the_activity_key_is_refreshed_at_most_once_per_interval(self):
+        with mock.patch('main.utils.org_context.time.monotonic') as monotonic, \
+                mock.patch('main.utils.org_context.cache', wraps=cache) as cache_mock:
+            for now in (1000, 1001, 1000 + ACTIVE_REFRESH - 1, 1000 + ACTIVE_REFRESH):
+                monotonic.return_value = now
+                mark_org_active("org-1")
+
+        self.assertEqual(cache_mock.set.call_count, 2)
+        cache_mock.set.assert_called_with("org_active:org-1", 1, ACTIVE_TTL + ACTIVE_REFRESH)
+        self.assertEqual(active_organizations(["org-1", "org-2"]), {"org-1"})
@@ -11,8 +11,13 @@ urlpatterns = [
 	path('get-ad-profiles/', AdProfileListView.as_view()),
 	path('select-ad-profile/', SelectAdProfileView.as_view()),
 	path('generate-ai-copy/', views.AICopyGeneratorAPIView.as_view()),
+	path('generate-ai-copy/batch/', views.AICopyBatchGeneratorAPIView.as_view()),
+	path('generate-ai-copy/stream/', views.AICopyStreamAPIView.as_view()),
     path('generate-ad-copy/', views.AIAdCopyGeneratorAPIView.as_view()),
+	path('generate-ad-copy/stream/', views.AIAdCopyStreamAPIView.as_view()),
+	path('ai-copy-jobs/<str:job_id>/', views.AICopyJobAPIView.as_view()),
 	path('analytics/', views.AnalyticsAPIView.as_view()),
+	path('analytics/devices/', views.DeviceBreakdownAPIView.as_view()),
 	path('create-platform-campaign/', views.CreatePlatformCampaignAPIView.as_view()),
     path('team/', views.TeamAPIView.as_view()),
     path('team-members/', views.TeamMemberListAPIView.as_view()),
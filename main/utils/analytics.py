@@ -1,33 +1,282 @@
-from analysis.models import AnalysisDaily
+from itertools import islice
+from django.db import transaction
+from django.db.models import Sum
+from analysis.metrics import derive_metrics, metric_expressions, to_minor
+from analysis.models import AnalysisDaily, AnalysisDailyDevice
+from analysis.retention import period_filter, retention_cutoff
+from analysis.rollups import as_date, refresh_rollups
+from main.utils.dashboard_cache import invalidate_dashboard_on_commit
 
-def save_daily_analytics(data, account_id, date):
+# Natural key of an AnalysisDaily row, matches its unique_together
+KEY_FIELDS = ('organization_id', 'platform', 'account_id', 'campaign_id', 'adgroup_id', 'date', 'granularity')
+FACT_FIELDS = ['impressions', 'clicks', 'spend_minor', 'conversions', 'conversion_value_minor']
+UPDATE_FIELDS = ['campaign_name', *FACT_FIELDS]
+BULK_CHUNK_SIZE = 1000
+
+def _row_key(row):
+    return tuple(str(row[field]) for field in KEY_FIELDS)
+
+def _normalize_row(row, organization):
+    # Platforms only report days, MONTH rows are written by compaction alone
+    return {
+        **row,
+        "organization_id": organization.id,
+        "adgroup_id": row.get("adgroup_id") or "",
+        "granularity": AnalysisDaily.Granularity.DAY,
+    }
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+def rows_from_detailed_analytics(data, account_id, date, platform="TIKTOK"):
+    """
+    Flattens the per campaign structure returned by the platform handlers
+    into AnalysisDaily field dicts.
+    """
     for campaign_name, matrix in data.items():
-        campaign_id = matrix.get("campaign_id")
-        device_breakdown = matrix.get("device_breakdown", {})
         total_performance = matrix.get("total_performance", {})
-        spend = total_performance.get("spend", 0.0)
-        impressions = total_performance.get("impressions", 0)
-        clicks = total_performance.get("clicks", 0)
-        ctr = total_performance.get("ctr", 0.0)
-        cpc = total_performance.get("cpc", 0.0)
-        roas = total_performance.get("roas", 0.0)
-        analysis_entry, created = AnalysisDaily.objects.update_or_create(
-            platform="TIKTOK",
-            account_id=account_id,
-            campaign_id=campaign_id,
-            campaign_name=campaign_name,
-            adgroup_id=None,
-            date=date,
-            defaults={
-                "impressions": impressions,
-                "clicks": clicks,
-                "spend": spend,
-                "ctr": ctr,
-                "cpc": cpc,
-                "roas": roas,
-                "device_breakdown": device_breakdown
+        spend = float(total_performance.get("spend", 0.0) or 0)
+        yield {
+            "platform": platform,
+            "account_id": account_id,
+            "campaign_id": matrix.get("campaign_id"),
+            "campaign_name": campaign_name,
+            "adgroup_id": None,
+            "date": date,
+            "impressions": int(total_performance.get("impressions", 0) or 0),
+            "clicks": int(total_performance.get("clicks", 0) or 0),
+            "spend_minor": to_minor(spend),
+            "conversions": int(total_performance.get("conversions", 0) or 0),
+            "conversion_value_minor": to_minor(spend * float(total_performance.get("roas", 0.0) or 0)),
+        }
+
+def device_rows_from_detailed_analytics(data, account_id, date, platform="TIKTOK"):
+    """Flattens the `device_breakdown` of the same structure into device rows."""
+    for matrix in data.values():
+        for device, metrics in (matrix.get("device_breakdown") or {}).items():
+            spend = float(metrics.get("spend") or 0)
+            yield {
+                "platform": platform,
+                "account_id": account_id,
+                "campaign_id": matrix.get("campaign_id"),
+                "adgroup_id": "",
+                "date": date,
+                "device": device,
+                "impressions": int(metrics.get("impressions") or 0),
+                "clicks": int(metrics.get("clicks") or 0),
+                "spend_minor": to_minor(spend),
+                "conversions": 0,
+                "conversion_value_minor": to_minor(spend * float(metrics.get("roas") or 0)),
+            }
+
+def bulk_save_daily_analytics(rows, organization, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Upserts an iterable of AnalysisDaily field dicts in chunks inside one
+    transaction: one SELECT (to tell inserts from updates) and one
+    INSERT ... ON CONFLICT DO UPDATE per chunk.
+
+    Campaign level rows are stored with an empty `adgroup_id` rather than
+    NULL, since NULLs never collide in a unique constraint and the upsert
+    would otherwise always insert. Rows are keyed per organization, so
+    organizations sharing an ad account never take over each other's rows.
+
+    The day/month `AnalysisRollup` buckets the rows fall into are refreshed
+    in the same transaction.
+
+    Days before the retention cutoff have already been compacted into
+    monthly rows (see analysis.retention) and are skipped, re-adding them
+    would count those days twice.
+
+    Returns `{"inserted": int, "updated": int, "skipped": int}`.
+    """
+    inserted = updated = skipped = 0
+    touched = set()
+    cutoff = retention_cutoff()
+
+    with transaction.atomic():
+        for chunk in _chunked(rows, chunk_size):
+            # Later rows win, ON CONFLICT can't touch the same row twice in one statement
+            by_key = {}
+            for row in chunk:
+                if cutoff and as_date(row["date"]) < cutoff:
+                    skipped += 1
+                    continue
+                row = _normalize_row(row, organization)
+                by_key[_row_key(row)] = row
+            if not by_key:
+                continue
+
+            existing = set(
+                tuple(str(value) for value in key)
+                for key in AnalysisDaily.objects.filter(
+                    organization=organization,
+                    platform__in={row["platform"] for row in by_key.values()},
+                    account_id__in={row["account_id"] for row in by_key.values()},
+                    campaign_id__in={row["campaign_id"] for row in by_key.values()},
+                    date__in={row["date"] for row in by_key.values()},
+                ).values_list(*KEY_FIELDS)
+            )
+            chunk_updated = len(existing & by_key.keys())
+
+            # Only overwrite what the batch carries
+            update_fields = [field for field in UPDATE_FIELDS if field in chunk[0]] + ["updated_at"]
+            AnalysisDaily.objects.bulk_create(
+                [AnalysisDaily(**row) for row in by_key.values()],
+                update_conflicts=True,
+                unique_fields=list(KEY_FIELDS),
+                update_fields=update_fields,
+            )
+            updated += chunk_updated
+            inserted += len(by_key) - chunk_updated
+            touched.update((row["platform"], row["date"]) for row in by_key.values())
+
+        refresh_rollups(organization.id, touched)
+        if touched:
+            invalidate_dashboard_on_commit(organization.id)
+
+    return {"inserted": inserted, "updated": updated, "skipped": skipped}
+
+def bulk_save_device_metrics(rows, organization, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Upserts streamed `{..key fields.., "device": ..., <facts>}` rows into
+    AnalysisDailyDevice under their campaign level AnalysisDaily row: one
+    SELECT for the parents and one INSERT ... ON CONFLICT DO UPDATE per
+    chunk. Rows whose parent was not written are skipped.
+
+    Returns `{"written": int, "skipped": int}`.
+    """
+    written = skipped = 0
+
+    with transaction.atomic():
+        for chunk in _chunked(rows, chunk_size):
+            by_key = {}
+            for row in chunk:
+                row = _normalize_row(row, organization)
+                by_key[(_row_key(row), row["device"])] = row
+
+            parents = {
+                tuple(str(value) for value in key): parent_id
+                for parent_id, *key in AnalysisDaily.objects.filter(
+                    organization=organization,
+                    platform__in={row["platform"] for row in by_key.values()},
+                    account_id__in={row["account_id"] for row in by_key.values()},
+                    campaign_id__in={row["campaign_id"] for row in by_key.values()},
+                    date__in={row["date"] for row in by_key.values()},
+                    adgroup_id="",
+                    granularity=AnalysisDaily.Granularity.DAY,
+                ).values_list('id', *KEY_FIELDS)
             }
-        )
+
+            devices = []
+            for (key, device), row in by_key.items():
+                parent_id = parents.get(key)
+                if parent_id is None:
+                    skipped += 1
+                    continue
+                devices.append(AnalysisDailyDevice(
+                    daily_id=parent_id,
+                    organization=organization,
+                    platform=row["platform"],
+                    date=row["date"],
+                    device=device,
+                    **{field: row.get(field) or 0 for field in FACT_FIELDS},
+                ))
+            AnalysisDailyDevice.objects.bulk_create(
+                devices,
+                update_conflicts=True,
+                unique_fields=['daily', 'device'],
+                update_fields=FACT_FIELDS,
+            )
+            written += len(devices)
+
+    return {"written": written, "skipped": skipped}
+
+def save_daily_analytics(data, account_id, date, organization, platform="TIKTOK"):
+    result = bulk_save_daily_analytics(
+        rows_from_detailed_analytics(data, account_id, date, platform=platform),
+        organization,
+    )
+    bulk_save_device_metrics(
+        device_rows_from_detailed_analytics(data, account_id, date, platform=platform),
+        organization,
+    )
     print(f"Saved daily analytics for {len(data)} campaigns on {date}.")
+    return result
+
+def get_daily_analytics(organization, date, platform=None):
+    """
+    Reads synced AnalysisDaily rows back into the per campaign structure
+    the platform handlers produce. A day of a compacted month reads the
+    whole month, with "granularity" set to MONTH.
+    """
+    rows = AnalysisDaily.objects.filter(period_filter(date, date), organization=organization)
+    if platform:
+        rows = rows.filter(platform=platform)
+
+    rows = list(rows.annotate(**metric_expressions()).order_by('platform', 'campaign_name').values(
+        'id', 'campaign_id', 'campaign_name', 'platform', 'granularity', 'impressions', 'clicks', 'conversions',
+        'spend', 'ctr', 'cpc', 'roas',
+    ))
+    breakdowns = {}
+    for device in AnalysisDailyDevice.objects.filter(daily_id__in=[row['id'] for row in rows]).values('daily_id', 'device', *FACT_FIELDS):
+        breakdowns.setdefault(device['daily_id'], {})[device['device']] = {
+            **derive_metrics(device['spend_minor'], device['impressions'], device['clicks'], device['conversion_value_minor']),
+            "impressions": device['impressions'],
+            "clicks": device['clicks'],
+            "conversions": device['conversions'],
+        }
+
+    data = {}
+    for row in rows:
+        data[row['campaign_name'] or row['campaign_id']] = {
+            "campaign_id": row['campaign_id'],
+            "platform": row['platform'],
+            "granularity": row['granularity'],
+            "total_performance": {
+                "spend": row['spend'],
+                "impressions": row['impressions'],
+                "clicks": row['clicks'],
+                "conversions": row['conversions'],
+                "ctr": round(row['ctr'], 2),
+                "cpc": round(row['cpc'], 2),
+                "roas": round(row['roas'], 2)
+            },
+            "device_breakdown": breakdowns.get(row['id'], {})
+        }
+    return data
+
+def get_device_breakdown(organization, start_date, end_date, platform=None, campaign_id=None):
+    """
+    Spend and performance per platform and device over a date range,
+    summed across campaigns and days in one grouped query. Compacted
+    months the range touches are summed whole into separate MONTH rows.
+    """
+    rows = AnalysisDailyDevice.objects.filter(period_filter(start_date, end_date, prefix='daily__'), organization=organization)
+    if platform:
+        rows = rows.filter(platform=platform)
+    if campaign_id:
+        rows = rows.filter(daily__campaign_id=campaign_id)
+
+    breakdown = rows.values('platform', 'device', 'daily__granularity').annotate(
+        **{f'total_{field}': Sum(field) for field in FACT_FIELDS},
+        **metric_expressions(Sum('spend_minor'), Sum('impressions'), Sum('clicks'), Sum('conversion_value_minor')),
+    ).order_by('-total_spend_minor')
 
-        
\ No newline at end of file
+    return [
+        {
+            "platform": row['platform'],
+            "device": row['device'],
+            "granularity": row['daily__granularity'],
+            "spend": round(row['spend'], 2),
+            "impressions": row['total_impressions'],
+            "clicks": row['total_clicks'],
+            "conversions": row['total_conversions'],
+            "conversion_value": round(row['conversion_value'], 2),
+            "ctr": round(row['ctr'], 2),
+            "cpc": round(row['cpc'], 2),
+            "roas": round(row['roas'], 2),
+        }
+        for row in breakdown
+    ]
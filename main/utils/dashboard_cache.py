@@ -0,0 +1,73 @@
+"""
+Versioned, per organization cache of the dashboard payload.
+
+Writes only bump the organization's version (`invalidate_dashboard`), they
+never recompute. Readers get the cached payload straight away; when it was
+built for an older version a single Celery refresh is enqueued and the
+stale payload is served until it lands (stale-while-revalidate). Only a
+cold cache is computed inline.
+"""
+import logging
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from main.utils.helper import get_dashboard_data
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "dashboard:version:{org_id}"
+PAYLOAD_KEY = "dashboard:payload:{org_id}"
+REFRESH_LOCK_KEY = "dashboard:refresh:{org_id}:{version}"
+PAYLOAD_TTL = 60 * 60 * 24
+REFRESH_LOCK_TTL = 60
+
+
+def get_dashboard_version(org_id):
+    key = VERSION_KEY.format(org_id=org_id)
+    cache.add(key, 1, None)
+    return cache.get(key, 1)
+
+
+def invalidate_dashboard(org_id):
+    key = VERSION_KEY.format(org_id=org_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 2, None)
+
+
+def invalidate_dashboard_on_commit(org_id):
+    transaction.on_commit(lambda: invalidate_dashboard(org_id))
+
+
+def refresh_dashboard(organization):
+    """
+    Recomputes and stores the payload. The version is read before computing,
+    so a write landing mid-way leaves the entry stale and triggers another refresh.
+    """
+    version = get_dashboard_version(organization.id)
+    entry = {
+        'version': version,
+        'computed_at': timezone.now().isoformat(),
+        'data': get_dashboard_data(organization.snowflake_id),
+    }
+    cache.set(PAYLOAD_KEY.format(org_id=organization.id), entry, PAYLOAD_TTL)
+    return entry
+
+
+def get_cached_dashboard(organization):
+    entry = cache.get(PAYLOAD_KEY.format(org_id=organization.id))
+    if entry is None:
+        return refresh_dashboard(organization)['data']
+
+    version = get_dashboard_version(organization.id)
+    if entry['version'] != version:
+        # One refresh per version, however many readers see it stale
+        if cache.add(REFRESH_LOCK_KEY.format(org_id=organization.id, version=version), True, REFRESH_LOCK_TTL):
+            from main.tasks import refresh_dashboard_task
+            try:
+                refresh_dashboard_task.delay(organization.id)
+            except Exception:
+                logger.exception("Could not enqueue dashboard refresh for organization %s", organization.id)
+                return refresh_dashboard(organization)['data']
+    return entry['data']
@@ -1,24 +1,104 @@
-from django.db.models import Sum
+from django.db.models import F, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncMonth
 from django.utils import timezone
 from datetime import timedelta
-from main.models import Organization, Platform, UnifiedCampaign
-from analysis.models import AnalysisDaily
+from main.models import CampaignBudget, Organization, Platform, PlatformCampaign, UnifiedCampaign
+from analysis.metrics import derive_metrics, from_minor
+from analysis.models import AnalysisDaily, AnalysisRollup
 from main.serializers import SimpleCampaignSerializer, AIInsightSerializer
 
+# Additive facts shared by AnalysisDaily and AnalysisRollup
+FACT_FIELDS = ['spend_minor', 'impressions', 'clicks', 'conversions', 'conversion_value_minor']
+
+def monthly_platform_totals(queryset, platform_values):
+    """
+    One grouped query: a row per month with a `total_<fact>` sum of every
+    fact plus a conditional `<PLATFORM>_spend_minor` sum for every platform.
+    Works on AnalysisDaily and on AnalysisRollup querysets alike.
+    """
+    spend_by_platform = {
+        f'{platform}_spend_minor': Sum('spend_minor', filter=Q(platform=platform))
+        for platform in platform_values
+    }
+    return queryset.annotate(month=TruncMonth('date')).values('month').annotate(
+        **{f'total_{field}': Sum(field) for field in FACT_FIELDS},
+        **spend_by_platform,
+    ).order_by('month')
+
+def get_monthly_platform_totals(queryset, platform_values):
+    return list(monthly_platform_totals(queryset, platform_values))
+
+def attach_campaign_metrics(campaigns):
+    """
+    Sets a `total_<fact>` sum per fact on every UnifiedCampaign in
+    `campaigns` with one grouped AnalysisDaily query over all of their
+    platform campaigns, matched back by (organization, platform, campaign id).
+    """
+    campaigns = list(campaigns)
+    for campaign in campaigns:
+        for field in FACT_FIELDS:
+            setattr(campaign, f'total_{field}', 0)
+    if not campaigns:
+        return campaigns
+
+    by_id = {campaign.pk: campaign for campaign in campaigns}
+    owners = {}
+    for unified_id, platform, platform_campaign_id in PlatformCampaign.objects.filter(
+        unified_campaign_id__in=by_id,
+        platform_campaign_id__isnull=False,
+    ).values_list('unified_campaign_id', 'integration__platform', 'platform_campaign_id'):
+        campaign = by_id[unified_id]
+        owners.setdefault((campaign.organization_id, platform, platform_campaign_id), []).append(campaign)
+    if not owners:
+        return campaigns
+
+    totals = AnalysisDaily.objects.filter(
+        organization_id__in={key[0] for key in owners},
+        campaign_id__in={key[2] for key in owners},
+    ).values('organization_id', 'platform', 'campaign_id').annotate(
+        **{f'total_{field}': Sum(field) for field in FACT_FIELDS}
+    ).order_by()
+    for row in totals:
+        for campaign in owners.get((row['organization_id'], row['platform'], row['campaign_id']), ()):
+            for field in FACT_FIELDS:
+                setattr(campaign, f'total_{field}', getattr(campaign, f'total_{field}') + (row[f'total_{field}'] or 0))
+    return campaigns
+
+def with_campaign_metrics(queryset):
+    """
+    Prefetches platform campaigns with their integration and annotates
+    `total_budget_minor`. Pass the evaluated page to
+    `attach_campaign_metrics` for the `total_<fact>` sums, so the campaign
+    serializers run no per row queries.
+    """
+    budget_minor = CampaignBudget.objects.filter(
+        campaign=OuterRef('pk')
+    ).values('campaign').annotate(total=Sum('daily_budget_minor')).values('total')
+    return queryset.prefetch_related(
+        Prefetch('platform_campaigns', queryset=PlatformCampaign.objects.select_related('integration'))
+    ).annotate(
+        total_budget_minor=Coalesce(Subquery(budget_minor), 0),
+    )
+
 def get_dashboard_data(organization_id: str):
     organization = Organization.objects.get(snowflake_id=organization_id)
     # Required fieklds: total spend, impressions, click rate, roas
     # Required for matrics: Sepend overview(Meta, Google, TikTok), AI Insigts list, Recent campaigns list.
     
-    six_moths_ago = timezone.now() - timedelta(days=180)
-    analysis_data = AnalysisDaily.objects.filter(
-        organization=organization,
-        date__gte=six_moths_ago
-    ).annotate(
-        total_spend=Sum('spend'),
-        ).order_by('platform')
-    platforms = Platform.choices
-    platform_values = [platform[0] for platform in platforms]
+    six_moths_ago = (timezone.now() - timedelta(days=180)).date().replace(day=1)
+    platform_values = [platform[0] for platform in Platform.choices]
+
+    # Served from the monthly rollup; falls back to the daily table for
+    # organizations whose rollups have not been built yet
+    monthly = get_monthly_platform_totals(
+        AnalysisRollup.objects.filter(organization=organization, period=AnalysisRollup.Period.MONTH, date__gte=six_moths_ago),
+        platform_values,
+    )
+    if not monthly:
+        monthly = get_monthly_platform_totals(
+            AnalysisDaily.objects.filter(organization=organization, date__gte=six_moths_ago),
+            platform_values,
+        )
 
     result = {}
     months = []
@@ -29,24 +109,32 @@ def get_dashboard_data(organization_id: str):
     for month in months:
         result[month] = {platform: 0 for platform in platform_values}
 
-    for item in analysis_data:
-        month = item.date.strftime('%b')
+    totals = {field: 0 for field in FACT_FIELDS}
+    for item in monthly:
+        month = item['month'].strftime('%b')
         if month in result:
-            result[month][item.platform] += item.total_spend
-    # TODO: Implement the logic to calculate total spend, impressions, click rate, and ROAS based on the organization's campaigns and ad data.
-    total_spend = analysis_data.aggregate(total_spend=Sum('spend'))['total_spend'] or 0
-    impressions = analysis_data.aggregate(total_impressions=Sum('impressions'))['total_impressions'] or 0
-    click_rate = analysis_data.aggregate(total_clicks=Sum('clicks'))['total_clicks'] or 0
-    roas = analysis_data.aggregate(total_roas=Sum('roas'))['total_roas'] or 0
+            result[month] = {platform: from_minor(item[f'{platform}_spend_minor']) for platform in platform_values}
+        for field in FACT_FIELDS:
+            totals[field] += item[f'total_{field}'] or 0
+    # Ratios of the exact integer totals, not sums of per-row ratios
+    metrics = derive_metrics(totals['spend_minor'], totals['impressions'], totals['clicks'], totals['conversion_value_minor'])
     
-    recent_campaigns = UnifiedCampaign.objects.filter(organization=organization).order_by('-created_at')[:5]
-    ai_insights = AIInsightSerializer(organization.ai_insights.order_by('-created_at')[:5], many=True).data
+    recent_campaigns = attach_campaign_metrics(
+        with_campaign_metrics(UnifiedCampaign.objects.filter(organization=organization)).order_by('-created_at')[:5]
+    )
+    # Latest engine run first, its findings by rank
+    ai_insights = AIInsightSerializer(
+        organization.ai_insights.order_by(F('date').desc(nulls_last=True), '-score', '-created_at')[:5],
+        many=True,
+    ).data
     
     return {
-        'total_spend': total_spend,
-        'impressions': impressions,
-        'click_rate': click_rate,
-        'roas': roas,
+        'total_spend': metrics['spend'],
+        'impressions': totals['impressions'],
+        'clicks': totals['clicks'],
+        'conversions': totals['conversions'],
+        'click_rate': metrics['ctr'],
+        'roas': metrics['roas'],
         'spend_overview': result,
         'ai_insights': ai_insights,  
         'recent_campaigns': SimpleCampaignSerializer(recent_campaigns, many=True).data
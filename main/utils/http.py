@@ -0,0 +1,11 @@
+def decode_json_object(res):
+    """
+    The JSON object body of a `requests` or `httpx` response, or None when
+    the body is not one: gateways answer 502/504 with an HTML page, and some
+    errors come back with an empty body.
+    """
+    try:
+        body = res.json()
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
@@ -0,0 +1,132 @@
+import asyncio, json, logging, random
+import httpx
+from analysis.metrics import to_minor
+from main.utils.http import decode_json_object
+
+logger = logging.getLogger(__name__)
+
+GRAPH_URL = "https://graph.facebook.com/v18.0"
+
+# Graph API throttling codes: app, user, account and ads-management level limits
+RETRYABLE_CODES = {4, 17, 32, 613, 80000, 80004}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class MetaAPIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"Meta API error {code}: {message}")
+        self.code = code
+        self.message = message
+
+
+def get_ad_account_path(ad_account_id):
+    ad_account_id = str(ad_account_id)
+    return ad_account_id if ad_account_id.startswith("act_") else f"act_{ad_account_id}"
+
+
+async def meta_get(http, url, params=None, max_retries=3, backoff=1.0, max_backoff=30.0):
+    """
+    GET against the Graph API with jittered exponential backoff on throttling.
+    Returns the decoded body or raises `MetaAPIError`, also for a body that
+    is not JSON (an HTML error page, an empty 4xx).
+    """
+    for attempt in range(max_retries + 1):
+        last_try = attempt == max_retries
+        try:
+            res = await http.get(url, params=params)
+        except httpx.TransportError:
+            if last_try:
+                raise
+            await asyncio.sleep(random.uniform(0, min(max_backoff, backoff * (2 ** attempt))))
+            continue
+
+        body = decode_json_object(res)
+        error = body.get("error") if body else None
+        retryable = res.status_code in RETRYABLE_STATUS or (error and error.get("code") in RETRYABLE_CODES)
+        if retryable and not last_try:
+            logger.warning("Meta GET %s throttled (HTTP %s), retrying (%s/%s)", url, res.status_code, attempt + 1, max_retries)
+            await asyncio.sleep(random.uniform(0, min(max_backoff, backoff * (2 ** attempt))))
+            continue
+        if body is None:
+            raise MetaAPIError(None, f"Unreadable response body (HTTP {res.status_code})")
+        if error:
+            raise MetaAPIError(error.get("code"), error.get("message"))
+        res.raise_for_status()
+        return body
+
+
+def _purchase_action(row, field):
+    for item in row.get(field) or []:
+        if item.get("action_type") in ("omni_purchase", "purchase"):
+            return item.get("value", 0)
+    return 0
+
+
+def get_fact_metrics(row):
+    return {
+        "impressions": int(row.get("impressions", 0)),
+        "clicks": int(row.get("clicks", 0)),
+        "spend_minor": to_minor(row.get("spend", 0)),
+        "conversions": int(float(_purchase_action(row, "actions"))),
+        "conversion_value_minor": to_minor(_purchase_action(row, "action_values")),
+    }
+
+
+def daily_row_from_insight(row, ad_account_id):
+    return {
+        "platform": "META",
+        "account_id": ad_account_id,
+        "campaign_id": str(row["campaign_id"]),
+        "campaign_name": row.get("campaign_name"),
+        "adgroup_id": "",
+        "date": row["date_start"],
+        **get_fact_metrics(row),
+    }
+
+
+def device_row_from_insight(row, ad_account_id):
+    return {
+        "platform": "META",
+        "account_id": ad_account_id,
+        "campaign_id": str(row["campaign_id"]),
+        "adgroup_id": "",
+        "date": row["date_start"],
+        "device": row.get("device_platform", "unknown"),
+        **get_fact_metrics(row),
+    }
+
+
+async def aiter_insights(http, access_token, ad_account_id, start_date, end_date, breakdowns=None):
+    """
+    Lazily yields campaign/day insight rows page by page, following
+    every `paging.next` cursor link.
+    """
+    url = f"{GRAPH_URL}/{get_ad_account_path(ad_account_id)}/insights"
+    params = {
+        "access_token": access_token,
+        "level": "campaign",
+        "fields": "campaign_id,campaign_name,spend,impressions,clicks,actions,action_values",
+        "time_range": json.dumps({"since": start_date, "until": end_date}),
+        "time_increment": 1,
+        "limit": 500,
+    }
+    if breakdowns:
+        params["breakdowns"] = breakdowns
+
+    while url:
+        body = await meta_get(http, url, params=params)
+        for row in body.get("data", []):
+            yield row
+        # `next` already carries every query parameter
+        url = body.get("paging", {}).get("next")
+        params = None
+
+
+async def aiter_analytics_rows(http, access_token, ad_account_id, start_date, end_date):
+    async for row in aiter_insights(http, access_token, ad_account_id, start_date, end_date):
+        yield daily_row_from_insight(row, ad_account_id)
+
+
+async def aiter_device_rows(http, access_token, ad_account_id, start_date, end_date):
+    async for row in aiter_insights(http, access_token, ad_account_id, start_date, end_date, breakdowns="device_platform"):
+        yield device_row_from_insight(row, ad_account_id)
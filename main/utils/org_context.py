@@ -0,0 +1,137 @@
+"""
+Resolves the organization named by `?org_id=` and the caller's membership
+once per request.
+
+The result is attached to the request, so the permissions, the mixin and the
+view share it. Only the ids, role and status are cached in Redis for a short
+time per user + organization, enough for the permission checks; the model
+instances are fetched fresh by primary key when a view asks for them, so
+views never save back a stale cached copy. Organization and membership
+changes bump a per organization version, which makes every cached entry of
+that organization unreachable.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.functional import cached_property
+
+from main.models import Organization, OrganizationMember
+
+CONTEXT_KEY = "org_context:ids:{org_id}:{version}:{user_id}"
+VERSION_KEY = "org_context:version:{org_id}"
+CONTEXT_TTL = 60
+# Seen by the analytics sync scheduler, which syncs organizations in use more often
+ACTIVE_KEY = "org_active:{org_id}"
+ACTIVE_TTL = 60 * 15
+# A process rewrites the activity key at most this often (seconds) per
+# organization; the key lives that much longer, so it still outlasts the
+# last request by at least ACTIVE_TTL
+ACTIVE_REFRESH = 60 * 3
+
+_active_marked_at = {}
+
+
+class OrganizationContext:
+    def __init__(self, org_id, organization_id=None, membership_id=None, role=None, status=None):
+        self.org_id = org_id  # the snowflake id it was resolved for
+        self.organization_id = organization_id
+        self.membership_id = membership_id
+        self.role = role
+        self.status = status
+
+    @classmethod
+    def load(cls, org_id, user):
+        organization_id = Organization.objects.filter(snowflake_id=org_id).values_list('id', flat=True).first()
+        membership = None
+        if organization_id and user.is_authenticated:
+            membership = OrganizationMember.objects.filter(
+                user=user, organization_id=organization_id
+            ).values('id', 'role', 'status').first()
+        membership = membership or {}
+        return cls(org_id, organization_id, membership.get('id'), membership.get('role'), membership.get('status'))
+
+    def as_cache(self):
+        return (self.organization_id, self.membership_id, self.role, self.status)
+
+    @cached_property
+    def organization(self):
+        if self.organization_id is None:
+            return None
+        return Organization.objects.filter(id=self.organization_id).first()
+
+    @cached_property
+    def membership(self):
+        if self.membership_id is None:
+            return None
+        return OrganizationMember.objects.filter(id=self.membership_id).first()
+
+    @property
+    def is_member(self):
+        return self.membership_id is not None
+
+    def has_role(self, *roles):
+        return self.membership_id is not None and self.role in roles
+
+
+def _get_version(org_id):
+    return cache.get(VERSION_KEY.format(org_id=org_id), 0)
+
+
+def invalidate_org_context(org_id):
+    key = VERSION_KEY.format(org_id=org_id)
+    if not cache.add(key, 1, None):
+        cache.incr(key)
+
+
+def invalidate_org_context_on_commit(org_id):
+    transaction.on_commit(lambda: invalidate_org_context(org_id))
+
+
+def mark_org_active(org_id):
+    # Sliding window: member requests push the expiry back, without a cache
+    # write on every request
+    now = time.monotonic()
+    if now - _active_marked_at.get(org_id, -ACTIVE_REFRESH) < ACTIVE_REFRESH:
+        return
+    _active_marked_at[org_id] = now
+    cache.set(ACTIVE_KEY.format(org_id=org_id), 1, ACTIVE_TTL + ACTIVE_REFRESH)
+
+
+def active_organizations(org_ids):
+    """The subset of `org_ids` with a member request in the last `ACTIVE_TTL` seconds."""
+    found = cache.get_many([ACTIVE_KEY.format(org_id=org_id) for org_id in org_ids])
+    return {org_id for org_id in org_ids if ACTIVE_KEY.format(org_id=org_id) in found}
+
+
+def get_org_context(request, org_id=None):
+    """
+    Returns the `OrganizationContext` for `org_id` (defaults to the
+    `org_id` query parameter), or None when no id was given.
+    """
+    org_id = org_id or request.query_params.get("org_id")
+    if not org_id:
+        return None
+
+    resolved = getattr(request, "_org_contexts", None)
+    if resolved is None:
+        resolved = request._org_contexts = {}
+    if org_id in resolved:
+        return resolved[org_id]
+
+    user = request.user
+    if user.is_authenticated:
+        key = CONTEXT_KEY.format(org_id=org_id, version=_get_version(org_id), user_id=user.pk)
+        cached = cache.get(key)
+        if cached is None:
+            context = OrganizationContext.load(org_id, user)
+            cache.set(key, context.as_cache(), CONTEXT_TTL)
+        else:
+            context = OrganizationContext(org_id, *cached)
+    else:
+        context = OrganizationContext.load(org_id, user)
+
+    if context.is_member:
+        mark_org_active(org_id)
+    resolved[org_id] = context
+    return context
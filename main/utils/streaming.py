@@ -0,0 +1,82 @@
+"""
+Helpers for streaming JSON mode LLM completions to the browser as
+server-sent events.
+"""
+import json
+
+from django.http import StreamingHttpResponse
+
+
+class PartialJSONStrings:
+    """
+    Incremental scanner over a JSON document that arrives in chunks.
+    `feed()` returns every string value completed by the chunk as
+    `(path, value)`, where `path` holds the object keys and array indexes
+    leading to it, e.g. `(("variations", 0), "Copy 1")`. Object keys and
+    non-string scalars are consumed but not reported.
+    """
+
+    def __init__(self):
+        self.stack = []  # [kind, key or index, expecting a key]
+        self.in_string = False
+        self.escaped = False
+        self.raw = []
+
+    def path(self):
+        return tuple(entry[1] for entry in self.stack)
+
+    def _close_string(self):
+        value = json.loads('"' + "".join(self.raw) + '"')
+        self.raw = []
+        top = self.stack[-1] if self.stack else None
+        if top and top[0] == "object" and top[2]:
+            top[1] = value
+            top[2] = False
+            return None
+        return self.path(), value
+
+    def feed(self, chunk):
+        completed = []
+        for char in chunk:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                    self.raw.append(char)
+                elif char == "\\":
+                    self.escaped = True
+                    self.raw.append(char)
+                elif char == '"':
+                    self.in_string = False
+                    item = self._close_string()
+                    if item:
+                        completed.append(item)
+                else:
+                    self.raw.append(char)
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.stack.append(["object", None, True])
+            elif char == "[":
+                self.stack.append(["array", 0, False])
+            elif char in "}]" and self.stack:
+                self.stack.pop()
+            elif char == "," and self.stack:
+                top = self.stack[-1]
+                if top[0] == "object":
+                    top[2] = True
+                else:
+                    top[1] += 1
+        return completed
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """Wraps an (async) iterator of `sse_event` strings in an unbuffered event-stream response."""
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Keeps nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
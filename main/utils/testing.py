@@ -0,0 +1,16 @@
+"""
+Fixtures shared by the app test suites.
+"""
+from django.test import override_settings
+
+from accounts.models import User
+
+# Tests never need Redis, the cache backend is swapped for a local one
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+use_locmem_cache = override_settings(CACHES=LOCMEM_CACHE)
+
+
+def create_organization(email):
+    """A new user's organization, created by the user post_save signal."""
+    return User.objects.create(email=email).owned_organizations.get()
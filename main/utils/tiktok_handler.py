@@ -1,25 +1,326 @@
-import requests, datetime, json, os
+import requests, datetime, json, os, random, time, logging, asyncio
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from django.conf import settings
 from django.utils import timezone
 from datetime import datetime, timezone as dt_timezone
 from dotenv import load_dotenv
 load_dotenv()
 
 from main.models import UnifiedCampaign, PlatformCampaign
+from main.utils.analytics import bulk_save_daily_analytics, bulk_save_device_metrics
+from main.utils.http import decode_json_object
+from analysis.metrics import to_minor
+
+logger = logging.getLogger(__name__)
 
 # --- CONFIGURATION (SANDBOX) ---
 # ⚠️ TikTok Sandbox URL is different from Production!
+# Only the manual flows on the sandbox credentials below use it, clients
+# built for an integration use settings.TIKTOK_API_BASE_URL
 BASE_URL = "https://sandbox-ads.tiktok.com/open_api/v1.3"
-PRODUCTION_URL = "https://ads.tiktok.com/open_api/v1.3"
+PRODUCTION_URL = "https://business-api.tiktok.com/open_api/v1.3"
 
 # PASTE YOUR CREDENTIALS HERE
 ACCESS_TOKEN = os.getenv('ACCESS_TOKEN')
 ADVERTISER_ID = os.getenv('ADVERTISER_ID')
 
-# Standard Headers for every request
-HEADERS = {
-    "Access-Token": ACCESS_TOKEN,
-    "Content-Type": "application/json"
-}
+# (connect, read) timeout in seconds for every TikTok call
+DEFAULT_TIMEOUT = (5, 30)
+
+# TikTok answers with HTTP 200 and a non-zero `code` when throttled:
+# 40100 = too many requests, 40200/40201 = task/app QPS limits, 50000/50002 = transient server errors
+THROTTLE_CODES = {40100, 40200, 40201}
+RETRYABLE_CODES = THROTTLE_CODES | {50000, 50002}
+THROTTLE_STATUS = {429}
+RETRYABLE_STATUS = THROTTLE_STATUS | {500, 502, 503, 504}
+
+# Safe to resend after a timeout or a 5xx. Anything else (the */create/
+# calls) may already have been applied, so it is only retried when TikTok
+# says it was throttled, i.e. rejected before doing anything.
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class TikTokAPIError(Exception):
+    def __init__(self, code, message, request_id=None):
+        super().__init__(f"TikTok API error {code}: {message}")
+        self.code = code
+        self.message = message
+        self.request_id = request_id
+
+
+class BaseTikTokClient:
+    """
+    Configuration and retry policy shared by the sync and async TikTok clients.
+    """
+
+    def __init__(self, access_token, advertiser_id=None, base_url=None,
+                 timeout=DEFAULT_TIMEOUT, max_retries=3, backoff=1.0, max_backoff=30.0, pool_size=10):
+        self.access_token = access_token
+        self.advertiser_id = advertiser_id
+        self.base_url = (base_url or getattr(settings, 'TIKTOK_API_BASE_URL', PRODUCTION_URL)).rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+
+    @classmethod
+    def for_integration(cls, integration, base_url=None, **kwargs):
+        """Client for a connected advertiser, on `settings.TIKTOK_API_BASE_URL` unless `base_url` is given."""
+        return cls(integration.access_token, integration.ad_account_id, base_url=base_url, **kwargs)
+
+    def _url(self, path):
+        return path if path.startswith('http') else f"{self.base_url}/{path.lstrip('/')}"
+
+    def _headers(self, extra=None):
+        headers = {"Access-Token": self.access_token}
+        if extra:
+            headers.update(extra)
+        return headers
+
+    def _retry_delay(self, attempt):
+        # Full jitter: spread concurrent workers instead of retrying in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    @staticmethod
+    def _is_idempotent(method, idempotent):
+        return method.upper() in IDEMPOTENT_METHODS if idempotent is None else idempotent
+
+    # Unreadable bodies are left to the status checks
+    _decode = staticmethod(decode_json_object)
+
+    def _should_retry(self, method, path, status_code, body, attempt, idempotent):
+        statuses, codes = (RETRYABLE_STATUS, RETRYABLE_CODES) if idempotent else (THROTTLE_STATUS, THROTTLE_CODES)
+        reason = None
+        if status_code in statuses:
+            reason = f"HTTP {status_code}"
+        elif body is not None and body.get('code') in codes:
+            reason = f"code {body.get('code')}"
+        if reason:
+            logger.warning("TikTok %s %s throttled with %s, retrying (%s/%s)", method, path, reason, attempt + 1, self.max_retries)
+        return reason is not None
+
+    @staticmethod
+    def _result(res, body):
+        if body is None or res.status_code in RETRYABLE_STATUS:
+            res.raise_for_status()
+        if body is None:
+            raise TikTokAPIError(None, f"Unreadable response body (HTTP {res.status_code})")
+        return body
+
+    @staticmethod
+    def _unwrap(body):
+        if body.get('code') != 0:
+            raise TikTokAPIError(body.get('code'), body.get('message'), body.get('request_id'))
+        return body.get('data') or {}
+
+
+class TikTokClient(BaseTikTokClient):
+    """
+    Thin TikTok Business API client bound to one advertiser.
+
+    Owns a keep-alive connection pool so every call made for the same
+    integration reuses the TLS connection, sends the access token per
+    request (never through shared module state), applies a timeout to
+    every call and retries rate-limit/transient errors with jittered
+    exponential backoff.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def request(self, method, path, params=None, json=None, data=None, files=None, headers=None, timeout=None, idempotent=None):
+        """
+        Performs a call and returns the decoded TikTok envelope
+        (`{"code": ..., "message": ..., "data": ...}`).
+
+        Timeouts, connection errors and 5xx are only retried for GET or
+        when the caller passes `idempotent=True`; other calls are retried
+        on throttling alone. Multipart uploads are never retried since the
+        file stream has already been consumed.
+        """
+        idempotent = self._is_idempotent(method, idempotent)
+        attempts = 1 if files else self.max_retries + 1
+
+        for attempt in range(attempts):
+            last_try = attempt == attempts - 1
+            try:
+                res = self.session.request(
+                    method, self._url(path),
+                    params=params, json=json, data=data, files=files,
+                    headers=self._headers(headers),
+                    timeout=timeout or self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if last_try or not idempotent:
+                    raise
+                logger.warning("TikTok %s %s failed to connect, retrying (%s/%s)", method, path, attempt + 1, self.max_retries)
+                time.sleep(self._retry_delay(attempt))
+                continue
+
+            body = self._decode(res)
+            if not last_try and self._should_retry(method, path, res.status_code, body, attempt, idempotent):
+                time.sleep(self._retry_delay(attempt))
+                continue
+            return self._result(res, body)
+
+    def get(self, path, params=None, **kwargs):
+        return self.request('GET', path, params=params, **kwargs)
+
+    def post(self, path, json=None, **kwargs):
+        return self.request('POST', path, json=json, **kwargs)
+
+    def get_data(self, path, params=None, **kwargs):
+        """
+        Same as `get` but unwraps `data` and raises `TikTokAPIError` on a non-zero code.
+        """
+        return self._unwrap(self.get(path, params=params, **kwargs))
+
+
+class AsyncTikTokClient(BaseTikTokClient):
+    """
+    asyncio flavour of `TikTokClient` built on httpx, used by the analytics
+    sync engine to fetch many advertisers concurrently from one worker.
+
+    Pass a shared `httpx.AsyncClient` to pool connections across advertisers.
+    """
+
+    def __init__(self, *args, http=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._owns_http = http is None
+        self.http = http or httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_http:
+            await self.http.aclose()
+
+    async def request(self, method, path, params=None, json=None, headers=None, idempotent=None):
+        idempotent = self._is_idempotent(method, idempotent)
+        attempts = self.max_retries + 1
+
+        for attempt in range(attempts):
+            last_try = attempt == attempts - 1
+            try:
+                res = await self.http.request(
+                    method, self._url(path),
+                    params=params, json=json,
+                    headers=self._headers(headers),
+                )
+            except httpx.TransportError:
+                if last_try or not idempotent:
+                    raise
+                logger.warning("TikTok %s %s failed to connect, retrying (%s/%s)", method, path, attempt + 1, self.max_retries)
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+
+            body = self._decode(res)
+            if not last_try and self._should_retry(method, path, res.status_code, body, attempt, idempotent):
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            return self._result(res, body)
+
+    async def get(self, path, params=None, **kwargs):
+        return await self.request('GET', path, params=params, **kwargs)
+
+    async def post(self, path, json=None, **kwargs):
+        return await self.request('POST', path, json=json, **kwargs)
+
+    async def get_data(self, path, params=None, **kwargs):
+        return self._unwrap(await self.get(path, params=params, **kwargs))
+
+
+def get_default_client():
+    """
+    Client bound to the sandbox credentials from the environment.
+    Used by the manual flows at the bottom of this module.
+    """
+    return TikTokClient(ACCESS_TOKEN, ADVERTISER_ID, base_url=BASE_URL)
+
+# TikTok caps page_size at 1000 for both campaign/get/ and report/integrated/get/
+PAGE_SIZE = 1000
+
+def iter_pages(client, path, params, page_size=PAGE_SIZE, prefetch=False):
+    """
+    Lazily yields the `list` of every page of a TikTok list endpoint.
+
+    With `prefetch=True` the next page is requested on a background
+    thread while the caller is still consuming the current one.
+    """
+    def fetch(page):
+        return client.get_data(path, params={**params, "page": page, "page_size": page_size})
+
+    data = fetch(1)
+    total_pages = data.get('page_info', {}).get('total_page') or 1
+
+    if not prefetch or total_pages == 1:
+        yield data.get('list', [])
+        for page in range(2, total_pages + 1):
+            yield fetch(page).get('list', [])
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        next_page = pool.submit(fetch, 2)
+        yield data.get('list', [])
+        for page in range(2, total_pages + 1):
+            data = next_page.result()
+            if page < total_pages:
+                next_page = pool.submit(fetch, page + 1)
+            yield data.get('list', [])
+
+def iter_list(client, path, params, **kwargs):
+    for page in iter_pages(client, path, params, **kwargs):
+        yield from page
+
+async def aiter_pages(client, path, params, page_size=PAGE_SIZE, prefetch=True):
+    """
+    Async counterpart of `iter_pages` for an `AsyncTikTokClient`.
+    """
+    async def fetch(page):
+        return await client.get_data(path, params={**params, "page": page, "page_size": page_size})
+
+    data = await fetch(1)
+    total_pages = data.get('page_info', {}).get('total_page') or 1
+
+    next_page = None
+    try:
+        for page in range(1, total_pages + 1):
+            if page > 1:
+                data = await next_page if next_page else await fetch(page)
+            next_page = asyncio.create_task(fetch(page + 1)) if prefetch and page < total_pages else None
+            yield data.get('list', [])
+    finally:
+        # Consumer stopped early
+        if next_page and not next_page.done():
+            next_page.cancel()
+
+async def aiter_list(client, path, params, **kwargs):
+    async for page in aiter_pages(client, path, params, **kwargs):
+        for item in page:
+            yield item
 
 def to_tiktok_datetime(dt):
     """
@@ -86,7 +387,7 @@ def get_tiktok_adgroup_config(objective):
         "pacing": "PACING_MODE_SMOOTH",
     }
 
-def create_platform_campaign_for_tiktok(campaign, integration, ADVERTISER_ID, ACCESS_TOKEN):
+def create_platform_campaign_for_tiktok(campaign, integration, ADVERTISER_ID, ACCESS_TOKEN, client=None):
     print(type(campaign))
     platform_campaign = PlatformCampaign.objects.get(unified_campaign=campaign, integration=integration)
     campaign_budget = campaign.campaignbudget_set.filter(platform='TIKTOK').first()
@@ -94,10 +395,9 @@ def create_platform_campaign_for_tiktok(campaign, integration, ADVERTISER_ID, AC
         print("TikTok Campaign already exists. Skipping creation.")
         return platform_campaign.platform_campaign_id
     
-    url = f"{BASE_URL}/campaign/create/"
     # ADVERTISER_ID = integration.ad_account_id
     # ACCESS_TOKEN = integration.access_token
-    HEADERS["Access-Token"] = ACCESS_TOKEN
+    client = client or TikTokClient(ACCESS_TOKEN, ADVERTISER_ID, base_url=BASE_URL)
     
     payload = {
         "advertiser_id": ADVERTISER_ID,
@@ -107,8 +407,7 @@ def create_platform_campaign_for_tiktok(campaign, integration, ADVERTISER_ID, AC
         "budget": campaign_budget.daily_budget_minor, # Minimum is usually 50 in Sandbox
     }
     
-    res = requests.post(url, headers=HEADERS, json=payload)
-    data = res.json()
+    data = client.post("campaign/create/", json=payload)
     
     if data['code'] != 0:
         print(f"❌ Campaign Failed: {data['message']}")
@@ -122,14 +421,14 @@ def create_platform_campaign_for_tiktok(campaign, integration, ADVERTISER_ID, AC
     return campaign_id
     
 
-def create_ad_group_for_tiktok(campaign_id):
-    url = f"{BASE_URL}/adgroup/create/"
+def create_ad_group_for_tiktok(campaign_id, client=None):
     print(campaign_id)
-    platform_campaign = PlatformCampaign.objects.get(platform_campaign_id=campaign_id)
+    platform_campaign = PlatformCampaign.objects.select_related('integration').get(platform_campaign_id=campaign_id)
     adgroup = platform_campaign.ad_groups.first()
+    client = client or TikTokClient.for_integration(platform_campaign.integration)
     # Ad Group requires stricter validation than Meta
     payload = {
-        "advertiser_id": ADVERTISER_ID,
+        "advertiser_id": client.advertiser_id,
         "campaign_id": campaign_id,
         "adgroup_name": adgroup.name,
         "placement_type": "PLACEMENT_TYPE_NORMAL",
@@ -144,8 +443,7 @@ def create_ad_group_for_tiktok(campaign_id):
     config = get_tiktok_adgroup_config(platform_campaign.unified_campaign.objective)
     payload.update(config)
     
-    res = requests.post(url, headers=HEADERS, json=payload)
-    data = res.json()
+    data = client.post("adgroup/create/", json=payload)
     
     if data['code'] != 0:
         print(f"❌ Ad Group Failed: {data['message']}")
@@ -166,15 +464,16 @@ def create_tiktok_ad_creative(campaign, integration):
 def create_full_ad_for_tiktok(campaign, integration):
 
     # TODO: Need to change to the actual values from campaign and integration
-    campaign_id = create_platform_campaign_for_tiktok(campaign, integration, integration.ad_account_id, integration.access_token)
-    adgroup_id = create_ad_group_for_tiktok(campaign_id)
+    with TikTokClient.for_integration(integration) as client:
+        campaign_id = create_platform_campaign_for_tiktok(campaign, integration, integration.ad_account_id, integration.access_token, client=client)
+        adgroup_id = create_ad_group_for_tiktok(campaign_id, client=client)
 
 def create_tiktok_ad_flow():
     print(f"🚀 Starting TikTok Sandbox Flow for Advertiser: {ADVERTISER_ID}")
+    client = get_default_client()
 
     # --- 1. CREATE CAMPAIGN ---
     print("\n1️⃣ Creating Campaign...")
-    url = f"{BASE_URL}/campaign/create/"
     payload = {
         "advertiser_id": ADVERTISER_ID,
         "campaign_name": "Python Sandbox Campaign 2025-12-20 6",
@@ -183,8 +482,7 @@ def create_tiktok_ad_flow():
         "budget": 50.0, # Minimum is usually 50 in Sandbox
     }
     
-    res = requests.post(url, headers=HEADERS, json=payload)
-    data = res.json()
+    data = client.post("campaign/create/", json=payload)
     
     if data['code'] != 0:
         print(f"❌ Campaign Failed: {data['message']}")
@@ -195,7 +493,6 @@ def create_tiktok_ad_flow():
     # campaign_id = "1851326442807426"  # Use existing campaign for testing
     # --- 2. CREATE AD GROUP (Targeting) ---
     print("\n2️⃣ Creating Ad Group...")
-    url = f"{BASE_URL}/adgroup/create/"
     
     # Ad Group requires stricter validation than Meta
     payload = {
@@ -216,8 +513,7 @@ def create_tiktok_ad_flow():
         "promotion_type": "WEBSITE", 
     }
     
-    res = requests.post(url, headers=HEADERS, json=payload)
-    data = res.json()
+    data = client.post("adgroup/create/", json=payload)
     
     if data['code'] != 0:
         print(f"❌ Ad Group Failed: {data['message']}")
@@ -236,8 +532,6 @@ def create_tiktok_ad_flow():
         return
 
     # Step A: Initialize Upload to get a Signature
-    url = f"{BASE_URL}/file/video/ad/upload/"
-    
     # We send the file binary logic differently here
     with open(video_path, 'rb') as f:
         files = {
@@ -250,10 +544,7 @@ def create_tiktok_ad_flow():
         
         # Requests library handles multipart/form-data automatically if we pass 'files'
         # We DO NOT send JSON content-type here
-        upload_headers = {"Access-Token": ACCESS_TOKEN} 
-        
-        res = requests.post(url, headers=upload_headers, data=data_payload, files=files)
-        data = res.json()
+        data = client.request("POST", "file/video/ad/upload/", data=data_payload, files=files)
 
     if data['code'] != 0:
         print(f"❌ Video Upload Failed: {data['message']}")
@@ -264,7 +555,6 @@ def create_tiktok_ad_flow():
 
     # --- 4. CREATE AD (Creative) ---
     print("\n4️⃣ Creating Final Ad...")
-    url = f"{BASE_URL}/ad/create/"
     
     payload = {
         "advertiser_id": ADVERTISER_ID,
@@ -284,8 +574,7 @@ def create_tiktok_ad_flow():
         ]
     }
     
-    res = requests.post(url, headers=HEADERS, json=payload)
-    data = res.json()
+    data = client.post("ad/create/", json=payload)
     
     if data['code'] != 0:
         print(f"❌ Ad Creation Failed: {data['message']}")
@@ -296,14 +585,12 @@ def create_tiktok_ad_flow():
     print(f"\n🎉 SUCCESS! TikTok Ad Created. ID: {ad_id}")
 
 def get_campaigns():
-    url = f"{BASE_URL}/campaign/get/"
     print(ADVERTISER_ID)
     payload = {
         "advertiser_id": ADVERTISER_ID
     }
     
-    res = requests.get(url, headers=HEADERS, params=payload)
-    data = res.json()
+    data = get_default_client().get("campaign/get/", params=payload)
     with open('tiktok_campaigns.json', 'w') as f:
         json.dump(data, f, indent=4)
     
@@ -318,14 +605,12 @@ def get_campaigns():
         print(campaign)
 
 def get_single_campaign(campaign_id):
-    url = f"{BASE_URL}/campaign/get/"
     payload = {
         "advertiser_id": ADVERTISER_ID,
         "campaign_ids": [campaign_id]
     }
     
-    res = requests.get(url, headers=HEADERS, params=payload)
-    data = res.json()
+    data = get_default_client().get("campaign/get/", params=payload)
     
     if data['code'] != 0:
         print(f"❌ Get Single Campaign Failed: {data['message']}")
@@ -335,8 +620,9 @@ def get_single_campaign(campaign_id):
     print(f"\n📋 Campaign Details for ID {campaign_id}:")
     print(json.dumps(campaign, indent=4))
 
-def get_analytics(ACCESS_TOKEN=None, ADVERTISER_ID=None):
-    url = f"{PRODUCTION_URL}/report/integrated/get/"
+def get_analytics(ACCESS_TOKEN=None, ADVERTISER_ID=None, client=None):
+    client = client or TikTokClient(ACCESS_TOKEN, ADVERTISER_ID, base_url=PRODUCTION_URL)
+    ADVERTISER_ID = client.advertiser_id
     payload = {
         "advertiser_id": ADVERTISER_ID,
         "dimensions": json.dumps(["campaign_id"]), 
@@ -348,14 +634,9 @@ def get_analytics(ACCESS_TOKEN=None, ADVERTISER_ID=None):
         "page": 1,
         "page_size": 50
     }
-    HEADERS["Access-Token"] = ACCESS_TOKEN
     
-    res = requests.get(url, headers=HEADERS, params=payload)
-
-    print("Response Status Code:", res.status_code)
-    print("Response Content:", res.text)
-
-    data = res.json()
+    data = client.get("report/integrated/get/", params=payload)
+    print("Response Content:", data)
     
     if data['code'] != 0:
         print(f"❌ Get Analytics Failed: {data['message']}")
@@ -367,53 +648,31 @@ def get_analytics(ACCESS_TOKEN=None, ADVERTISER_ID=None):
         print(report)
     return reports
 
-def get_detailed_analytics(ACCESS_TOKEN=ACCESS_TOKEN, ADVERTISER_ID=ADVERTISER_ID, target_date=None):
-    """
-    Returns campaign metrics including ROAS and Device Breakdown.
-    Format: { 
-        'Campaign Name': { 
-            'campaign_id': '...',
-            'total_performance': {...}, 
-            'device_breakdown': {...} 
-        } 
-    }
-    """
-
-    if target_date is None:
-        target_date = datetime.now().strftime("%Y-%m-%d")
-
-    headers = {"Access-Token": ACCESS_TOKEN, "Content-Type": "application/json"}
-
-    # 1. Fetch campaigns
-    camp_res = requests.get(f"{BASE_URL}/campaign/get/", headers=headers, params={"advertiser_id": ADVERTISER_ID})
-    all_campaigns = camp_res.json().get('data', {}).get('list', [])
-    
+def get_valid_campaigns(all_campaigns):
     # Map IDs to Names and filter out deleted/drafts
-    valid_camps = {str(c['campaign_id']): c['campaign_name'] for c in all_campaigns 
-                   if str(c.get('primary_status')).upper() not in ["DELETE", "DRAFT"]}
-    
-    if not valid_camps:
-        return {}
+    return {str(c['campaign_id']): c['campaign_name'] for c in all_campaigns 
+            if str(c.get('primary_status')).upper() not in ["DELETE", "DRAFT"]}
 
-    # 2. Fetch Integrated Report
-    report_payload = {
-        "advertiser_id": ADVERTISER_ID,
+def get_detailed_report_payload(advertiser_id, start_date, end_date, dimensions):
+    # Rows of deleted/draft campaigns are dropped while reading: filtering by
+    # campaign_ids would cap the report at TikTok's 100 ids per filter.
+    return {
+        "advertiser_id": advertiser_id,
         "report_type": "BASIC",
         "data_level": "AUCTION_CAMPAIGN",
-        "dimensions": json.dumps(["campaign_id", "device_system"]), 
+        "dimensions": json.dumps(dimensions), 
         "metrics": json.dumps([
-            "spend", "impressions", "clicks", "ctr", "cpc", "conversion_roas"
+            "spend", "impressions", "clicks", "ctr", "cpc", "conversion", "conversion_roas"
         ]),
-        "start_date": target_date,
-        "end_date": target_date,
-        "filtering": json.dumps({"campaign_ids": list(valid_camps.keys())}),
-        "page_size": 100
+        "start_date": start_date,
+        "end_date": end_date,
     }
 
-    res = requests.get(f"{BASE_URL}/report/integrated/get/", headers=headers, params=report_payload)
-    report_data = res.json().get('data', {}).get('list', [])
-
-    # 3. Structure the Result
+def build_detailed_analytics(valid_camps, report_data):
+    """
+    Folds `campaign_id x device_system` report rows into the per campaign
+    structure returned by `get_detailed_analytics`.
+    """
     final_output = {}
 
     # Initialize output for all valid campaigns
@@ -441,14 +700,7 @@ def get_detailed_analytics(ACCESS_TOKEN=ACCESS_TOKEN, ADVERTISER_ID=ADVERTISER_I
         if not c_name: continue
 
         # Add to device breakdown
-        final_output[c_name]["device_breakdown"][device] = {
-            "spend": m.get("spend"),
-            "impressions": m.get("impressions"),
-            "clicks": m.get("clicks"),
-            "ctr": f"{m.get('ctr')}",
-            "cpc": m.get("cpc"),
-            "roas": m.get("conversion_roas")
-        }
+        final_output[c_name]["device_breakdown"][device] = get_device_metrics(m)
         
         # Update Total Performance
         total = final_output[c_name]["total_performance"]
@@ -469,6 +721,130 @@ def get_detailed_analytics(ACCESS_TOKEN=ACCESS_TOKEN, ADVERTISER_ID=ADVERTISER_I
 
     return final_output
 
+def get_detailed_analytics(ACCESS_TOKEN=ACCESS_TOKEN, ADVERTISER_ID=ADVERTISER_ID, target_date=None, client=None):
+    """
+    Returns campaign metrics including ROAS and Device Breakdown.
+    Format: { 
+        'Campaign Name': { 
+            'campaign_id': '...',
+            'total_performance': {...}, 
+            'device_breakdown': {...} 
+        } 
+    }
+    """
+
+    if target_date is None:
+        target_date = datetime.now().strftime("%Y-%m-%d")
+
+    client = client or TikTokClient(ACCESS_TOKEN, ADVERTISER_ID, base_url=BASE_URL)
+
+    # 1. Fetch campaigns
+    valid_camps = get_campaign_names(client)
+    
+    if not valid_camps:
+        return {}
+
+    # 2. Fetch Integrated Report (every page)
+    report_payload = get_detailed_report_payload(client.advertiser_id, target_date, target_date, ["campaign_id", "device_system"])
+    report_data = iter_list(client, "report/integrated/get/", report_payload, prefetch=True)
+
+    # 3. Structure the Result
+    return build_detailed_analytics(valid_camps, report_data)
+
+# --- Streaming ingestion into AnalysisDaily ---
+
+def get_device_metrics(m):
+    return {
+        "spend": m.get("spend"),
+        "impressions": m.get("impressions"),
+        "clicks": m.get("clicks"),
+        "ctr": f"{m.get('ctr')}",
+        "cpc": m.get("cpc"),
+        "roas": m.get("conversion_roas")
+    }
+
+def get_fact_metrics(m):
+    spend = float(m.get("spend", 0))
+    return {
+        "impressions": int(m.get("impressions", 0)),
+        "clicks": int(m.get("clicks", 0)),
+        "spend_minor": to_minor(m.get("spend", 0)),
+        "conversions": int(float(m.get("conversion", 0))),
+        # TikTok only reports the ratio, ROAS = value / spend
+        "conversion_value_minor": to_minor(spend * float(m.get("conversion_roas", 0))),
+    }
+
+def daily_row_from_report(row, valid_camps, advertiser_id):
+    c_id = str(row['dimensions']['campaign_id'])
+    if c_id not in valid_camps:
+        return None
+    return {
+        "platform": "TIKTOK",
+        "account_id": advertiser_id,
+        "campaign_id": c_id,
+        "campaign_name": valid_camps[c_id],
+        "adgroup_id": "",
+        "date": row['dimensions']['stat_time_day'][:10],
+        **get_fact_metrics(row['metrics']),
+    }
+
+def device_row_from_report(row, valid_camps, advertiser_id):
+    c_id = str(row['dimensions']['campaign_id'])
+    if c_id not in valid_camps:
+        return None
+    return {
+        "platform": "TIKTOK",
+        "account_id": advertiser_id,
+        "campaign_id": c_id,
+        "adgroup_id": "",
+        "date": row['dimensions']['stat_time_day'][:10],
+        "device": row['dimensions']['device_system'],
+        **get_fact_metrics(row['metrics']),
+    }
+
+DAILY_DIMENSIONS = ["campaign_id", "stat_time_day"]
+DEVICE_DIMENSIONS = ["campaign_id", "stat_time_day", "device_system"]
+
+def get_campaign_names(client):
+    return get_valid_campaigns(iter_list(client, "campaign/get/", {"advertiser_id": client.advertiser_id}))
+
+def iter_analytics_rows(client, valid_camps, start_date, end_date, dimensions, to_row, prefetch=True):
+    payload = get_detailed_report_payload(client.advertiser_id, start_date, end_date, dimensions)
+    for report_row in iter_list(client, "report/integrated/get/", payload, prefetch=prefetch):
+        row = to_row(report_row, valid_camps, client.advertiser_id)
+        if row:
+            yield row
+
+def sync_daily_analytics(client, organization, start_date, end_date, prefetch=True):
+    """
+    Streams every page of the campaign/day report straight into the
+    AnalysisDaily bulk writer, then merges the device breakdown report
+    into the same rows. Nothing is held in memory beyond one chunk.
+    """
+    valid_camps = get_campaign_names(client)
+    if not valid_camps:
+        return {"inserted": 0, "updated": 0}
+
+    result = bulk_save_daily_analytics(
+        iter_analytics_rows(client, valid_camps, start_date, end_date, DAILY_DIMENSIONS, daily_row_from_report, prefetch),
+        organization,
+    )
+    bulk_save_device_metrics(
+        iter_analytics_rows(client, valid_camps, start_date, end_date, DEVICE_DIMENSIONS, device_row_from_report, prefetch),
+        organization,
+    )
+    return result
+
+async def aget_campaign_names(client):
+    return get_valid_campaigns([c async for c in aiter_list(client, "campaign/get/", {"advertiser_id": client.advertiser_id})])
+
+async def aiter_analytics_rows(client, valid_camps, start_date, end_date, dimensions, to_row, prefetch=True):
+    payload = get_detailed_report_payload(client.advertiser_id, start_date, end_date, dimensions)
+    async for report_row in aiter_list(client, "report/integrated/get/", payload, prefetch=prefetch):
+        row = to_row(report_row, valid_camps, client.advertiser_id)
+        if row:
+            yield row
+
 if __name__ == '__main__':
     # create_tiktok_ad_flow()
     # get_campaigns()
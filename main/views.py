@@ -5,7 +5,7 @@ from django.db import models
 from accounts.models import User
 from main.utils.tiktok_handler import create_full_ad_for_tiktok
 from .serializers import (
-    AIAdCopySerializer, CampaignSerializer, CreateAdSerializer, AICopyRequestSerializer, OrganizationSerializer, TeamMemberInviteSerializer, TeamMemberSerializer
+    AIAdCopySerializer, AICopyBatchRequestSerializer, CampaignSerializer, CreateAdSerializer, AICopyRequestSerializer, OrganizationSerializer, TeamMemberInviteSerializer, TeamMemberSerializer
 )
 from .models import UnifiedCampaign, Organization, OrganizationMember, TeamInvitation
 from main.utils.object_handlers import (
@@ -15,8 +15,10 @@ from accounts.permissions import IsAdminOrOwnerOfOrganization, IsRegularPlatform
 from rest_framework.filters import SearchFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.pagination import PageNumberPagination
-from .ai_services import generate_ad_copy, generate_copy
-from .mixins import RequiredOrganizationIDMixin
+from .ai_services import astream_ad_copy, astream_copy, generate_ad_copy, generate_copy, generate_copy_batch
+from .utils.streaming import sse_event, sse_response
+from .tasks import enqueue_ai_copy_job, get_ai_copy_job
+from .mixins import CampaignMetricsMixin, RequiredOrganizationIDMixin
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiTypes
 from django.core.mail import send_mail
 from django.conf import settings
@@ -24,8 +26,10 @@ from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 from accounts.email_utils import send_team_invitation_email, send_welcome_email, send_account_created_email
 import random
-from main.utils.helper import get_dashboard_data
+from main.utils.dashboard_cache import get_cached_dashboard
+from main.utils.helper import with_campaign_metrics
 
+ASYNC_TRUE_VALUES = ('1', 'true', 'True')
 
 
 @extend_schema(
@@ -44,40 +48,16 @@ class OrganizationRetrieveUpdateAPIView(RequiredOrganizationIDMixin, generics.Re
 	permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
 
 	def get_object(self):
-		user = self.request.user
-		snoflake_id = self.get_org_id()
-		organization = Organization.objects.filter(snowflake_id=snoflake_id, memberships__user=user).first()
-		if not organization:
+		if not self.get_membership():
 			raise ValidationError({'org_id': 'Invalid organization id'})
-		return organization
+		return self.get_organization()
 
 class DashboardAPIView(RequiredOrganizationIDMixin, generics.GenericAPIView):
     permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
 
     def get(self, request, *args, **kwargs):
-        snowflake_id = self.get_org_id()
-        organization = Organization.objects.filter(snowflake_id=snowflake_id).first()
-        if not organization:
-            raise ValidationError({'org_id': 'Invalid organization id'})
-        from main.models import AIInsight
-        # Create some dummy AI insights if there are none for testing purposes
-        test_campaign = UnifiedCampaign.objects.filter(organization=organization).first()
-        if not organization.ai_insights.exists():
-            AIInsight.objects.create(
-                organization=organization,
-                campaign=test_campaign,
-                title="Test Insight 1",
-                description="This is a test insight.",
-                impect="HIGH"
-            )
-            AIInsight.objects.create(
-                organization=organization,
-                campaign=test_campaign,
-                title="Test Insight 2",
-                description="This is another test insight.",
-                impect="MEDIUM"
-            )
-        data = get_dashboard_data(organization.snowflake_id)
+        organization = self.get_organization()
+        data = get_cached_dashboard(organization)
         return Response(data, status=status.HTTP_200_OK)
 
 class CampaignPagination(PageNumberPagination):
@@ -96,7 +76,7 @@ class CampaignPagination(PageNumberPagination):
 		)
 	]
 )
-class CampaignListAPIView(RequiredOrganizationIDMixin, generics.ListAPIView):
+class CampaignListAPIView(RequiredOrganizationIDMixin, CampaignMetricsMixin, generics.ListAPIView):
 	serializer_class = CampaignSerializer
 	permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
 	filter_backends = [SearchFilter, DjangoFilterBackend]
@@ -105,11 +85,8 @@ class CampaignListAPIView(RequiredOrganizationIDMixin, generics.ListAPIView):
 	filterset_fields = ['status']
 
 	def get_queryset(self):
-		org_snowflake_id = self.get_org_id()
-		organization = Organization.objects.filter(snowflake_id=org_snowflake_id).first()
-		if not organization:
-			raise ValidationError({'org_id': 'Invalid organization id'})
-		queryset = UnifiedCampaign.objects.filter(organization=organization).order_by('-created_at')
+		organization = self.get_organization()
+		queryset = with_campaign_metrics(UnifiedCampaign.objects.filter(organization=organization)).order_by('-created_at')
 		return queryset
 
 @extend_schema(
@@ -128,11 +105,7 @@ class CreateAdAPIView(RequiredOrganizationIDMixin, generics.GenericAPIView):
 	
 	def post(self, request, *args, **kwargs):
 		serializer = CreateAdSerializer(data=request.data, context={'request': request})
-		user = request.user
-		snowflake_id = self.get_org_id()
-		organization = Organization.objects.filter(snowflake_id=snowflake_id).first()
-		if not organization:
-			raise ValidationError({'org_id': 'Invalid organization id'})
+		organization = self.get_organization()
 		
 		if serializer.is_valid(raise_exception=True):
 			data = serializer.validated_data
@@ -156,7 +129,8 @@ class CreateAdAPIView(RequiredOrganizationIDMixin, generics.GenericAPIView):
 			location=OpenApiParameter.QUERY,
 			required=True,
 			description="Organization Snowflake ID"
-		)
+		),
+		OpenApiParameter(name="async", type=OpenApiTypes.BOOL, location=OpenApiParameter.QUERY, description="Queue the generation and return a job id (202); the result is pushed over the notifications websocket"),
 	]
 )
 class AICopyGeneratorAPIView(RequiredOrganizationIDMixin, generics.GenericAPIView):
@@ -168,6 +142,8 @@ class AICopyGeneratorAPIView(RequiredOrganizationIDMixin, generics.GenericAPIVie
 		if not serializer.is_valid():
 			return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 		data = serializer.validated_data
+		if request.query_params.get('async') in ASYNC_TRUE_VALUES:
+			return Response(enqueue_ai_copy_job(request.user, 'copy', dict(data)), status=status.HTTP_202_ACCEPTED)
 		generated_copy = generate_copy(
 			product=data['product'],
 			audience=data['audience'],
@@ -179,6 +155,138 @@ class AICopyGeneratorAPIView(RequiredOrganizationIDMixin, generics.GenericAPIVie
 		return Response({'generated_copies': generated_copy}, status=status.HTTP_200_OK)
 
 
+async def copy_events(data):
+	copies = []
+	try:
+		async for variation in astream_copy(
+			product=data['product'],
+			audience=data['audience'],
+			benefits=data['benefits'],
+			tone=data['tone'],
+			copy_type=data['copy_type']
+		):
+			yield sse_event('variation', {'index': len(copies), 'text': variation})
+			copies.append(variation)
+	except Exception as e:
+		yield sse_event('error', {'error': f"Error generating copy: {str(e)}"})
+		return
+	yield sse_event('done', {'generated_copies': copies})
+
+
+async def ad_copy_events(data):
+	ad_copy = {}
+	try:
+		async for field, value in astream_ad_copy(
+			product_service=data['product_service'],
+			target_audience=data['target_audience'],
+			key_benefits=data['key_benefits'],
+			tone=data['tone']
+		):
+			yield sse_event('field', {'field': field, 'value': value})
+			ad_copy[field] = value
+	except Exception as e:
+		yield sse_event('error', {'success': False, 'error': str(e)})
+		return
+	yield sse_event('done', {'Ad copy': {**ad_copy, 'success': True}})
+
+
+@extend_schema(
+	parameters=[
+		OpenApiParameter(
+			name="org_id",
+			type=OpenApiTypes.STR,
+			location=OpenApiParameter.QUERY,
+			required=True,
+			description="Organization Snowflake ID"
+		)
+	]
+)
+class AICopyStreamAPIView(RequiredOrganizationIDMixin, generics.GenericAPIView):
+	"""
+	Same input as `generate-ai-copy/`, answered as server-sent events: one
+	`variation` event per variation as soon as it is written, then `done`
+	with the full list (or `error`).
+	"""
+	permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
+	serializer_class = AICopyRequestSerializer
+
+	def post(self, request, *args, **kwargs):
+		serializer = self.get_serializer(data=request.data)
+		if not serializer.is_valid():
+			return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+		return sse_response(copy_events(serializer.validated_data))
+
+
+@extend_schema(
+	parameters=[
+		OpenApiParameter(
+			name="org_id",
+			type=OpenApiTypes.STR,
+			location=OpenApiParameter.QUERY,
+			required=True,
+			description="Organization Snowflake ID"
+		)
+	]
+)
+class AIAdCopyStreamAPIView(RequiredOrganizationIDMixin, generics.GenericAPIView):
+	"""
+	Same input as `generate-ad-copy/`, answered as server-sent events: one
+	`field` event per ad copy field as soon as it is complete, then `done`
+	with the same body the blocking endpoint returns (or `error`).
+	"""
+	permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
+	serializer_class = AIAdCopySerializer
+
+	def post(self, request, *args, **kwargs):
+		serializer = self.get_serializer(data=request.data)
+		if not serializer.is_valid():
+			return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+		return sse_response(ad_copy_events(serializer.validated_data))
+
+
+@extend_schema(
+	parameters=[
+		OpenApiParameter(
+			name="org_id",
+			type=OpenApiTypes.STR,
+			location=OpenApiParameter.QUERY,
+			required=True,
+			description="Organization Snowflake ID"
+		)
+	]
+)
+class AICopyBatchGeneratorAPIView(RequiredOrganizationIDMixin, generics.GenericAPIView):
+	"""Generates copy for several products at once, concurrently and from the cache where possible."""
+	permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
+	serializer_class = AICopyBatchRequestSerializer
+
+	def post(self, request, *args, **kwargs):
+		serializer = self.get_serializer(data=request.data)
+		if not serializer.is_valid():
+			return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+		items = serializer.validated_data['items']
+		results = generate_copy_batch([dict(item) for item in items])
+
+		return Response({
+			'results': [
+				{'product': item['product'], 'generated_copies': generated_copy}
+				for item, generated_copy in zip(items, results)
+			]
+		}, status=status.HTTP_200_OK)
+
+
+@extend_schema(
+	parameters=[
+		OpenApiParameter(
+			name="org_id",
+			type=OpenApiTypes.STR,
+			location=OpenApiParameter.QUERY,
+			required=True,
+			description="Organization Snowflake ID"
+		),
+		OpenApiParameter(name="async", type=OpenApiTypes.BOOL, location=OpenApiParameter.QUERY, description="Queue the generation and return a job id (202); the result is pushed over the notifications websocket"),
+	]
+)
 class AIAdCopyGeneratorAPIView(RequiredOrganizationIDMixin, generics.GenericAPIView):
 	permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
 	serializer_class = AIAdCopySerializer
@@ -190,6 +298,8 @@ class AIAdCopyGeneratorAPIView(RequiredOrganizationIDMixin, generics.GenericAPIV
 			return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 			
 		data = serializer.validated_data
+		if request.query_params.get('async') in ASYNC_TRUE_VALUES:
+			return Response(enqueue_ai_copy_job(request.user, 'ad_copy', dict(data)), status=status.HTTP_202_ACCEPTED)
 		generated_copy = generate_ad_copy(
 			product_service=data['product_service'],
 			target_audience=data['target_audience'],
@@ -199,6 +309,17 @@ class AIAdCopyGeneratorAPIView(RequiredOrganizationIDMixin, generics.GenericAPIV
 		
 		return Response({'Ad copy': generated_copy}, status=status.HTTP_200_OK)
 
+
+class AICopyJobAPIView(generics.GenericAPIView):
+	"""Polls an async AI copy job; the same payload is pushed over the websocket when it completes."""
+	permission_classes = [IsRegularPlatformUser]
+
+	def get(self, request, job_id, *args, **kwargs):
+		job = get_ai_copy_job(job_id, request.user)
+		if job is None:
+			return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+		return Response(job, status=status.HTTP_200_OK)
+
 @extend_schema(
 	parameters=[
 		OpenApiParameter(
@@ -213,26 +334,86 @@ class AIAdCopyGeneratorAPIView(RequiredOrganizationIDMixin, generics.GenericAPIV
 class AnalyticsAPIView(RequiredOrganizationIDMixin, generics.GenericAPIView):
 	permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
 
+	@staticmethod
+	def parse_date(value):
+		from datetime import datetime
+		if not value:
+			return None
+		try:
+			return datetime.strptime(str(value), '%Y-%m-%d').date()
+		except ValueError:
+			raise ValidationError({'date': 'Dates must use the YYYY-MM-DD format'})
+
+	@staticmethod
+	def parse_platform(value):
+		from .models import Platform
+		if not value:
+			return None
+		if value.upper() not in Platform.values:
+			raise ValidationError({'platform': f"Platform must be one of {', '.join(Platform.values)}"})
+		return value.upper()
+
 	def get(self, request, *args, **kwargs):
-		snowflake_id = self.get_org_id()
-		organization = Organization.objects.get(snowflake_id=snowflake_id, memberships__user=request.user)
-		campaigns = UnifiedCampaign.objects.filter(organization=organization)
-		integration = organization.integrations.filter(platform='TIKTOK').first()
-		if not integration:
-			return Response({'error': 'No TikTok integration found for this organization.'}, status=status.HTTP_400_BAD_REQUEST)
-		access_token = integration.access_token
-		from .utils.tiktok_handler import get_detailed_analytics as tiktok_analytics
+		organization = self.get_organization()
 		from django.utils import timezone
-		date = timezone.now().date().strftime("%Y-%m-%d")
-		data = tiktok_analytics(target_date=date)
-		from .utils.analytics import save_daily_analytics
-		save_daily_analytics(data, integration.ad_account_id, date)
+		from analysis.sync import get_sync_progress
+		from .utils.analytics import get_daily_analytics
+		date = self.parse_date(request.query_params.get('date')) or timezone.now().date()
+		platform = self.parse_platform(request.query_params.get('platform'))
 		analytics_data = {
-			'data': data
+			'data': get_daily_analytics(organization, date, platform=platform),
+			'sync': get_sync_progress(organization.snowflake_id)
 		}
 		
 		return Response(analytics_data, status=status.HTTP_200_OK)
 
+	def post(self, request, *args, **kwargs):
+		snowflake_id = self.get_org_id()
+		from analysis.tasks import sync_analytics_task
+		target_date = self.parse_date(request.data.get('date'))
+		sync_analytics_task.delay(org_id=snowflake_id, target_date=target_date.isoformat() if target_date else None)
+		return Response({'message': 'Analytics sync started.'}, status=status.HTTP_202_ACCEPTED)
+
+@extend_schema(
+	parameters=[
+		OpenApiParameter(
+			name="org_id",
+			type=OpenApiTypes.STR,
+			location=OpenApiParameter.QUERY,
+			required=True,
+			description="Organization Snowflake ID"
+		),
+		OpenApiParameter(name="start_date", type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY, description="Defaults to 30 days ago"),
+		OpenApiParameter(name="end_date", type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY, description="Defaults to today"),
+		OpenApiParameter(name="platform", type=OpenApiTypes.STR, location=OpenApiParameter.QUERY),
+		OpenApiParameter(name="campaign_id", type=OpenApiTypes.STR, location=OpenApiParameter.QUERY, description="Platform campaign id"),
+	]
+)
+class DeviceBreakdownAPIView(RequiredOrganizationIDMixin, generics.GenericAPIView):
+	permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
+
+	def get(self, request, *args, **kwargs):
+		from datetime import timedelta
+		from django.utils import timezone
+		from .utils.analytics import get_device_breakdown
+		organization = self.get_organization()
+
+		end_date = AnalyticsAPIView.parse_date(request.query_params.get('end_date')) or timezone.now().date()
+		start_date = AnalyticsAPIView.parse_date(request.query_params.get('start_date')) or end_date - timedelta(days=30)
+		if start_date > end_date:
+			raise ValidationError({'start_date': 'start_date must be before or equal to end_date'})
+
+		data = get_device_breakdown(
+			organization, start_date, end_date,
+			platform=AnalyticsAPIView.parse_platform(request.query_params.get('platform')),
+			campaign_id=request.query_params.get('campaign_id'),
+		)
+		return Response({
+			'start_date': start_date,
+			'end_date': end_date,
+			'data': data,
+		}, status=status.HTTP_200_OK)
+
 @extend_schema(
 	parameters=[
 		OpenApiParameter(
@@ -313,10 +494,7 @@ class TeamMemberListAPIView(RequiredOrganizationIDMixin, generics.ListAPIView):
 	permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
 
 	def get_queryset(self):
-		org_snowflake_id = self.get_org_id()
-		organization = Organization.objects.filter(snowflake_id=org_snowflake_id).first()
-		if not organization:
-			raise ValidationError({'org_id': 'Invalid organization id'})
+		organization = self.get_organization()
 		queryset = OrganizationMember.objects.filter(organization=organization).select_related('user')
 		return queryset
 
@@ -450,10 +628,7 @@ class IntegrationStatusAPIView(RequiredOrganizationIDMixin, generics.GenericAPIV
     permission_classes = [IsRegularPlatformUser, IsOrganizationMember]
 
     def get(self, request, *args, **kwargs):
-        snowflake_id = self.get_org_id()
-        organization = Organization.objects.filter(snowflake_id=snowflake_id).first()
-        if not organization:
-            raise ValidationError({'org_id': 'Invalid organization id'})
+        organization = self.get_organization()
         
         # show META, GOOGLE, TIKTOK integrations with their status and created at even if they are no objects for that platform
         integrations = []